@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+#=============================================================================
+#
+# file :        DualBenchmark.py
+#
+# description : Benchmarks of the polling engine and the VarianDUAL device,
+#            results are saved as JSON to compare between releases.
+#
+#            python DualBenchmark.py --output bench_output.txt
+#            python DualBenchmark.py --device test/vc/dual-01 --clients 8
+#            python DualBenchmark.py --device test/vc/dual-01 --write
+#            python DualBenchmark.py --serial test/serial/emulator
+#
+#            Engine benchmarks run DualPoller in-process against a
+#            DualEmulator; device benchmarks require a running VarianDUAL
+#            device (e.g. connected to a DualEmulator served by TCP); the
+#            serial line benchmark compares the legacy SerialVacuumDevice
+#            with DualPoller on a Tango Serial device (e.g. attached to the
+#            pty of python DualEmulator.py --pty).
+#
+# project :    VacuumController Device Server
+#
+# $Author: srubio $
+#
+# copyleft :    Cells / Alba Synchrotron
+#               Bellaterra
+#               Spain
+#
+############################################################################
+#
+# This file is part of Tango-ds.
+#
+# Tango-ds is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Tango-ds is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+##########################################################################
+
+import sys
+import time
+import json
+import socket
+import platform
+import threading
+
+from MultiGauge import MultiGaugeProtocol
+from DualEmulator import DualEmulator,DualEmulatorTransport
+
+def getPolledCommands(channels=((1,'HV'),(2,'HV'))):
+    """ (name,channel,command code,period) polled by VarianDUAL.init_device for the given ChannelTable """
+    from VarianDUAL import VarianDUAL
+    G,H = MultiGaugeProtocol.GeneralComms,MultiGaugeProtocol.HighVoltageCommands
+    commands = []
+    for period in (1.,10.,60.):
+        commands.extend((name,channel,G.get(comm,H.get(comm)),polling)
+            for name,channel,comm,polling,priority in VarianDUAL.GENERAL_READS if polling==period)
+        commands.extend((name%channel,channel,G.get(comm,H.get(comm)),polling)
+            for channel,kind in channels for name,comm,polling,priority in VarianDUAL.CHANNEL_READS[kind] if polling==period)
+    return commands
+
+def percentiles(values, points=(50,90,99)):
+    values = sorted(values)
+    if not values: return {}
+    result = dict(('p%d'%p,values[min((len(values)-1,int(len(values)*p/100.)))]) for p in points)
+    result.update({'min':values[0],'max':values[-1],'mean':sum(values)/len(values),'n':len(values)})
+    return result
+
+def newPoller(options, pipeline, commands=None):
+    from DualPoller import DualPoller
+    emulator = DualEmulator(latency=options.latency,jitter=options.jitter,baud=options.baud,seed=0)
+    emulator.hv = {1:1,2:1}
+    poller = DualPoller('DualEmulator',transport=DualEmulatorTransport(emulator),
+        pipeline=pipeline,log='WARNING')
+    for name,chann,comm,period in (commands or getPolledCommands()):
+        poller.setPolledComm(poller.packMultiGauge(chann,comm),period)
+    return poller
+
+def benchCycle(options):
+    """ Time needed to read all polled commands, for each pipeline size and number of commands """
+    results,commands = [],getPolledCommands()
+    for pipeline in options.pipelines:
+        for n in sorted(set((6,12,len(commands)))):
+            poller = newPoller(options,pipeline or n,commands[:n])
+            times = []
+            for i in range(options.cycles):
+                poller.polledNext = list(poller.readList)
+                t0 = time.time()
+                poller.readCycle()
+                times.append(time.time()-t0)
+            results.append({'pipeline':pipeline or n,'commands':n,'cycle':percentiles(times)})
+            print('cycle: pipeline=%s commands=%d p50=%1.4f s'%(pipeline or n,n,results[-1]['cycle']['p50']))
+    return results
+
+def benchRoundTrip(options):
+    """ Round trip of every polled command sent alone """
+    poller,results = newPoller(options,1),{}
+    for name,chann,comm,period in getPolledCommands():
+        frame,times = poller.packMultiGauge(chann,comm),[]
+        for i in range(options.repeat):
+            t0 = time.time()
+            poller.transaction([frame])
+            times.append(time.time()-t0)
+        results[name] = percentiles(times)
+    print('round trip: p50 of HV1 P = %1.4f s'%results['HV1 P']['p50'])
+    return results
+
+def benchSerialLine(options):
+    """
+    Legacy SerialVacuumDevice (Pipeline=0) and DualPoller polling the same commands through the
+    Tango Serial device options.serial: time until all commands are read once and age of the
+    last reply sampled every 10 ms while polling at the Refresh period
+    """
+    from VacuumController import SerialVacuumDevice
+    from DualPoller import DualPoller
+    SerialVacuumDevice.LogLevel = 'WARNING'
+    results = {}
+    for name,klass,kwargs in (('legacy',SerialVacuumDevice,{}),('pipelined',DualPoller,{'pipeline':8})):
+        svd = klass(tangoDevice=options.serial,period=options.refresh,wait=.2,retries=3,log='WARNING',**kwargs)
+        for n,chann,comm,period in getPolledCommands():
+            frame = MultiGaugeProtocol().packMultiGauge(chann,comm)
+            svd.addComm(frame)
+            svd.setPolledComm(frame,period)
+        t0 = time.time()
+        svd.start()
+        try:
+            while not svd.init and time.time()<t0+options.timeout: time.sleep(.01)
+            results[name] = {'all_read':time.time()-t0 if svd.init else None}
+            ages,end = [],time.time()+options.duration
+            while time.time()<end:
+                ages.append(time.time()-svd.lasttime)
+                time.sleep(.01)
+            results[name]['reply_age'] = percentiles(ages)
+        finally:
+            svd.stop()
+        print('serial line: %s read all commands in %s s'%(name,results[name]['all_read']))
+    return results
+
+def benchDevice(options):
+    """
+    Attribute throughput, always_executed_hook overhead, P1 read latency while
+    another client writes and On() to HV1Status=ON time of a running device
+    """
+    import PyTango
+    dp,results = PyTango.DeviceProxy(options.device),{}
+
+    counts,stop = [0]*options.clients,threading.Event()
+    def reader(i):
+        proxy = PyTango.DeviceProxy(options.device)
+        while not stop.isSet():
+            proxy.read_attribute('P1')
+            counts[i] += 1
+    threads = [threading.Thread(target=reader,args=(i,)) for i in range(options.clients)]
+    [t.start() for t in threads]
+    time.sleep(options.duration)
+    stop.set()
+    [t.join() for t in threads]
+    results['read_P1_per_second'] = sum(counts)/float(options.duration)
+    results['clients'] = options.clients
+
+    #ping does not execute always_executed_hook, State does
+    pings,states = [],[]
+    for i in range(options.repeat):
+        t0 = time.time(); dp.ping(); pings.append(time.time()-t0)
+        t0 = time.time(); dp.state(); states.append(time.time()-t0)
+    results['ping'],results['state'] = percentiles(pings),percentiles(states)
+    results['hook_overhead'] = results['state']['p50']-results['ping']['p50']
+
+    if options.write:
+        #The same pump types are written again and again, each write is confirmed by the device
+        value,writes = dp.read_attribute('IonPumpsConfig').value,[0]
+        def writer():
+            proxy = PyTango.DeviceProxy(options.device)
+            while not stop.isSet():
+                proxy.write_attribute('IonPumpsConfig',value)
+                writes[0] += 1
+        def latencies():
+            values = []
+            for i in range(options.repeat):
+                t0 = time.time(); dp.read_attribute('P1'); values.append(time.time()-t0)
+            return percentiles(values)
+        results['read_P1_idle'] = latencies()
+        stop.clear()
+        thread = threading.Thread(target=writer)
+        thread.start()
+        results['read_P1_writing'] = latencies()
+        stop.set()
+        thread.join()
+        results['writes'] = writes[0]
+        print('device: P1 read p99 %1.4f s idle, %1.4f s while writing'%(
+            results['read_P1_idle']['p99'],results['read_P1_writing']['p99']))
+
+    if options.switch:
+        dp.command_inout('OffHV1')
+        t0 = time.time()
+        dp.command_inout('OnHV1')
+        while time.time()<t0+options.timeout:
+            if dp.read_attribute('HV1Status').value.upper()=='ON': break
+            time.sleep(.01)
+        results['on_to_hv1status_on'] = time.time()-t0
+    print('device: %1.1f reads/s, hook overhead %1.4f s'%(results['read_P1_per_second'],results['hook_overhead']))
+    return results
+
+def main(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='VarianDUAL benchmarks')
+    parser.add_argument('--output',default='bench_output.txt',help='file to save the results (JSON)')
+    parser.add_argument('--pipelines',type=int,nargs='+',default=[1,4,8,0],help='burst sizes, 0 for all commands at once')
+    parser.add_argument('--cycles',type=int,default=20)
+    parser.add_argument('--repeat',type=int,default=50)
+    parser.add_argument('--refresh',type=float,default=3.,help='Refresh property of the serial line benchmark')
+    parser.add_argument('--latency',type=float,default=.01,help='emulator latency')
+    parser.add_argument('--jitter',type=float,default=.0,help='emulator jitter')
+    parser.add_argument('--baud',type=int,default=9600,help='emulator baud rate')
+    parser.add_argument('--device',default='',help='running VarianDUAL device to benchmark')
+    parser.add_argument('--serial',default='',help='Tango Serial device attached to a DualEmulator, to compare legacy and pipelined polling')
+    parser.add_argument('--clients',type=int,default=4,help='concurrent reading clients')
+    parser.add_argument('--duration',type=float,default=10.,help='seconds reading attributes')
+    parser.add_argument('--write',action='store_true',help='measure P1 read latency while another client writes IonPumpsConfig (device benchmark)')
+    parser.add_argument('--switch',action='store_true',help='switch HV1 off and on (device benchmark)')
+    parser.add_argument('--timeout',type=float,default=30.)
+    options = parser.parse_args(args)
+
+    results = {
+        'date':time.strftime('%Y-%m-%d %H:%M:%S'),
+        'host':socket.gethostname(),
+        'python':platform.python_version(),
+        'options':vars(options),
+        'cycle':benchCycle(options),
+        'round_trip':benchRoundTrip(options),
+        }
+    if options.serial:
+        results['serial_line'] = benchSerialLine(options)
+    if options.device:
+        results['device'] = benchDevice(options)
+    f = open(options.output,'w')
+    json.dump(results,f,indent=2,sort_keys=True)
+    f.close()
+    print('Results saved to %s'%options.output)
+    return results
+
+if __name__ == '__main__':
+    main()
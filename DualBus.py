@@ -0,0 +1,162 @@
+#=============================================================================
+#
+# file :        DualBus.py
+#
+# description : Arbitration of a serial line (RS-485 multi-drop or terminal
+#            server port) shared by several controllers, the devices using
+#            the same bus name get it in turns, also from different
+#            processes of the same host.
+#
+# project :    VacuumController Device Server
+#
+# $Author: srubio $
+#
+# copyleft :    Cells / Alba Synchrotron
+#               Bellaterra
+#               Spain
+#
+############################################################################
+#
+# This file is part of Tango-ds.
+#
+# Tango-ds is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Tango-ds is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+##########################################################################
+
+import os
+import re
+import time
+import fcntl
+import tempfile
+import threading
+
+class BusArbiter(object):
+    """
+    Serializes the transactions of all the owners (DualPoller objects) of a bus.
+
+    Inside a process the owners wait in a queue: an owner that releases the
+    bus goes to the end of it, so polling is interleaved fairly, and writes
+    are queued before the reads already waiting. Between processes the bus
+    is an exclusive flock() on a lock file named after the bus; a process
+    holds a shared lock on a second file for as long as it has writes
+    pending, making the reads of the other processes wait, and after each
+    release no owner of the process takes the bus again for a gap that
+    lets the other processes get it.
+    """
+    _arbiters = {}
+    _arbiters_lock = threading.Lock()
+
+    @classmethod
+    def get(klass, name, lockdir=None):
+        """ Arbiter shared by all the owners of the process using the bus name """
+        with klass._arbiters_lock:
+            if name not in klass._arbiters: klass._arbiters[name] = klass(name,lockdir)
+            return klass._arbiters[name]
+
+    def __init__(self, name, lockdir=None, gap=.005, timeout=10.):
+        self.name = name
+        self.gap = gap
+        self.timeout = timeout
+        self.path = os.path.join(lockdir or tempfile.gettempdir(),
+            'VarianDUAL.%s.lock'%re.sub('[^\w\-\.]','_',name))
+        self.busfile = open(self.path,'a')
+        self.writefile = open(self.path+'.w','a')
+        self.condition = threading.Condition()
+        self.owner = None
+        self.waiting = []
+        self.writers = set()
+        self.pending = False
+        self.released = 0
+        self.transactions = self.writes = self.busy = 0
+        self.waited = 0.
+
+    def flagWrites(self):
+        """ Holds the shared lock on the write file while there are writes pending """
+        if self.writers and not self.pending:
+            fcntl.flock(self.writefile,fcntl.LOCK_SH)
+            self.pending = True
+        elif self.pending and not self.writers:
+            fcntl.flock(self.writefile,fcntl.LOCK_UN)
+            self.pending = False
+
+    def lockBus(self, write):
+        """ Tries to get the lock file without blocking """
+        if not write:
+            #Reads wait while this or other process has a write pending
+            if self.pending: return False
+            try:
+                fcntl.flock(self.writefile,fcntl.LOCK_EX|fcntl.LOCK_NB)
+                fcntl.flock(self.writefile,fcntl.LOCK_UN)
+            except IOError:
+                return False
+        try:
+            fcntl.flock(self.busfile,fcntl.LOCK_EX|fcntl.LOCK_NB)
+            return True
+        except IOError:
+            return False
+
+    def acquire(self, owner, write=False, timeout=None):
+        """
+        Waits until owner gets the bus, returns False if it did not get it in timeout
+        seconds (self.timeout if None). With timeout=0 it never blocks and the owner
+        keeps its place in the queue until the next call or release().
+        """
+        t0 = time.time()
+        timeout = self.timeout if timeout is None else timeout
+        with self.condition:
+            if write and owner not in self.writers:
+                if owner in self.waiting: self.waiting.remove(owner)
+                self.waiting.insert(len([o for o in self.waiting if o in self.writers]),owner)
+                self.writers.add(owner)
+                self.flagWrites()
+            elif owner not in self.waiting:
+                self.waiting.append(owner)
+            while True:
+                if (self.owner is None and self.waiting[0] is owner
+                        and time.time()>=self.released+self.gap and self.lockBus(owner in self.writers)):
+                    break
+                remaining = t0+timeout-time.time()
+                if remaining<=0:
+                    if timeout:
+                        self.busy += 1
+                        self.waiting.remove(owner)
+                        self.writers.discard(owner)
+                        self.flagWrites()
+                    return False
+                #Other processes do not notify, the lock file is checked periodically
+                self.condition.wait(min((remaining,self.gap)))
+            self.waiting.remove(owner)
+            if owner in self.writers:
+                self.writers.discard(owner)
+                self.flagWrites()
+                self.writes += 1
+            self.owner = owner
+            self.transactions += 1
+            self.waited += time.time()-t0
+            return True
+
+    def release(self, owner):
+        """ Frees the bus, or removes the owner from the queue if it was waiting """
+        with self.condition:
+            if owner in self.waiting:
+                self.waiting.remove(owner)
+                self.writers.discard(owner)
+                self.flagWrites()
+            if self.owner is owner:
+                fcntl.flock(self.busfile,fcntl.LOCK_UN)
+                self.owner,self.released = None,time.time()
+            self.condition.notifyAll()
+
+    def getReport(self):
+        return 'Bus %s: %d transactions (%d writes), %1.4f s average wait, %d times busy'%(
+            self.name,self.transactions,self.writes,self.waited/(self.transactions or 1),self.busy)
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+#=============================================================================
+#
+# file :        DualEmulator.py
+#
+# description : Emulator of a Varian DUAL controller speaking the MultiGauge
+#            compatible protocol, to test and benchmark the device server
+#            without hardware.
+#
+#            python DualEmulator.py --pty                 #prints the pty name
+#            python DualEmulator.py --tcp 4001 --latency .02 --baud 9600
+#
+# project :    VacuumController Device Server
+#
+# $Author: srubio $
+#
+# copyleft :    Cells / Alba Synchrotron
+#               Bellaterra
+#               Spain
+#
+############################################################################
+#
+# This file is part of Tango-ds.
+#
+# Tango-ds is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Tango-ds is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+##########################################################################
+
+import os
+import sys
+import time
+import math
+import random
+import select
+import socket
+import threading
+
+from MultiGauge import MultiGaugeProtocol
+
+class ProtocolError(Exception):
+    """ Raised with the ProtocolErrors code to be answered """
+    pass
+
+class DualEmulator(MultiGaugeProtocol):
+    """
+    Emulates the commands of GeneralComms and HighVoltageCommands on two
+    High Voltage channels; interlocks and HV faults are set with
+    setInterlock/setFault and switch off the affected channels using the
+    OnOffCoding codes.
+
+    Timing is emulated by write()/read(): each answer becomes readable
+    after latency (+ random jitter) and the time needed to transmit it at
+    baud rate (10 bits per character), answers are sent one after another.
+
+    Fault injection probabilities:
+        drop: the request is not answered
+        corrupt: one character of the answer is replaced
+        split: the answer is made available in two separate reads
+    """
+
+    #Channels accepted by each command code
+    CHANNELS = {
+        10:(0,), 30:(1,2), 3:(0,), 5:(0,), 7:(1,2), 8:(1,2), 2:(1,2), 19:(0,1,2),
+        6:(0,), 1:(1,2), 11:(1,2), 12:(0,), 13:(0,),
+        60:(1,2), 61:(1,2), 63:(1,2), 66:(1,2), 71:(1,2), 72:(1,2),
+        }
+    #Commands that can only be read
+    READ_ONLY = (5,7,8,2,19,11,12,13)
+    #Commands that cannot be written while the channel is ON
+    CONFIG = (1,63,66,71,72)
+
+    INTERLOCKS = {
+        'PanelInterlock':('FrontPanel',(1,2)),
+        'HV1RemoteInterlock':('HV1RemoteIO',(1,)),
+        'HV2RemoteInterlock':('HV2RemoteIO',(2,)),
+        'HV1CableInterlock':('HV1Cable',(1,)),
+        'HV2CableInterlock':('HV2Cable',(2,)),
+        }
+
+    def __init__(self, latency=.01, jitter=0., baud=9600, drop=0., corrupt=0., split=0., seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.baud = baud
+        self.drop = drop
+        self.corrupt = corrupt
+        self.split = split
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.firmware = 'DUAL01.0'
+        self.mode = 0 #0=LOCAL, 1=REMOTE, 2=SERIAL
+        self.unit = 1
+        self.error = 0
+        self.interlock = 0
+        self.hv = {1:0,2:0} #OnOffCoding
+        self.step = {1:1,2:1}
+        self.protect = {1:1,2:1}
+        self.vmax = {1:7000,2:7000}
+        self.iprotect = {1:100,2:100}
+        self.setpoints = {1:[1e-6,1e-7],2:[1e-6,1e-7]}
+        self.pump = {1:1,2:1}
+        self.pressure = {1:2e-9,2:5e-9}
+
+        self.input = ''
+        self.output = [] #(due time, answer)
+        self.line_free = 0
+        self.requests = 0
+
+    #-------------------------------------------------------------------------
+    # Hardware emulation
+
+    def setInterlock(self, name, active=True):
+        """ name is one of INTERLOCKS keys """
+        bit,channels = self.INTERLOCKS[name]
+        mask = sum(v for k,v in self.InterlockStatus.items() if k==bit)
+        if active:
+            self.interlock |= mask
+            code = self.OnOffCoding['PanelInterlock' if bit=='FrontPanel'
+                else ('RemoteInterlock' if 'Remote' in bit else 'CableInterlock')]
+            for c in channels: self.hv[c] = code
+        else:
+            self.interlock &= ~mask
+            for c in channels:
+                if self.hv[c]<0: self.hv[c] = 0
+
+    def setFault(self, channel, fault):
+        """ fault is one of the negative OnOffCoding keys (HVProtect, HVTemperature, ...) """
+        self.hv[channel] = self.OnOffCoding[fault]
+        self.error = {'HVProtect':9,'HVTemperature':6,'HVShortCircuit':10}.get(fault,5)
+
+    def setPressure(self, channel, pressure):
+        self.pressure[channel] = pressure
+
+    def getPressure(self, channel):
+        self.pressure[channel] *= math.exp(self.random.gauss(0,.01))
+        return self.pressure[channel] if self.hv[channel]>0 else 0.
+
+    def getCurrent(self, channel):
+        #Around 0.1 A/mbar for a 150 l/s pump
+        return .1*self.getPressure(channel)
+
+    def getVoltage(self, channel):
+        if self.hv[channel]<=0: return 0
+        if not self.step[channel]: return self.vmax[channel]
+        return 3000 if self.pressure[channel]>1e-6 else (5000 if self.pressure[channel]>1e-8 else 7000)
+
+    #-------------------------------------------------------------------------
+    # Protocol
+
+    def formatExponential(self, value):
+        mantissa,exponent = ('%1.1E'%value).split('E')
+        return '%sE%s%02d'%(mantissa,exponent[0],abs(int(exponent)))
+
+    def readValue(self, chann, comm):
+        if comm==10: return '%d'%self.mode
+        if comm==30: return '%d'%self.hv[chann]
+        if comm==3: return '%d'%self.unit
+        if comm==5: return self.firmware
+        if comm==7: return '%05d'%self.getVoltage(chann)
+        if comm==8: return self.formatExponential(self.getCurrent(chann))
+        if comm==2: return self.formatExponential(self.getPressure(chann))
+        if comm==19: return '%05d'%self.error
+        if comm==1: return chr(0x30+self.pump[chann])
+        if comm==11: return self.DeviceTypes[self.pump[chann]]
+        if comm==12: return '0'
+        if comm==13: return '{0:08b}'.format(self.interlock)
+        if comm==60: return '%d'%self.step[chann]
+        if comm==61: return '%d'%self.protect[chann]
+        if comm==63: return '%05d'%self.vmax[chann]
+        if comm==66: return '%05d'%self.iprotect[chann]
+        if comm in (71,72): return self.formatExponential(self.setpoints[chann][comm-71])
+        raise ProtocolError('2')
+
+    def writeValue(self, chann, comm, data):
+        if comm in self.READ_ONLY: raise ProtocolError('4')
+        if comm not in (10,6) and self.mode!=2: raise ProtocolError(':')
+        if comm in self.CONFIG and self.hv[chann]>0: raise ProtocolError('8')
+        try:
+            if comm in (10,30,3,60,61):
+                value = self.decodeStatus(data)
+                if value not in {10:(0,1,2),3:(0,1,2)}.get(comm,(0,1)): raise ProtocolError('6')
+            elif comm in (63,66):
+                #Written values must have the 5 digits of the format
+                if len(data)!=5 or not data.isdigit(): raise ProtocolError('5')
+                value = self.decodeInteger(data)
+            elif comm in (71,72): value = self.decodeExponential(data)
+            elif comm==1: value = ord(data)-0x30 if len(data)==1 else -1
+            else: value = data
+        except ValueError:
+            raise ProtocolError('5')
+        if comm==10: self.mode = value
+        elif comm==6: self.error = 0
+        elif comm==3: self.unit = value
+        elif comm==30:
+            if value and self.hv[chann]<0: raise ProtocolError('5')
+            self.hv[chann] = value
+        elif comm==60: self.step[chann] = value
+        elif comm==61: self.protect[chann] = value
+        elif comm==63:
+            if not 3000<=value<=7000 or value%100: raise ProtocolError('6')
+            self.vmax[chann] = value
+        elif comm==66:
+            if not 10<=value<=100 or value%10: raise ProtocolError('6')
+            self.iprotect[chann] = value
+        elif comm in (71,72):
+            if not 1e-9<=value<=10.: raise ProtocolError('6')
+            self.setpoints[chann][comm-71] = value
+        elif comm==1:
+            if not 0<=value<len(self.DeviceTypes): raise ProtocolError('6')
+            self.pump[chann] = value
+
+    def process(self, frame):
+        """ Returns the answer to a single request frame (without TERM) """
+        self.requests += 1
+        try:
+            if len(frame)<5 or frame[0]!=self.ASK or not frame[1:4].isdigit():
+                raise ProtocolError('7')
+            chann,comm,data = int(frame[1]),int(frame[2:4]),frame[4:]
+            if comm not in self.CHANNELS: raise ProtocolError('2')
+            if chann not in self.CHANNELS[comm]: raise ProtocolError('3')
+            if data==self.READ:
+                return self.ANSWER+frame[1:4]+self.readValue(chann,comm)+self.TERM
+            self.writeValue(chann,comm,data)
+            return self.ACK
+        except ProtocolError,e:
+            return self.NACK+str(e)
+
+    #-------------------------------------------------------------------------
+    # Timing
+
+    def write(self, data, now=None):
+        """ Receives characters from the line, answers will be available to read() """
+        now = now or time.time()
+        with self.lock:
+            self.input += data
+            frames = self.input.split(self.TERM)
+            self.input = frames.pop(-1)
+            for frame in frames:
+                if not frame: continue
+                answer = self.process(frame)
+                if self.drop and self.random.random()<self.drop: continue
+                if self.corrupt and self.random.random()<self.corrupt:
+                    i = self.random.randrange(len(answer))
+                    answer = answer[:i]+chr(self.random.randint(0x20,0x7e))+answer[i+1:]
+                start = max((now+self.latency+self.random.uniform(0,self.jitter),self.line_free))
+                self.line_free = start+(10.*len(answer)/self.baud if self.baud else 0)
+                if self.split and len(answer)>1 and self.random.random()<self.split:
+                    i = self.random.randrange(1,len(answer))
+                    self.output.append(((start+self.line_free)/2.,answer[:i]))
+                    self.output.append((self.line_free,answer[i:]))
+                else:
+                    self.output.append((self.line_free,answer))
+
+    def read(self, now=None):
+        """ Returns the characters already transmitted """
+        now = now or time.time()
+        with self.lock:
+            ready = [a for t,a in self.output if t<=now]
+            self.output = self.output[len(ready):]
+            return ''.join(ready)
+
+    def nextTime(self):
+        with self.lock:
+            return self.output[0][0] if self.output else None
+
+    #-------------------------------------------------------------------------
+    # Servers
+
+    def serve(self, fd, stop=None):
+        """ Answers requests received on a file descriptor until closed or stop is set """
+        while not (stop and stop.isSet()):
+            due = self.nextTime()
+            timeout = .1 if due is None else max((0,min((.1,due-time.time()))))
+            r,w,e = select.select([fd],[],[],timeout)
+            if r:
+                data = os.read(fd,1024)
+                if not data: break
+                self.write(data)
+            data = self.read()
+            if data: os.write(fd,data)
+
+    def servePty(self, stop=None):
+        import tty
+        master,slave = os.openpty()
+        tty.setraw(slave)
+        print('DualEmulator listening at %s'%os.ttyname(slave))
+        sys.stdout.flush()
+        try: self.serve(master,stop)
+        finally: os.close(master)
+
+    def serveTcp(self, port, host='localhost', stop=None):
+        """ Accepts one client at a time, like a terminal server port """
+        server = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+        server.bind((host,port))
+        server.listen(1)
+        print('DualEmulator listening at %s:%d'%(host,port))
+        sys.stdout.flush()
+        while not (stop and stop.isSet()):
+            r,w,e = select.select([server],[],[],.1)
+            if not r: continue
+            client,address = server.accept()
+            try: self.serve(client.fileno(),stop)
+            finally: client.close()
+        server.close()
+
+class DualEmulatorTransport(object):
+    """ In-process transport (same interface as DualPoller transports) connected to a DualEmulator """
+    def __init__(self, emulator=None):
+        self.name = 'DualEmulator'
+        self.emulator = emulator or DualEmulator()
+
+    def write(self, data):
+        self.emulator.write(data)
+
+    def read(self):
+        return self.emulator.read()
+
+    def flush(self):
+        self.emulator.read(now=float('inf'))
+
+    def wait(self, timeout):
+        next = self.emulator.nextTime()
+        if next is not None: timeout = min((timeout,next-time.time()))
+        if timeout>0: time.sleep(timeout)
+
+def main(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Varian DUAL controller emulator')
+    parser.add_argument('--pty',action='store_true',help='listen on a new pseudo terminal')
+    parser.add_argument('--tcp',type=int,default=0,help='listen on a TCP port')
+    parser.add_argument('--host',default='localhost')
+    parser.add_argument('--latency',type=float,default=.01,help='seconds before answering')
+    parser.add_argument('--jitter',type=float,default=0.,help='max random seconds added to latency')
+    parser.add_argument('--baud',type=int,default=9600,help='line speed, 0 for no limit')
+    parser.add_argument('--drop',type=float,default=0.,help='probability of not answering')
+    parser.add_argument('--corrupt',type=float,default=0.,help='probability of corrupting an answer')
+    parser.add_argument('--split',type=float,default=0.,help='probability of splitting an answer')
+    parser.add_argument('--interlock',action='append',default=[],help='one of %s'%','.join(DualEmulator.INTERLOCKS))
+    parser.add_argument('--on',action='store_true',help='start with both channels ON')
+    options = parser.parse_args(args)
+    emulator = DualEmulator(latency=options.latency,jitter=options.jitter,baud=options.baud,
+        drop=options.drop,corrupt=options.corrupt,split=options.split)
+    if options.on: emulator.hv = {1:1,2:1}
+    for i in options.interlock: emulator.setInterlock(i)
+    if options.tcp: emulator.serveTcp(options.tcp,options.host)
+    else: emulator.servePty()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#=============================================================================
+#
+# file :        DualHistory.py
+#
+# description : Fixed size buffers keeping the recent values read from the
+#            controller, and rolling statistics of them, filled by the
+#            polling thread.
+#
+# project :    VacuumController Device Server
+#
+# $Author: srubio $
+#
+# copyleft :    Cells / Alba Synchrotron
+#               Bellaterra
+#               Spain
+#
+############################################################################
+#
+# This file is part of Tango-ds.
+#
+# Tango-ds is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Tango-ds is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+##########################################################################
+
+import math
+import time
+import threading
+import collections
+
+import numpy
+
+from DualPoller import RunningStats
+
+class HistoryBuffer(object):
+    """
+    Ring buffer of (timestamp,value) rows stored in a preallocated array,
+    appending a value does not allocate memory.
+    """
+    def __init__(self, capacity=3600):
+        self.capacity = max((1,capacity))
+        self.data = numpy.zeros((self.capacity,2))
+        self.index = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, date, value):
+        with self.lock:
+            self.data[self.index] = date,value
+            self.index = (self.index+1)%self.capacity
+            self.count = min((self.count+1,self.capacity))
+
+    def get(self, since=0):
+        """ Returns a copy of the rows with timestamp>=since in chronological order """
+        with self.lock:
+            if self.count<self.capacity: rows = self.data[:self.count].copy()
+            else: rows = numpy.roll(self.data,-self.index,axis=0)
+        if since:
+            rows = rows[numpy.searchsorted(rows[:,0],since):]
+        return rows
+
+    def clear(self):
+        with self.lock:
+            self.index = self.count = 0
+
+class TrendStats(object):
+    """ Slope of the least squares line of (t,y) pairs in constant memory, mergeable like RunningStats """
+    def __init__(self):
+        self.n,self.t,self.y,self.m2,self.c = 0,0.,0.,0.,0.
+
+    def add(self, t, y):
+        self.n += 1
+        dt = t-self.t
+        self.t += dt/self.n
+        self.y += (y-self.y)/self.n
+        self.m2 += dt*(t-self.t)
+        self.c += dt*(y-self.y)
+
+    def merge(self, other):
+        if not other.n: return self
+        n = self.n+other.n
+        dt,dy = other.t-self.t,other.y-self.y
+        self.m2 += other.m2+dt*dt*self.n*other.n/n
+        self.c += other.c+dt*dy*self.n*other.n/n
+        self.t += dt*other.n/n
+        self.y += dy*other.n/n
+        self.n = n
+        return self
+
+    @property
+    def slope(self):
+        return self.c/self.m2 if self.m2>0 else 0.
+
+class WindowStats(object):
+    """
+    Statistics of the values received in the last window seconds. The window is
+    split in buckets, adding a value updates only the last bucket (Welford) and
+    buckets older than the window are dropped, so the window moves in steps of
+    window/buckets seconds; reading merges the buckets left.
+    """
+    def __init__(self, window, buckets=10):
+        self.window = window
+        self.size = window/float(buckets)
+        self.buckets = collections.deque() #(start,RunningStats,TrendStats)
+        self.lock = threading.Lock()
+
+    def expire(self, now):
+        while self.buckets and self.buckets[0][0]+self.size<=now-self.window:
+            self.buckets.popleft()
+
+    def add(self, date, value):
+        with self.lock:
+            if not self.buckets or self.buckets[-1][0]+self.size<=date:
+                self.buckets.append((date-date%self.size,RunningStats(),TrendStats()))
+                self.expire(date)
+            start,stats,trend = self.buckets[-1]
+            stats.add(value)
+            #The rate is relative to the value, only positive values are used
+            if value>0: trend.add(date,math.log(value))
+
+    def get(self, now=None):
+        """ Returns [window, n, mean, std, min, max, d(log value)/dt], NaN if no values """
+        stats,trend = RunningStats(),TrendStats()
+        with self.lock:
+            self.expire(now or time.time())
+            for start,s,t in self.buckets:
+                stats.merge(s)
+                trend.merge(t)
+        if not stats.n: return [self.window,0]+[float('nan')]*5
+        return [self.window,stats.n,stats.mean,stats.std,float(stats.min),float(stats.max),trend.slope]
+
+class RollingStats(object):
+    """ WindowStats of the same values for several windows """
+    def __init__(self, windows=(10.,60.,600.), buckets=10):
+        self.windows = [WindowStats(w,buckets) for w in windows]
+
+    def add(self, date, value):
+        for w in self.windows: w.add(date,value)
+
+    def get(self, now=None):
+        """ Rows of WindowStats.get() of each window in a flat list """
+        now = now or time.time()
+        return [v for w in self.windows for v in w.get(now)]
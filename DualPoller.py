@@ -0,0 +1,858 @@
+#=============================================================================
+#
+# file :        DualPoller.py
+#
+# description : Pipelined polling engine for MultiGauge compatible controllers.
+#            It replaces the one-by-one polling of SerialVacuumDevice by bursts
+#            of frames written at once, demultiplexing the answers by channel
+#            and command code.
+#
+# project :    VacuumController Device Server
+#
+# $Author: srubio $
+#
+# copyleft :    Cells / Alba Synchrotron
+#               Bellaterra
+#               Spain
+#
+############################################################################
+#
+# This file is part of Tango-ds.
+#
+# Tango-ds is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Tango-ds is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+##########################################################################
+
+import os
+import time
+import fcntl
+import bisect
+import select
+import threading
+import traceback
+
+from fandango.log import Logger
+
+from MultiGauge import MultiGaugeProtocol,MultiGaugeParser
+
+class TangoSerialTransport(object):
+    """
+    Raw access to a Tango Serial device server (DevSerWriteString/DevSerReadRaw),
+    the writes are not followed by an implicit read so several frames can be
+    on the line at the same time.
+    """
+    #Every call waits for the Serial device server (up to its client timeout)
+    blocking = True
+
+    def __init__(self, tangoDevice):
+        import PyTango
+        self.name = tangoDevice
+        self.dp = PyTango.DeviceProxy(tangoDevice)
+
+    def write(self, data):
+        self.dp.command_inout('DevSerWriteString',data)
+
+    def read(self):
+        return self.dp.command_inout('DevSerReadRaw') or ''
+
+    def flush(self):
+        self.dp.command_inout('DevSerFlush',2)
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+
+class BlackBox(object):
+    """ Keeps the last N frames exchanged with the hardware """
+    def __init__(self, size=0):
+        self.size = size
+        self.buffer = []
+
+    def append(self, direction, data):
+        if not self.size: return
+        self.buffer.append((time.time(),direction,data))
+        if len(self.buffer)>self.size: self.buffer.pop(0)
+
+    def to_string(self):
+        return '\n'.join('%s %s %s'%(time.strftime('%H:%M:%S',time.localtime(t)),d,repr(s))
+            for t,d,s in self.buffer)
+
+    def save(self, filename):
+        f = open(filename,'w')
+        f.write(self.to_string())
+        f.close()
+
+class RunningStats(object):
+    """ Count, mean, standard deviation, min and max of a series in constant memory (Welford) """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n,self.mean,self.m2 = 0,0.,0.
+        self.min = self.max = None
+
+    def add(self, value):
+        self.n += 1
+        delta = value-self.mean
+        self.mean += delta/self.n
+        self.m2 += delta*(value-self.mean)
+        self.min = value if self.min is None else min((self.min,value))
+        self.max = value if self.max is None else max((self.max,value))
+
+    def merge(self, other):
+        """ Adds the values counted by other RunningStats (Chan's parallel algorithm) """
+        if not other.n: return self
+        n = self.n+other.n
+        delta = other.mean-self.mean
+        self.m2 += other.m2+delta*delta*self.n*other.n/n
+        self.mean += delta*other.n/n
+        self.n = n
+        self.min = other.min if self.min is None else min((self.min,other.min))
+        self.max = other.max if self.max is None else max((self.max,other.max))
+        return self
+
+    @property
+    def std(self):
+        return (self.m2/(self.n-1))**.5 if self.n>1 else 0.
+
+    def __str__(self):
+        if not self.n: return 'n=0'
+        return 'n=%d mean=%1.4f std=%1.4f min=%1.4f max=%1.4f'%(self.n,self.mean,self.std,self.min,self.max)
+
+class LatencyHistogram(object):
+    """ Latencies counted in fixed logarithmic bins (from 1 ms to ~16 s, x1.41 each) """
+    BINS = [.001*2**(i/2.) for i in range(29)]
+
+    def __init__(self):
+        self.counts = [0]*(len(self.BINS)+1)
+        self.n = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.BINS,value)] += 1
+        self.n += 1
+
+    def percentile(self, p):
+        """ Upper limit of the bin containing the percentile p """
+        if not self.n: return 0.
+        target,count = p*self.n/100.,0
+        for i,c in enumerate(self.counts):
+            count += c
+            if count>=target: return self.BINS[min((i,len(self.BINS)-1))]
+        return self.BINS[-1]
+
+class CommandStats(object):
+    """ Counters of a single command """
+    def __init__(self):
+        self.requests = self.replies = self.timeouts = 0
+        self.nacks = {}
+        self.latency = LatencyHistogram()
+
+    def add(self, answer, latency):
+        self.requests += 1
+        if answer is None:
+            self.timeouts += 1
+        elif answer[1]==MultiGaugeProtocol.NACK:
+            self.nacks[answer[2]] = self.nacks.get(answer[2],0)+1
+        else:
+            self.replies += 1
+            self.latency.add(latency)
+
+    def __str__(self):
+        return 'requests=%d replies=%d timeouts=%d nacks=%s p50=%1.3f p90=%1.3f p99=%1.3f'%(
+            self.requests,self.replies,self.timeouts,
+            ','.join('%s:%d'%i for i in sorted(self.nacks.items())) or 0,
+            self.latency.percentile(50),self.latency.percentile(90),self.latency.percentile(99))
+
+class Burst(object):
+    """ Frames written at once and the answers received for each of them """
+    def __init__(self, frames, keys, wait, write=False):
+        self.frames = frames
+        self.keys = keys
+        self.write = write
+        self.pending = list(range(len(frames)))
+        self.answers = [None]*len(frames)
+        self.received = [0]*len(frames)
+        self.start = time.time()
+        self.timeout = self.start+wait*len(frames)
+        self.future = None
+
+class Future(object):
+    """ Reply to a frame sent through the write lane of DualPoller """
+    def __init__(self, frame):
+        self.frame = frame
+        self.attempts = 0
+        self.answer = self.exception = None
+        self.event = threading.Event()
+
+    def set(self, answer=None, exception=None):
+        self.answer,self.exception = answer,exception
+        self.event.set()
+
+    def done(self):
+        return self.event.isSet()
+
+    def result(self, timeout=None):
+        """ Waits for the reply (without terminator), raises the exception of a failed write """
+        if not self.event.wait(timeout):
+            raise Exception('DualPoller: no reply to %s after %s s'%(repr(self.frame),timeout))
+        if self.exception is not None:
+            raise self.exception
+        return self.answer
+
+class DualPoller(Logger, MultiGaugeProtocol):
+    """
+    Polling thread that provides the same interface used by VarianDUAL on
+    SerialVacuumDevice (addComm, setPolledComm, setPolledNext, getComm,
+    serialComm, start, stop, getReport, ...).
+
+    Each polled command has a base period and a priority; its deadline is
+    the last reply time plus the base period multiplied by an adaptive
+    factor (within factors): the factor is halved when a reply changes
+    (according to changeCheck(comm,old,new) if set) and grows slowly
+    while the replies do not change. setPolledComm can set other factors
+    for a command, e.g. (1.,1.) to poll it always at its base period. Commands passed to boost() are polled
+    at the minimum factor for a while, commands passed to suspend() are
+    only polled at a keep-alive period until resume() or boost() are
+    called for them. When budget (frames per second) is
+    set the due commands are sent by priority and deadline order until
+    the budget is exhausted.
+
+    Writes (submit or addComm with value) are queued in a write lane that
+    is sent before the next polling burst, each one returns a Future with
+    its reply; the polling is never stopped to write.
+
+    All the due commands of a cycle are written in bursts of up to
+    pipeline frames, the replies are matched to its request using the
+    channel/command code of the '>' answers; ACK/NACK answers (that do
+    not carry a code) are assigned to the oldest request still pending.
+
+    The answers are rebuilt from the stream by MultiGaugeParser, so split
+    or concatenated frames are not lost. The cached replies keep the
+    SerialVacuumDevice format: the '>' header and the terminator are
+    removed, so data starts at position 3.
+
+    If an engine (DualEngine) is passed the poller does not create its own
+    thread, start() registers it in the engine that calls step() instead.
+    Blocking transports (TangoSerialTransport) are never polled by an
+    engine: a slow or dead Serial device would stop the polling of every
+    other device in the process, so they keep their own thread.
+    If an arbiter (DualBus.BusArbiter) is passed, every burst is sent only
+    after getting the bus, that is released when the burst finishes.
+    """
+    #Key of the stats shared by all the frames that are not polled
+    WRITES = 'writes'
+
+    def __init__(self, tangoDevice, period=.1, wait=.2, retries=3, log='INFO',
+            blackbox=0, pipeline=8, transport=None, engine=None, arbiter=None):
+        Logger.__init__(self,'DualPoller(%s)'%tangoDevice,level=log)
+        self.tangoDevice = tangoDevice
+        self.transport = transport or TangoSerialTransport(tangoDevice)
+        self.period = period
+        self.wait = wait
+        self.retries = retries
+        self.pipeline = max((1,pipeline))
+        self.blackbox = BlackBox(blackbox)
+        self.parser = MultiGaugeParser()
+
+        self.readList = []
+        self.pollingList = {}
+        self.writeList = []
+        self.comms = {}
+        self.lastRead = {}
+        self.polledNext = []
+        self.listeners = []
+        self.batch_listeners = []
+        self.conditions = {}
+
+        self.priorities = {}
+        self.factor = {}
+        self.factors = (.25,4.)
+        self.limits = {}
+        self.boosted = {}
+        self.suspended = {}
+        self.changeCheck = None
+        self.budget = 0
+        self.tokens = 0
+        self.last_tokens = 0
+        self.wake_event = threading.Event()
+
+        self.init = False
+        self.errors = 0
+        self.lasttime = 0
+        self.cycles = 0
+        self.cycletime = 0
+        self.stats = {}
+        self.cycle_stats = RunningStats()
+        self.jitter_stats = RunningStats()
+        self.last_cycle = 0
+        self.lock = threading.RLock()
+        self.stop_event = threading.Event()
+        self.updateThread = None
+        #Engine mode, the polling is done by DualEngine.step() calls
+        if engine is not None and getattr(self.transport,'blocking',False):
+            self.warning('%s is a blocking transport, it is polled from its own thread instead of DualEngine'%tangoDevice)
+            engine = None
+        self.engine = engine
+        self.burst = None
+        self.queue = None
+        #Serial line shared with other controllers (DualBus.BusArbiter)
+        self.arbiter = arbiter
+
+    @property
+    def Alive(self):
+        if self.engine is not None:
+            return self.engine.Alive and self in self.engine.pollers
+        return bool(self.updateThread and self.updateThread.isAlive())
+
+    def addComm(self, comm, value=None):
+        """
+        Without value the command is added to the read list,
+        with value it will be written once in the next slot (returns a Future).
+        """
+        if value is not None:
+            return self.submit(comm)
+        elif comm not in self.readList:
+            self.readList.append(comm)
+            self.comms[comm] = None
+            self.lastRead[comm] = 0
+            self.conditions[comm] = threading.Condition()
+
+    def submit(self, comm):
+        """
+        Queues comm to be sent before the next polling burst and returns a Future
+        with its reply; if the poller is not running it is sent immediately.
+        """
+        future = Future(comm)
+        if not self.Alive:
+            try: future.set(self.serialComm(comm))
+            except Exception,e: future.set(exception=e)
+        else:
+            self.writeList.append(future)
+            self.wake_event.set()
+        return future
+
+    def waitComm(self, comm, since=None, timeout=None):
+        """
+        Forces the read of comm and returns the first reply received after since
+        (now by default), None if it is not received before timeout. The reply
+        has the format of getComm; commands not polled are sent through submit.
+        """
+        since = time.time() if since is None else since
+        timeout = self.getWriteTimeout()+self.period if timeout is None else timeout
+        if comm not in self.readList:
+            try: reply = self.submit(comm).result(timeout)
+            except: return None
+            return reply[1:] if reply.startswith(self.ANSWER) else None
+        end = time.time()+timeout
+        condition = self.conditions[comm]
+        self.setPolledNext(comm)
+        with condition:
+            while self.lastRead[comm]<=since:
+                remaining = end-time.time()
+                if remaining<=0: return None
+                condition.wait(remaining)
+            return self.comms[comm]
+
+    def getWriteTimeout(self, n=1):
+        """ Max time to reply n writes: the burst in flight plus all the retries """
+        timeout = self.wait*(self.pipeline+self.retries*(len(self.writeList)+n))+1.
+        if self.arbiter: timeout += self.arbiter.timeout
+        return timeout
+
+    def setPolledComm(self, comm, period, priority=0, factors=None):
+        """ factors=(min,max) replaces self.factors for this command, None in either keeps the default """
+        if comm not in self.readList: self.addComm(comm)
+        self.pollingList[comm] = period
+        self.priorities[comm] = priority
+        if factors: self.limits[comm] = factors
+        else: self.limits.pop(comm,None)
+
+    def setPolledNext(self, comm):
+        if comm not in self.polledNext: self.polledNext.append(comm)
+        self.wake_event.set()
+
+    def boost(self, comms, duration=30.):
+        """ Polls comms at the minimum period during duration seconds """
+        until = time.time()+duration
+        for comm in comms: self.boosted[comm] = until
+        self.wake_event.set()
+
+    def suspend(self, comms, period=30.):
+        """ Polls comms only every period seconds (e.g. values of a channel switched off) """
+        for comm in comms: self.suspended[comm] = period
+
+    def resume(self, comms):
+        """ Restores the normal polling of suspended comms, reading them in the next cycle """
+        for comm in comms:
+            if self.suspended.pop(comm,None) is not None: self.setPolledNext(comm)
+
+    def getPeriod(self, comm, now=None):
+        """ Current polling period of a command, the base period multiplied by its adaptive factor """
+        period = self.pollingList.get(comm,0)
+        if self.boosted.get(comm,0)>(now or time.time()): return period*self.getFactors(comm)[0]
+        if comm in self.suspended: return max((period,self.suspended[comm]))
+        return period*self.factor.get(comm,1.)
+
+    def getFactors(self, comm):
+        """ (min,max) adaptive factors of a command """
+        low,high = self.limits.get(comm,(None,None))
+        return (self.factors[0] if low is None else low),(self.factors[-1] if high is None else high)
+
+    def adapt(self, comm, changed):
+        low,high = self.getFactors(comm)
+        factor = self.factor.get(comm,1.)
+        if changed: factor = max((low,factor*.5))
+        else: factor = min((high,factor*1.1))
+        self.factor[comm] = factor
+
+    def addListener(self, callback, batch=False):
+        """
+        callback(comm,reply,date) will be called from the polling thread for every new reply;
+        with batch=True, callback([(comm,reply,date),...]) is called once with all the replies of a burst
+        """
+        listeners = self.batch_listeners if batch else self.listeners
+        if callback not in listeners: listeners.append(callback)
+
+    def getComm(self, comm):
+        return self.comms.get(comm)
+
+    def getReport(self):
+        return 'Pipelined polling of %d commands (%d per burst): %d cycles, last took %1.3f s, %d errors, last read at %s'%(
+            len(self.readList),self.pipeline,self.cycles,self.cycletime,self.errors,
+            time.ctime(self.lasttime) if self.lasttime else 'never')
+
+    def resetStats(self):
+        self.stats = {}
+        self.cycle_stats.reset()
+        self.jitter_stats.reset()
+
+    def getStats(self, comm):
+        """ Stats of a polled command, all the other frames (writes, SendCommand) share the WRITES entry """
+        if comm not in self.comms: comm = self.WRITES
+        if comm not in self.stats: self.stats[comm] = CommandStats()
+        return self.stats[comm]
+
+    def getFrameKey(self, frame):
+        """ (channel,command) pair of a request frame """
+        return int(frame[1]),int(frame[2:4])
+
+    def fileno(self):
+        """ Descriptor that gets readable when answers to the burst in flight arrive, None if not available """
+        if self.burst is None: return None
+        return getattr(self.transport,'fd',None)
+
+    def getNextStep(self, now):
+        """ Time to check the burst in flight, DualEngine wakes sooner if fileno() gets readable """
+        if self.burst is not None and self.fileno() is not None: return self.burst.timeout
+        return now+self.engine.interval
+
+    def getNextDeadline(self, now=None):
+        now = now or time.time()
+        if self.polledNext or self.writeList: return now
+        return min([self.lastRead[c]+self.getPeriod(c,now) for c in self.readList] or [now+1.])
+
+    def getDueComms(self, now=None):
+        """ Commands forced by setPolledNext first, then by priority and deadline, limited by budget """
+        now = now or time.time()
+        forced = [c for c in self.polledNext if c in self.readList]
+        due = sorted(((-self.priorities.get(c,0),self.lastRead[c]+self.getPeriod(c,now),c) 
+            for c in self.readList if c not in forced and now>=self.lastRead[c]+self.getPeriod(c,now)))
+        due = forced+[c for p,d,c in due]
+        if self.budget:
+            self.tokens = min((self.budget,self.tokens+self.budget*(now-self.last_tokens)))
+            self.last_tokens = now
+            due = due[:max((len(forced),int(self.tokens)))]
+            self.tokens -= len(due)
+        return due
+
+    def beginBurst(self, frames, write=False):
+        """ Writes all frames at once, the answers are collected by pollBurst """
+        self.blackbox.append('>>',''.join(frames))
+        self.transport.write(''.join(frames))
+        return Burst(frames,[self.getFrameKey(f) for f in frames],self.wait,write)
+
+    def pollBurst(self, burst):
+        """ Reads the available data, returns True once all answers are received or the burst timed out """
+        data = self.transport.read()
+        if data:
+            self.blackbox.append('<<',data)
+            for r in self.parser.feed(data):
+                i = None
+                if r[0] is not None:
+                    i = next((j for j in burst.pending if burst.keys[j]==r[:2]),None)
+                elif burst.pending:
+                    i = burst.pending[0]
+                if i is None:
+                    self.debug('Unexpected answer: %s'%repr(r))
+                else:
+                    burst.answers[i],burst.received[i] = r,time.time()
+                    burst.pending.remove(i)
+        if burst.pending and time.time()<burst.timeout:
+            return False
+        for f,r,t in zip(burst.frames,burst.answers,burst.received):
+            self.getStats(f).add(r,t-burst.start)
+        return True
+
+    def endBurst(self, burst):
+        """ Processes the answers of a burst sent by step() """
+        if not burst.write:
+            self.processAnswers(burst.frames,burst.answers)
+        elif burst.answers[0] is not None:
+            burst.future.set(self.packAnswer(*burst.answers[0]))
+        else:
+            #Failed writes are retried before any other frame is sent
+            burst.future.attempts += 1
+            if burst.future.attempts<self.retries:
+                self.writeList.insert(0,burst.future)
+            else:
+                self.warning('Write %s failed: no answer received'%repr(burst.frames[0]))
+                burst.future.set(exception=Exception('DualPoller.step(%s): No answer received'%repr(burst.frames[0])))
+
+    def completeBurst(self):
+        """ Waits for the burst that step() left in flight, so the line can be used synchronously """
+        with self.lock:
+            burst = self.burst
+            if burst is None: return
+            try:
+                while not self.pollBurst(burst): self.transport.wait(.01)
+            except:
+                self.warning('Burst failed: %s'%traceback.format_exc())
+            self.burst = None
+            if self.arbiter: self.arbiter.release(self)
+            self.endBurst(burst)
+
+    def transaction(self, frames, write=False):
+        """
+        Writes all frames at once and returns a list with the (channel,command,payload)
+        answer to each one (None if not received before timeout), the timeout grows
+        with the number of frames but the method returns as soon as all answers are received.
+        With write=True the bus (if shared) is given to this transaction before any read.
+        """
+        with self.lock:
+            self.completeBurst()
+            if self.arbiter and not self.arbiter.acquire(self,write):
+                raise Exception('DualPoller.transaction(): %s bus busy'%self.arbiter.name)
+            try:
+                burst = self.beginBurst(frames,write)
+                while not self.pollBurst(burst): self.transport.wait(.01)
+            finally:
+                if self.arbiter: self.arbiter.release(self)
+            return burst.answers
+
+    def serialComm(self, comm):
+        """ Synchronous single command, returns the answer without terminator """
+        for i in range(self.retries):
+            answer = self.transaction([comm],write=True)[0]
+            if answer is not None:
+                return self.packAnswer(*answer)
+        raise Exception('DualPoller.serialComm(%s): No answer received'%repr(comm))
+
+    def processAnswers(self, burst, answers):
+        """ Updates the cached replies and notifies the listeners """
+        now,replies = time.time(),[]
+        for comm,answer in zip(burst,answers):
+            if comm in self.polledNext: self.polledNext.remove(comm)
+            if answer is None or answer[0] is None:
+                self.errors = min((self.errors+1,len(self.readList)))
+                self.debug('%s: no valid answer (%s)'%(repr(comm),repr(answer)))
+            else:
+                self.errors = 0
+                old,self.comms[comm] = self.comms[comm],self.packAnswer(*answer)[1:]
+                if old is not None:
+                    try: changed = self.changeCheck(comm,old,self.comms[comm]) if self.changeCheck else old!=self.comms[comm]
+                    except: changed = True
+                    self.adapt(comm,changed)
+                self.lastRead[comm] = self.lasttime = now
+                for callback in self.listeners:
+                    try: callback(comm,self.comms[comm],now)
+                    except: self.warning('Listener %s failed: %s'%(callback,traceback.format_exc()))
+                replies.append((comm,self.comms[comm],now))
+        if replies:
+            for callback in self.batch_listeners:
+                try: callback(replies)
+                except: self.warning('Listener %s failed: %s'%(callback,traceback.format_exc()))
+        #Waiters are woken once the listeners have processed the replies
+        for comm,reply,date in replies:
+            with self.conditions[comm]: self.conditions[comm].notifyAll()
+
+    def startCycle(self, now):
+        """ Returns the commands to be read in a new cycle """
+        if self.last_cycle:
+            #Lateness of this cycle compared to the time it was scheduled for: the earliest
+            #deadline but not sooner than period after the last cycle (now if forced)
+            if any(c in self.readList for c in self.polledNext): deadline = now
+            else: deadline = max((self.last_cycle+self.period,min([self.lastRead[c]+self.getPeriod(c,now) for c in self.readList] or [now])))
+            self.jitter_stats.add(max((0.,now-deadline)))
+        self.last_cycle = now
+        return self.getDueComms(now)
+
+    def endCycle(self):
+        self.cycles += 1
+        self.cycletime = time.time()-self.last_cycle
+        self.cycle_stats.add(self.cycletime)
+        if not self.init and all(self.lastRead[c] for c in self.readList):
+            self.info('All commands read in %d cycles'%self.cycles)
+            self.init = True
+
+    def sendWrites(self):
+        """ Sends the queued writes, setting the reply of their futures """
+        while self.writeList and not self.stop_event.isSet():
+            future = self.writeList.pop(0)
+            try:
+                future.set(self.serialComm(future.frame))
+            except Exception,e:
+                self.warning('Write %s failed: %s'%(repr(future.frame),e))
+                future.set(exception=e)
+
+    def readCycle(self):
+        due = self.startCycle(time.time())
+        for i in range(0,len(due),self.pipeline):
+            #Writes preempt the next burst
+            self.sendWrites()
+            if self.stop_event.isSet(): break
+            burst = due[i:i+self.pipeline]
+            try:
+                answers = self.transaction(burst)
+            except:
+                self.warning('Burst failed: %s'%traceback.format_exc())
+                answers = [None]*len(burst)
+            self.processAnswers(burst,answers)
+        self.sendWrites()
+        self.endCycle()
+
+    def step(self, now):
+        """
+        Non-blocking equivalent of readCycle used by DualEngine: collects the
+        answers of the burst in flight or writes the next one (pending writes
+        first) and returns the time at which it should be called again.
+        """
+        with self.lock:
+            if self.burst is not None:
+                try:
+                    if not self.pollBurst(self.burst): return self.getNextStep(now)
+                except:
+                    self.warning('Burst failed: %s'%traceback.format_exc())
+                burst,self.burst = self.burst,None
+                if self.arbiter: self.arbiter.release(self)
+                self.endBurst(burst)
+
+            if self.writeList:
+                future = self.writeList.pop(0)
+                frames,write = [future.frame],True
+            else:
+                if self.queue is None:
+                    deadline = max((self.last_cycle+self.period,self.getNextDeadline(now)))
+                    #Commands forced by setPolledNext do not wait for the period, like in updateLoop
+                    if now<deadline and not any(c in self.readList for c in self.polledNext):
+                        return deadline
+                    self.queue = self.startCycle(now)
+                if not self.queue:
+                    self.queue = None
+                    self.endCycle()
+                    return max((self.last_cycle+self.period,self.getNextDeadline(now)))
+                frames,write = self.queue[:self.pipeline],False
+                self.queue = self.queue[self.pipeline:]
+
+            if self.arbiter and not self.arbiter.acquire(self,write,timeout=0):
+                #Keeps its place in the bus queue, frames are sent in a later step
+                if write: self.writeList.insert(0,future)
+                else: self.queue = frames+self.queue
+                return now+self.engine.interval
+            try:
+                self.burst = self.beginBurst(frames,write)
+                if write: self.burst.future = future
+            except Exception,e:
+                self.warning('Burst failed: %s'%traceback.format_exc())
+                if self.arbiter: self.arbiter.release(self)
+                if write: future.set(exception=e)
+                else: self.processAnswers(frames,[None]*len(frames))
+            return self.getNextStep(now)
+
+    def updateLoop(self):
+        self.info('DualPoller.updateLoop() started')
+        while not self.stop_event.isSet():
+            t0 = time.time()
+            try: self.readCycle()
+            except: self.error('Exception in updateLoop: %s'%traceback.format_exc())
+            #Waits for the next deadline (at least period since the cycle start) or a forced command,
+            #writes queued meanwhile are sent at once
+            woken = False
+            while not self.stop_event.isSet():
+                self.wake_event.clear()
+                try: self.sendWrites()
+                except: self.error('Exception in updateLoop: %s'%traceback.format_exc())
+                now = time.time()
+                wait = max((self.period-(now-t0),self.getNextDeadline(now)-now))
+                if wait<=0 or (woken and self.polledNext): break
+                woken = self.wake_event.wait(min((wait,1.)))
+        self.info('DualPoller.updateLoop() finished')
+
+    def start(self):
+        if self.Alive: return
+        self.stop_event.clear()
+        if self.engine is not None:
+            self.wake_event = self.engine.wake_event
+            self.engine.register(self)
+            return
+        self.updateThread = threading.Thread(target=self.updateLoop,name='DualPoller')
+        self.updateThread.setDaemon(True)
+        self.updateThread.start()
+
+    def stop(self, timeout=3.):
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.engine is not None:
+            self.engine.unregister(self)
+            self.completeBurst()
+            self.queue = None
+            if self.arbiter: self.arbiter.release(self)
+        elif self.Alive and threading.currentThread() is not self.updateThread:
+            self.updateThread.join(timeout)
+        while self.writeList:
+            self.writeList.pop(0).set(exception=Exception('DualPoller(%s) stopped'%self.tangoDevice))
+
+class WakeEvent(object):
+    """ threading.Event that can also be waited with select.select (fileno) """
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.rfd,self.wfd = os.pipe()
+        for fd in (self.rfd,self.wfd):
+            fcntl.fcntl(fd,fcntl.F_SETFL,fcntl.fcntl(fd,fcntl.F_GETFL)|os.O_NONBLOCK)
+
+    def fileno(self):
+        return self.rfd
+
+    def isSet(self):
+        return self.event.isSet()
+
+    def set(self):
+        with self.lock:
+            if self.event.isSet(): return
+            self.event.set()
+            try: os.write(self.wfd,'x')
+            except OSError: pass
+
+    def clear(self):
+        with self.lock:
+            self.event.clear()
+            try:
+                while os.read(self.rfd,64): pass
+            except OSError: pass
+
+    def wait(self, timeout=None):
+        return self.event.wait(timeout)
+
+class DualEngine(Logger):
+    """
+    Single thread polling all the DualPoller objects of a process that use it
+    (engine=DualEngine.instance()), instead of a thread for each one.
+
+    The thread calls DualPoller.step() of every poller when it is due; step()
+    never waits for the hardware, bursts of different serial lines are in
+    flight at the same time. The thread waits with select on the descriptors
+    of the bursts in flight and the shared wake_event (set by setPolledNext,
+    addComm with value, ...) until the earliest deadline; transports without
+    a descriptor (e.g. DualEmulatorTransport) are checked every interval.
+    Only non-blocking transports are accepted (see DualPoller).
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(klass, log='INFO'):
+        """ Engine shared by all the devices of the process """
+        with klass._instance_lock:
+            if klass._instance is None: klass._instance = klass(log=log)
+            return klass._instance
+
+    def __init__(self, interval=.01, log='INFO'):
+        Logger.__init__(self,'DualEngine',level=log)
+        self.interval = interval
+        self.pollers = []
+        self.schedule = {}
+        self.lock = threading.Lock()
+        self.wake_event = WakeEvent()
+        self.stop_event = threading.Event()
+        self.loops = 0
+        self.updateThread = None
+
+    @property
+    def Alive(self):
+        return bool(self.updateThread and self.updateThread.isAlive())
+
+    def register(self, poller):
+        with self.lock:
+            if poller not in self.pollers: self.pollers.append(poller)
+            self.schedule[poller] = 0
+        self.start()
+        self.wake_event.set()
+
+    def unregister(self, poller):
+        with self.lock:
+            if poller in self.pollers: self.pollers.remove(poller)
+            self.schedule.pop(poller,None)
+
+    def getReport(self):
+        return 'DualEngine polling %d devices from a single thread: %d loops'%(len(self.pollers),self.loops)
+
+    def updateLoop(self):
+        self.info('DualEngine.updateLoop() started')
+        ready = []
+        while not self.stop_event.isSet():
+            self.wake_event.clear()
+            self.loops += 1
+            with self.lock: pollers = list(self.pollers)
+            busy = []
+            for poller in pollers:
+                now = time.time()
+                if (self.schedule.get(poller,0)>now and poller not in ready
+                        and not poller.writeList and not poller.polledNext):
+                    continue
+                #A poller locked by a synchronous command is skipped until next interval
+                if not poller.lock.acquire(False):
+                    self.schedule[poller] = now+self.interval
+                    busy.append(poller)
+                    continue
+                try:
+                    self.schedule[poller] = poller.step(now)
+                except:
+                    self.error('Exception in %s.step(): %s'%(poller.tangoDevice,traceback.format_exc()))
+                    self.schedule[poller] = now+1.
+                finally:
+                    poller.lock.release()
+            with self.lock:
+                wait = min(self.schedule.values() or [time.time()+1.])-time.time()
+            ready = []
+            if wait>0 and not self.stop_event.isSet():
+                fds = dict((poller.fileno(),poller) for poller in pollers if poller not in busy)
+                fds.pop(None,None)
+                try:
+                    readable = select.select([self.wake_event]+fds.keys(),[],[],min((wait,1.)))[0]
+                except (select.error,ValueError):
+                    #A descriptor closed meanwhile, it is checked in the next loop
+                    readable = []
+                ready = [fds[fd] for fd in readable if fd in fds]
+        self.info('DualEngine.updateLoop() finished')
+
+    def start(self):
+        if self.Alive: return
+        self.stop_event.clear()
+        self.updateThread = threading.Thread(target=self.updateLoop,name='DualEngine')
+        self.updateThread.setDaemon(True)
+        self.updateThread.start()
+
+    def stop(self, timeout=3.):
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.Alive and threading.currentThread() is not self.updateThread:
+            self.updateThread.join(timeout)
@@ -0,0 +1,132 @@
+#=============================================================================
+#
+# file :        DualPressure.py
+#
+# description : Pressure of the ion pumps computed from their current, so the
+#            pressure does not need to be polled with every current reading.
+#
+# project :    VacuumController Device Server
+#
+# $Author: srubio $
+#
+# copyleft :    Cells / Alba Synchrotron
+#               Bellaterra
+#               Spain
+#
+############################################################################
+#
+# This file is part of Tango-ds.
+#
+# Tango-ds is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Tango-ds is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+##########################################################################
+
+import math
+import threading
+
+def normalizePump(name):
+    """ Pump type names as compared by IonPumpsConfig: lowercase without spaces """
+    return str(name).strip().replace(' ','').lower()
+
+class PressureConverter(object):
+    """
+    Converts the current of an ion pump to pressure with I = K*S*P**n + I0, where
+    S is the nominal pumping speed (l/s) of each pump type of
+    MultiGaugeProtocol.DeviceTypes, K,n depend on the pump element and I0 is the
+    leakage current of the element, below which no pressure can be measured.
+
+    The nominal curves differ from the conversion done by the controller (voltage,
+    pump age, pressure unit), so every pressure read from the controller is compared
+    with the one computed for the last current of the channel, and a line
+    log(P) = a + b*log(Pnominal) is fitted to those pairs (exponentially weighted,
+    b is pulled to 1 until the readings span about a decade). The fitted curve
+    corrects the following conversions; pressure replies can then be polled much
+    slower than the current.
+    """
+    #Element: (K in A/(mbar**n*l/s), n, I0 in A)
+    ELEMENTS = {
+        'SC/Tr': (6.7e-4,1.15,1e-9),
+        'Diode/ND': (8.0e-4,1.2,1e-9),
+        }
+    #Pump type: (element, pumping speed in l/s); Spare has no conversion
+    PUMPS = {
+        '500SC/Tr': ('SC/Tr',500.),
+        '300SC/Tr': ('SC/Tr',300.),
+        '150SC/Tr': ('SC/Tr',150.),
+        '75-55-40SC/Tr': ('SC/Tr',55.),
+        '20SC/Tr': ('SC/Tr',20.),
+        '500Diode/ND': ('Diode/ND',500.),
+        '300Diode/ND': ('Diode/ND',300.),
+        '150Diode/ND': ('Diode/ND',150.),
+        '75-55-40Diode/ND': ('Diode/ND',55.),
+        '20-25Diode/ND': ('Diode/ND',22.5),
+        }
+    #Variance of log(Pnominal) at which the fitted slope weighs as much as the default 1
+    SPREAD = (math.log(10)/4)**2
+
+    def __init__(self, weight=.5):
+        """ weight of each new controller reading in the fit, 1 to use only the last one """
+        self.weight = weight
+        self.tables = dict((normalizePump(k),(self.ELEMENTS[e][0],s)+self.ELEMENTS[e][1:])
+            for k,(e,s) in self.PUMPS.items())
+        self.corrections = {} #channel:(pump,[mean x,mean y,mean x*x,mean x*y]) with x,y = log(Pnominal),log(P)
+        self.calibrations = {} #channel:count
+        self.lock = threading.Lock()
+
+    def getNominal(self, pump, current):
+        """ Pressure from the nominal curve of the pump type, None if unknown """
+        table = self.tables.get(normalizePump(pump))
+        if table is None: return None
+        K,S,n,I0 = table
+        if current<=I0: return 0.
+        return ((current-I0)/(K*S))**(1./n)
+
+    def getCurve(self, channel):
+        """ (a,b) of the fitted log(P) = a + b*log(Pnominal) of the channel """
+        x,y,xx,xy = self.corrections[channel][1]
+        var,cov = max((0.,xx-x*x)),xy-x*y
+        b = (cov+self.SPREAD)/(var+self.SPREAD)
+        return y-b*x,b
+
+    def getPressure(self, channel, pump, current):
+        """ Corrected pressure for a current of the channel, None if the pump type is unknown """
+        pressure = self.getNominal(pump,current)
+        if not pressure: return pressure
+        with self.lock:
+            if not self.isCalibrated(channel,pump): return pressure
+            a,b = self.getCurve(channel)
+        return math.exp(a+b*math.log(pressure))
+
+    def isCalibrated(self, channel, pump):
+        return self.corrections.get(channel,(None,))[0]==normalizePump(pump)
+
+    def calibrate(self, channel, pump, current, pressure):
+        """ Adds to the fit of the channel a pressure read for the given current """
+        nominal = self.getNominal(pump,current)
+        if not nominal or pressure<=0: return
+        pump = normalizePump(pump)
+        x,y = math.log(nominal),math.log(pressure)
+        point = [x,y,x*x,x*y]
+        with self.lock:
+            last = self.corrections.get(channel)
+            if last and last[0]==pump:
+                point = [(1-self.weight)*m+self.weight*p for m,p in zip(last[1],point)]
+            self.corrections[channel] = (pump,point)
+            self.calibrations[channel] = self.calibrations.get(channel,0)+1
+
+    def getReport(self):
+        with self.lock:
+            curves = [(c,p,m[0])+self.getCurve(c) for c,(p,m) in sorted(self.corrections.items())]
+        #Shown as the correction factor at the mean nominal pressure read and the slope
+        return 'Pressure from current: %s'%(', '.join('channel %d %s x%1.3g slope %1.3g (%d readings)'%(
+            c,p,math.exp(a+(b-1)*x),b,self.calibrations.get(c,0)) for c,p,x,a,b in curves) or 'not calibrated')
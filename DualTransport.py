@@ -0,0 +1,216 @@
+#=============================================================================
+#
+# file :        DualTransport.py
+#
+# description : Direct access to the controller line, a local serial port
+#            (termios) or a TCP port of a terminal server, without passing
+#            through a Tango Serial device server.
+#
+#            SerialLine = /dev/ttyS0           (9600 bauds, 8N1)
+#            SerialLine = /dev/ttyUSB0:19200
+#            SerialLine = tcp://moxa01:4001
+#
+# project :    VacuumController Device Server
+#
+# $Author: srubio $
+#
+# copyleft :    Cells / Alba Synchrotron
+#               Bellaterra
+#               Spain
+#
+############################################################################
+#
+# This file is part of Tango-ds.
+#
+# Tango-ds is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Tango-ds is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+##########################################################################
+
+import os
+import time
+import errno
+import select
+import socket
+import termios
+
+class FileTransport(object):
+    """
+    Non-blocking access to a file descriptor with the interface of DualPoller
+    transports (write,read,flush). After an I/O error the descriptor is closed
+    and reopened by the next call, not sooner than reconnect seconds later;
+    calls done while disconnected raise IOError. A write that cannot be
+    completed in timeout seconds also raises IOError. The base class opens
+    the file name as is (e.g. a pty), subclasses configure the descriptor.
+    """
+    def __init__(self, name, reconnect=5., timeout=3.):
+        self.name = name
+        self.reconnect = reconnect
+        self.timeout = timeout
+        self.fd = None
+        self.next_connect = 0
+        self.connections = 0
+
+    def open(self):
+        """ Returns a new non-blocking file descriptor """
+        return os.open(self.name,os.O_RDWR|os.O_NOCTTY|os.O_NONBLOCK)
+
+    def ready(self):
+        """ False while the descriptor returned by open() cannot be used yet """
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            try: os.close(self.fd)
+            except OSError: pass
+        self.fd = None
+
+    def check(self):
+        if self.fd is not None: return
+        if time.time()<self.next_connect:
+            raise IOError('%s: disconnected, retrying in %1.1f s'%(self.name,self.next_connect-time.time()))
+        self.next_connect = time.time()+self.reconnect
+        self.fd = self.open()
+        self.connections += 1
+
+    def write(self, data):
+        self.check()
+        if not self.ready(): raise IOError('%s: connecting'%self.name)
+        end = time.time()+self.timeout
+        try:
+            while data:
+                try:
+                    data = data[os.write(self.fd,data):]
+                except OSError,e:
+                    if e.errno not in (errno.EAGAIN,errno.EWOULDBLOCK): raise
+                    wait = end-time.time()
+                    if wait<=0 or not select.select([],[self.fd],[],wait)[1]:
+                        raise IOError('write timeout, %d bytes not sent in %1.1f s'%(len(data),self.timeout))
+        except (OSError,IOError),e:
+            self.close()
+            raise IOError('%s: %s'%(self.name,e))
+
+    def read(self):
+        """ Returns the data available or '' """
+        self.check()
+        if not self.ready(): return ''
+        try:
+            data = os.read(self.fd,4096)
+        except OSError,e:
+            if e.errno in (errno.EAGAIN,errno.EWOULDBLOCK): return ''
+            self.close()
+            raise IOError('%s: %s'%(self.name,e))
+        if not data and self.closedOnEmpty():
+            self.close()
+            raise IOError('%s: connection closed'%self.name)
+        return data
+
+    def closedOnEmpty(self):
+        """ True if reading nothing means that the other side closed the connection """
+        return False
+
+    def flush(self):
+        while self.read(): pass
+
+    def wait(self, timeout):
+        """ Waits until data can be read or timeout """
+        if self.fd is None: time.sleep(timeout)
+        else: select.select([self.fd],[],[],timeout)
+
+class SerialPortTransport(FileTransport):
+    """ Local serial port opened in raw mode, 8N1 without flow control """
+    def __init__(self, port, baudrate=9600, reconnect=5., timeout=3.):
+        FileTransport.__init__(self,port,reconnect,timeout)
+        self.port = port
+        self.baudrate = baudrate
+
+    def open(self):
+        fd = os.open(self.port,os.O_RDWR|os.O_NOCTTY|os.O_NONBLOCK)
+        try:
+            speed = getattr(termios,'B%d'%self.baudrate)
+            iflag,oflag,cflag,lflag,ispeed,ospeed,cc = termios.tcgetattr(fd)
+            cflag = termios.CS8|termios.CREAD|termios.CLOCAL
+            cc[termios.VMIN],cc[termios.VTIME] = 0,0
+            termios.tcsetattr(fd,termios.TCSANOW,[termios.IGNPAR,0,cflag,0,speed,speed,cc])
+            termios.tcflush(fd,termios.TCIOFLUSH)
+        except:
+            os.close(fd)
+            raise
+        return fd
+
+    def flush(self):
+        self.check()
+        termios.tcflush(self.fd,termios.TCIOFLUSH)
+
+class SocketTransport(FileTransport):
+    """
+    Raw TCP connection, e.g. to a port of a terminal server. The connection
+    is not waited for: open() returns at once and writes raise IOError until
+    it is established (or fails after timeout seconds), so the polling
+    engine is never blocked by an unreachable host.
+    """
+    def __init__(self, host, port, timeout=3., reconnect=5.):
+        FileTransport.__init__(self,'tcp://%s:%d'%(host,port),reconnect,timeout)
+        self.address = (host,port)
+        self.socket = None
+        self.connecting = 0
+
+    def open(self):
+        self.socket = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        self.socket.setblocking(0)
+        error = self.socket.connect_ex(self.address)
+        if error not in (0,errno.EINPROGRESS,errno.EWOULDBLOCK):
+            self.close()
+            raise IOError('%s: %s'%(self.name,os.strerror(error)))
+        self.connecting = time.time()+self.timeout if error else 0
+        return self.socket.fileno()
+
+    def ready(self):
+        """ Checks without blocking if the connection started by open() is established """
+        if not self.connecting: return True
+        if select.select([],[self.fd],[],0)[1]:
+            error = self.socket.getsockopt(socket.SOL_SOCKET,socket.SO_ERROR)
+        elif time.time()<self.connecting:
+            return False
+        else:
+            error = errno.ETIMEDOUT
+        self.connecting = 0
+        if error:
+            self.close()
+            raise IOError('%s: %s'%(self.name,os.strerror(error)))
+        return True
+
+    def close(self):
+        if self.socket is not None:
+            try: self.socket.close()
+            except socket.error: pass
+        self.socket = self.fd = None
+
+    def closedOnEmpty(self):
+        return True
+
+def isDirectLine(line):
+    return line.startswith('/dev/') or line.startswith('tcp://')
+
+def newTransport(line, reconnect=5.):
+    """
+    Transport for a /dev/tty[:baudrate] or tcp://host:port SerialLine,
+    None for Tango Serial device names.
+    """
+    if line.startswith('tcp://'):
+        host,port = line[len('tcp://'):].rsplit(':',1)
+        return SocketTransport(host,int(port),reconnect=reconnect)
+    elif line.startswith('/dev/'):
+        port,baudrate = line.split(':',1) if ':' in line else (line,'9600')
+        return SerialPortTransport(port,int(baudrate),reconnect=reconnect)
+    return None
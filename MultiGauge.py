@@ -32,6 +32,65 @@
 ##########################################################################
 #
 
+class MultiGaugeParser(object):
+    """
+    Incremental parser for the answers of a MultiGauge compatible controller.
+
+    Raw characters read from the serial stream are added using feed(),
+    frames split or concatenated by the serial server are rebuilt using
+    TERM and returned as (channel, command, payload) records:
+
+        '>' answers: (int channel, int command, payload string)
+        ACK:         (None, ACK, '')
+        NACK:        (None, NACK, error code), see ProtocolErrors
+
+    The characters are kept in a single bytearray that is compacted once
+    per feed() call; characters not belonging to any frame are discarded
+    and counted in self.discarded.
+    """
+    def __init__(self, maxsize=4096):
+        self.buffer = bytearray()
+        self.maxsize = maxsize
+        self.discarded = 0
+
+    def clear(self):
+        self.discarded += len(self.buffer)
+        del self.buffer[:]
+
+    def feed(self, data):
+        buff = self.buffer
+        buff.extend(data)
+        answer,ack,nack,term = [ord(c) for c in (MultiGaugeProtocol.ANSWER,
+            MultiGaugeProtocol.ACK,MultiGaugeProtocol.NACK,MultiGaugeProtocol.TERM)]
+        view,records = memoryview(buff),[]
+        pos,size = 0,len(buff)
+        while pos<size:
+            c = buff[pos]
+            if c==answer:
+                end = buff.find(MultiGaugeProtocol.TERM,pos)
+                if end<0: break
+                digits = [d-48 for d in buff[pos+1:pos+4]]
+                if end-pos<4 or not all(0<=d<=9 for d in digits):
+                    self.discarded += end+1-pos
+                else:
+                    records.append((digits[0],10*digits[1]+digits[2],view[pos+4:end].tobytes()))
+                pos = end+1
+            elif c==ack:
+                records.append((None,MultiGaugeProtocol.ACK,''))
+                pos += 1
+            elif c==nack:
+                if pos+1>=size: break
+                records.append((None,MultiGaugeProtocol.NACK,chr(buff[pos+1])))
+                pos += 2
+            else:
+                if c!=term: self.discarded += 1
+                pos += 1
+        del view
+        del buff[:pos]
+        if len(buff)>self.maxsize:
+            self.clear()
+        return records
+
 class MultiGaugeProtocol(object):
     """
     The most common commands are:
@@ -80,7 +139,46 @@ class MultiGaugeProtocol(object):
         comm = int(result[2:4])
         data = _type(result[4:-1])
         return chann, comm, data
-    
+
+    def packAnswer(self, chann, comm, data=''):
+        """ Rebuilds the answer string from a (channel,command,payload) record """
+        if chann is None: return comm+data
+        return self.ANSWER + ('%1d' % chann) + ('%02d' % comm) + data
+
+    def decodeStatus(self, data):
+        """ Status: '0'/'1' (or any digit), negative codes like '-3' for errors """
+        if len(data)==1 and '0'<=data<='9': return ord(data)-48
+        if len(data)==2 and data[0]=='-' and '0'<=data[1]<='9': return 48-ord(data[1])
+        raise ValueError('Not a Status value: %s'%repr(data))
+
+    def decodeInteger(self, data):
+        """ Integer: 'xxxxx' BCD on 5 digits; any -?[0-9]+ is accepted, as before the typed decoders """
+        if (data[1:] if data[:1]=='-' else data).isdigit(): return int(data)
+        raise ValueError('Not an Integer value: %s'%repr(data))
+
+    def decodeBitField(self, data):
+        """ BitField: 8 characters '0'/'1' """
+        if len(data)==8 and not data.strip('01'): return int(data,2)
+        raise ValueError('Not a BitField value: %s'%repr(data))
+
+    def decodeExponential(self, data):
+        """ Exponential: 'x.xEsxx' """
+        if (len(data)==7 and data[1]=='.' and data[3]=='E' and data[4] in '+-'
+                and '0'<=data[0]<='9' and '0'<=data[2]<='9'
+                and '0'<=data[5]<='9' and '0'<=data[6]<='9'):
+            return float(data)
+        raise ValueError('Not an Exponential value: %s'%repr(data))
+
+    def decodeString(self, data):
+        """ String: characters within the 20h and 7Fh range """
+        if data and ' '<=min(data) and max(data)<='\x7f': return data
+        raise ValueError('Not a String value: %s'%repr(data))
+
+    def getDecoder(self, comm):
+        """ Returns the decoder for a command frame (or command code) according to DataFormats """
+        code = comm if isinstance(comm,int) else int(comm[2:4])
+        return getattr(self,'decode'+self.DataFormats.get(code,'String'))
+
     GeneralComms = {
         'Local/Remote': 10,
         'HV On/Off': 30,
@@ -97,6 +195,28 @@ class MultiGaugeProtocol(object):
         'Interlock': 13
         }
         
+    #Data format of each command code (as described in VarianDUAL.readCommand)
+    DataFormats = {
+        10: 'Status', #Local/Remote
+        30: 'Status', #HV On/Off
+        3: 'Status', #Unit
+        5: 'String', #Firmware
+        7: 'Integer', #V Meas
+        8: 'Exponential', #I Meas
+        2: 'Exponential', #P Meas
+        19: 'Integer', #Error Status
+        1: 'Status', #Device Number
+        11: 'String', #Device Type
+        12: 'String', #Remote Error
+        13: 'BitField', #Interlock
+        60: 'Status', #fixed/step
+        61: 'Status', #start/protect
+        63: 'Integer', #Vmax
+        66: 'Integer', #Iprotect
+        71: 'Exponential', #SetPt1
+        72: 'Exponential', #SetPt2
+        }
+
     DeviceTypes = """
             Spare
             500SC/Tr
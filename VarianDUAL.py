@@ -47,7 +47,7 @@
 import sys
 import inspect
 import time
-import re
+import math
 import operator
 import traceback
 import threading
@@ -59,7 +59,6 @@ from PyTango import DevState,DevFailed
 from fandango.excepts import getLastException
 from fandango.device import Dev4Tango,TimedQueue
 from fandango.functional import isString,isSequence,toSequence
-from fandango.objects import self_locked
 
 ## @note Backward compatibility between PyTango3 and PyTango7
 if 'PyDeviceClass' not in dir(PyTango): PyTango.PyDeviceClass = PyTango.DeviceClass
@@ -69,6 +68,140 @@ if 'Device_4Impl' not in dir(PyTango): PyTango.Device_4Impl = PyTango.Device_3Im
 from MultiGauge import MultiGaugeProtocol
 from VacuumController import *
 
+class MonitorReleased(object):
+    """
+    Releases the Tango device monitor held by the current thread (if any) until
+    the block ends, so attribute reads of other clients are not queued behind
+    a thread waiting for the controller. Does nothing on PyTango versions
+    without AutoTangoAllowThreads.
+    """
+    def __init__(self, device):
+        self.device = device
+        self.allowed = None
+
+    def __enter__(self):
+        if hasattr(PyTango,'AutoTangoAllowThreads'):
+            self.allowed = PyTango.AutoTangoAllowThreads(self.device)
+            self.allowed.__enter__()
+        return self
+
+    def __exit__(self, etype, value, tb):
+        allowed,self.allowed = self.allowed,None
+        if allowed is not None: allowed.__exit__(etype,value,tb)
+        return False
+
+def write_locked(method):
+    """
+    Serializes the commands that change the controller state on self.lock.
+    The Tango monitor is released before waiting for the lock and while the
+    write runs, and reacquired after releasing it (never the other way round).
+    """
+    def locked(self, *args, **kwargs):
+        with MonitorReleased(self):
+            with self.lock:
+                return method(self,*args,**kwargs)
+    locked.__name__,locked.__doc__ = method.__name__,method.__doc__
+    return locked
+
+class WriteSession(object):
+    """
+    Batch of writes done with a single switch to SERIAL mode:
+
+        with self.writeSession() as session:
+            session.write('HV1 On')
+            session.write('HV1setStep')
+
+    The outermost session sets SERIAL mode when entered; when it ends it
+    waits for the replies of all the writes, confirms each one reading back
+    its channel and command, and sets LOCAL mode once if ForceLocal is set
+    (and SERIAL mode was not set by someone else in the last minute).
+    Nested sessions (e.g. OnHV1() called from WarmUp) share the outermost,
+    but only within the thread that opened it: the outermost session holds
+    the device lock, so a command from another client waits for it to end
+    instead of joining it. The Tango monitor is released while waiting for
+    the lock and for the replies, attribute reads are served meanwhile.
+    Writes not confirmed raise WriteNotConfirmed.
+    """
+    def __init__(self, device, timeout=None):
+        self.device = device
+        self.timeout = timeout
+        self.depth = 0
+        self.local = False
+        self.writes = []
+        self.failed = []
+
+    def __enter__(self):
+        self.depth += 1
+        if self.depth==1:
+            d = self.device
+            with MonitorReleased(d):
+                d.lock.acquire()
+            d.sessions.current = self
+            try:
+                self.local = (str(d.ForceLocal).lower() in ('true','yes')
+                    and time.time()>=d.last_serial_change+60)
+                d.SetMode('serial')
+            except:
+                self.depth,d.sessions.current = 0,None
+                d.lock.release()
+                raise
+        return self
+
+    def write(self, name, comm=None):
+        """ Queues the write of comm (HVComms[name] by default) """
+        d = self.device
+        comm = comm or d.HVComms[name]
+        d.info('WriteSession.write(%s,%s)'%(name,repr(comm)))
+        self.writes.append((name,comm,d.SVD.addComm(comm,comm)))
+
+    def confirm(self):
+        """ Checks the replies and reads back the written values, returns [(name,error)] """
+        d,failed,reads = self.device,[],[]
+        if not hasattr(d.SVD,'submit'):
+            d.refreshConfig([comm for name,comm,future in self.writes])
+            return failed
+        timeout = self.timeout or d.SVD.getWriteTimeout(len(self.writes))
+        for name,comm,future in self.writes:
+            try:
+                reply = future.result(timeout)
+                if reply.startswith(self.device.NACK):
+                    code = reply[1:2]
+                    raise Exception('ProtocolError%s: %s'%(code,d.ProtocolErrors.get(code,'')))
+                read = d.packMultiGauge(*d.SVD.getFrameKey(comm))
+                reads.append((name,comm,read,time.time()))
+                if read in d.SVD.readList: d.SVD.setPolledNext(read)
+            except Exception,e:
+                failed.append((name,str(e)))
+        for name,comm,read,since in reads:
+            #The first reply received after the write is acknowledged
+            reply = d.SVD.waitComm(read,since,timeout)
+            if reply is None:
+                failed.append((name,'no reply to %s'%repr(read)))
+            elif comm[4:].strip()!=reply[3:].strip():
+                failed.append((name,'%s reads %s'%(comm[4:].strip(),reply[3:].strip())))
+        return failed
+
+    def __exit__(self, etype, value, tb):
+        self.depth -= 1
+        if self.depth: return False
+        d = self.device
+        try:
+            if self.writes and etype is None:
+                with MonitorReleased(d):
+                    self.failed = self.confirm()
+                for name,error in self.failed:
+                    d.warning('WriteSession: %s not confirmed: %s'%(name,error))
+        finally:
+            d.sessions.current = None
+            try:
+                if self.local: d.SetMode('local')
+            finally:
+                d.lock.release()
+        if self.failed and etype is None:
+            PyTango.Except.throw_exception('WriteNotConfirmed','; '.join(
+                '%s: %s'%f for f in self.failed),'WriteSession')
+        return False
+
 #==================================================================
 #   VarianDUAL Class Description:
 #
@@ -85,7 +218,7 @@ from VacuumController import *
 #     Device States Description:
 #
 #   DevState.ON : Everything works fine
-#   DevState.OFF : Both channels switched off
+#   DevState.OFF : All channels switched off
 #   DevState.INIT : Hardware values not readed yet
 #   DevState.UNKNOWN : It's not possible to communicate
 #   DevState.MOVING: Current or Voltage values are changing
@@ -107,7 +240,6 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
 
     #--------- Add you global variables here --------------------------
     #State Machine methods
-    @self_locked
     def is_Attr_allowed(self, req_type): 
         self.debug('In is_Attr_allowed ...')
         return bool(self.SVD and self.SVD.errors<len(self.SVD.readList) and  self.get_state() not in [PyTango.DevState.UNKNOWN] and self.SVD.init)#,PyTango.DevState.INIT] )
@@ -150,6 +282,7 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
         if self.StartSequence:
             self.info('-'*80)
             self.info('In WarmUp() = executeStartSequence (%s)'%self.StartSequence)
+            steps = []
             for s in self.StartSequence:
                 self.info(s)
                 s,c = s.split(':',1) if ':' in s else (s,'')
@@ -157,10 +290,15 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
                 except: c = False
                 self.info('\t%s:%s'%(s,c))
                 if s in funcs.keys() and callable(funcs[s]) and c:
-                    self.info('In WarmUp() ... Executing %s'%s)
-                    funcs[s].__call__()
+                    steps.append(s)
                 else:
                     self.info('... unknown %s'%s)
+            if steps:
+                #The whole sequence is written in a single SERIAL session
+                with self.writeSession():
+                    for s in steps:
+                        self.info('In WarmUp() ... Executing %s'%s)
+                        funcs[s].__call__()
         return '\n'.join(self.StartSequence)
             
     def SetStartSequence(self,argin):
@@ -173,7 +311,7 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
             
     def getModeLocal(self):
         attr_Mode_read = 'Unknown'
-        st = self.readCommand('ModeLocal',int)
+        st = self.readValue('ModeLocal',int)
         if st in range(3):
             attr_Mode_read=['LOCAL','REMOTE','SERIAL'][st]
         return attr_Mode_read
@@ -181,31 +319,341 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
     def AsciiChecksum(self,argin):
         return '%04d'%sum(ord(i) for i in str(argin))
     
+    @write_locked
     def writeCommand(self, comm, argin, mode=False, local=False):
-        """ This method provides a generic function for executing write-only commands """
-        print '>'*80
-        if mode:
-            local = time.time()>=self.last_serial_change+60 and self.ForceLocal
-            if not 'SERIAL' in self.getModeLocal(): self.SetMode('serial')
-        else: local = False
+        """ This method provides a generic function for executing write-only commands, with mode=True it is done in a WriteSession """
         try:
             self.info('In writeCommand(%s,%s)'%(comm,argin))
-            self.SVD.addComm(argin,argin)
+            if mode:
+                with self.writeSession() as session:
+                    session.write(comm,argin)
+            else:
+                self.SVD.addComm(argin,argin)
         except Exception, e:
             exc = traceback.format_exc()
             self.error('Exception in writeCommand: '+exc)
             self.exception='Exception in writeCommand: '+str(e)
             raise Exception('Exception%s()'%comm, exc)
-        if mode and local: self.SetMode('local')
-        print '<'*80
-        
-    REGEXPS = {
-        bool:'[01]',
-        int:'-?[0-9]',
-        long:'[0-9]{4,5}',
-        float:'[0-9]\.[0-9]E[+-][0-9]{2,2}',
-        str:'.*'
+
+    def waitValue(self, name, _type, check, timeout=1.):
+        """
+        Forces the read of HVComms[name] and waits for fresh values until one makes
+        check(value) True or timeout expires, returns the last value read.
+        """
+        comm = self.HVComms[name]
+        since,end = time.time(),time.time()+timeout
+        while True:
+            if hasattr(self.SVD,'waitComm'):
+                #Woken by the polling thread as soon as a new reply is received
+                if self.SVD.waitComm(comm,since,end-time.time()) is None: break
+                since = self.SVD.lastRead.get(comm,time.time())
+            else:
+                self.SVD.setPolledNext(comm)
+                self.event.wait(.05)
+            value = self.readValue(name,_type)
+            if check(value) or time.time()>=end: return value
+        return self.readValue(name,_type)
+
+    #Slow changing configuration, polled every ConfigTTL seconds and read again after a write
+    #(%d is replaced by each channel number)
+    CONFIG_COMMANDS = ('Firmware','Pump%d','HV%d IProtect','HV%d PSetPoint','HV%dStep','HV%dProtect')
+    #Written command code: read command code affected, if different
+    CONFIG_WRITES = {
+        MultiGaugeProtocol.GeneralComms['Device Number']:MultiGaugeProtocol.GeneralComms['Device Type'],
         }
+
+    def refreshConfig(self, frames, timeout=None):
+        """
+        Forces the read of the configuration affected by the written frames and, if the
+        polling thread notifies new replies, waits for them; returns the names refreshed.
+        """
+        names = []
+        for frame in toSequence(frames):
+            if frame[4:].strip() in ('',self.READ): continue
+            code = int(frame[2:4])
+            name = self.HVNames.get(self.packMultiGauge(int(frame[1]),self.CONFIG_WRITES.get(code,code)))
+            if name in self.configNames and name not in names: names.append(name)
+        since = time.time()
+        for name in names:
+            self.SVD.setPolledNext(self.HVComms[name])
+        if hasattr(self.SVD,'waitComm'):
+            for name in names: self.SVD.waitComm(self.HVComms[name],since,timeout)
+        return names
+
+    #Channel numbers of the MultiGauge protocol, HV1/HV2 for the DUAL and up to 4 for other controllers
+    MAX_CHANNELS = 4
+    
+    #Commands read once for the whole controller: (name,channel,command,polling period,priority)
+    GENERAL_READS = (('ModeLocal',0,'Local/Remote',10.,0),('Remote Error',0,'Remote Error',10.,0),
+        ('Interlock',0,'Interlock',10.,1),('ErrorStatus',1,'Error Status',10.,1),('Firmware',0,'Firmware',60.,0))
+    
+    #Commands generated for each channel of ChannelTable depending on its kind, names
+    #keep the HV prefix of the DUAL for all kinds and %d is replaced by the channel number.
+    #Reads are (name,command,polling period,priority), writes are (name,command,data).
+    CHANNEL_READS = {
+        'HV': (('HV%d V','V Meas',1.,1),('HV%d I','I Meas',1.,1),('HV%d P','P Meas',1.,2),
+            ('HV%dStatus','HV On/Off',10.,2),('HV%dStep','fixed/step',10.,0),('HV%dProtect','start/protect',10.,0),
+            ('HV%d IProtect','Iprotect',10.,0),('HV%d PSetPoint','SetPt1',10.,0),('Pump%d','Device Type',60.,0)),
+        'GAUGE': (('HV%d P','P Meas',1.,2),('HV%dStatus','HV On/Off',10.,2)),
+        }
+    CHANNEL_WRITES = {
+        'HV': (('HV%d On','HV On/Off','1'),('HV%d Off','HV On/Off','0'),
+            ('HV%dsetFixed','fixed/step','0'),('HV%dsetStep','fixed/step','1'),
+            ('HV%dsetStart','start/protect','0'),('HV%dsetProtect','start/protect','1')),
+        'GAUGE': (('HV%d On','HV On/Off','1'),('HV%d Off','HV On/Off','0')),
+        }
+    CHANNEL_LABELS = {'HV':'High Voltage','GAUGE':'Gauge'}
+    
+    def parseChannelTable(self):
+        """ Returns [(channel,kind)] from the ChannelTable property, lines are channel[:kind] """
+        channels = []
+        for line in self.ChannelTable or ['1:HV','2:HV']:
+            if not line.strip() or line.strip().startswith('#'): continue
+            channel,kind = (line.split(':',1)+['HV'])[:2]
+            channel,kind = int(channel),kind.strip().upper()
+            if kind not in self.CHANNEL_READS or not 1<=channel<=self.MAX_CHANNELS:
+                raise Exception('Wrong ChannelTable line "%s", channels are 1 to %d and kinds %s'%(
+                    line,self.MAX_CHANNELS,'/'.join(sorted(self.CHANNEL_READS))))
+            channels.append((channel,kind))
+        return channels
+    
+    def getChannels(self, kind=None):
+        """ Channel numbers of ChannelTable, only those of the given kind if not None """
+        return [c for c,k in self.channels if kind is None or k==kind]
+    
+    def packChannel(self, channel, command, data='?'):
+        """ Frame of a command of GeneralComms or HighVoltageCommands for the channel """
+        code = self.GeneralComms.get(command,self.HighVoltageCommands.get(command))
+        return self.packMultiGauge(channel,code,data)
+    
+    def checkChannel(self, name, origin):
+        """ Raises an exception if the command was not generated for any channel """
+        if name not in self.HVComms:
+            PyTango.Except.throw_exception('ChannelNotConfigured','%s is not available for ChannelTable %s'%(
+                name,self.ChannelTable),origin)
+
+    def initWriteSessions(self):
+        """ Creates the device lock held by write sessions and the per-thread session holder """
+        if getattr(self,'lock',None) is None: self.lock = threading.RLock()
+        self.sessions = threading.local()
+
+    def getSession(self):
+        """ Returns the WriteSession opened by the current thread, if any """
+        return getattr(self.sessions,'current',None)
+
+    def writeSession(self):
+        """ Returns the WriteSession in progress in this thread or a new one """
+        return self.getSession() or WriteSession(self)
+        
+    def getTypeDecoder(self, _type):
+        """ Decoder used for commands not declared through addCommand """
+        return {
+            bool:self.decodeStatus,
+            int:self.decodeStatus,
+            long:self.decodeInteger,
+            float:self.decodeExponential,
+            str:self.decodeString,
+            }[_type]
+    
+    #Attributes pushed as change/archive events when a new reply is received
+    EVENT_ATTRIBUTES = dict(('HV%d %s'%(c,q),'%s%d'%(q,c)) for c in range(1,MAX_CHANNELS+1) for q in 'VIP')
+    EVENT_ATTRIBUTES.update(('HV%dStatus'%c,'HV%dStatus'%c) for c in range(1,MAX_CHANNELS+1))
+    
+    def getOnOffName(self, st):
+        name = 'Unknown'
+        for k,v in self.OnOffCoding.iteritems():
+            if v==st: name = k
+        return name
+    
+    def parseEventThresholds(self):
+        """ EventThresholds lines are attribute,type,threshold; type can be abs, rel or log (relative in log10) """
+        thresholds = {}
+        for line in self.EventThresholds:
+            line = line.split('#',1)[0].strip()
+            if not line: continue
+            try:
+                attr,kind,value = [l.strip() for l in line.split(',')]
+                if kind.lower() not in ('abs','rel','log'): raise Exception('Unknown type %s'%kind)
+                thresholds[attr.lower()] = (kind.lower(),float(value))
+            except Exception,e:
+                self.warning('Wrong EventThresholds line "%s": %s'%(line,e))
+        return thresholds
+    
+    def checkEventThreshold(self, attr, old, new):
+        kind,threshold = self.event_thresholds.get(attr.lower(),('',0))
+        if old is None or not kind or isString(new): return old!=new
+        if kind=='abs': return abs(new-old)>=threshold
+        elif kind=='rel': return abs(new-old)>=threshold*abs(old)
+        elif old>0 and new>0: return abs(math.log10(new)-math.log10(old))>=threshold
+        return old!=new
+    
+    def checkChanged(self, comm, old, new):
+        """ Used by the adaptive polling, values changing more than EventThresholds are polled faster """
+        name = self.HVNames.get(comm)
+        if name not in self.EVENT_ATTRIBUTES or old==new: return old!=new
+        decoder = self.HVDecoders[name]
+        return self.checkEventThreshold(self.EVENT_ATTRIBUTES[name],decoder(old[3:]),decoder(new[3:]))
+    
+    def pollChannel(self, channel):
+        """ Polls the channel status next, and all channel values at maximum rate for a while """
+        self.SVD.setPolledNext(self.HVComms['HV%dStatus'%channel])
+        if hasattr(self.SVD,'boost'):
+            self.SVD.boost(self.getChannelComms(channel)+[self.HVComms['HV%dStatus'%channel]])
+    
+    def pushEvents(self, attr, value, date):
+        if attr.endswith('Status'): value = self.getOnOffName(value)
+        if not self.checkEventThreshold(attr,self.last_events.get(attr),value): return
+        self.last_events[attr] = value
+        self.push_change_event(attr,value,date,PyTango.AttrQuality.ATTR_VALID)
+        self.push_archive_event(attr,value,date,PyTango.AttrQuality.ATTR_VALID)
+    
+    #History buffers filled by the polling thread
+    HISTORY_ATTRIBUTES = dict(('HV%d %s'%(c,q),'%s%dHistory'%(q,c)) for c in range(1,MAX_CHANNELS+1) for q in 'PVI')
+    HISTORY_ATTRIBUTES.update(('HV%dStatus'%c,'HV%dCodeHistory'%c) for c in range(1,MAX_CHANNELS+1))
+    #Max HistorySize, rows of the *History attributes
+    MAX_HISTORY = 86400
+    #Max number of StatsWindows, 7 values of each one fit in the *Stats attributes
+    MAX_STATS_WINDOWS = 8
+    
+    def processReplies(self, replies):
+        """
+        Called by the polling thread with the (comm,reply,date) of all the replies of a burst
+        (the commands of all channels polled together), publishes a new snapshot, then
+        updates history buffers and statistics and pushes events.
+        
+        The snapshot is a {name:(value,date,quality)} dictionary never modified once
+        published, a new one replaces it after every burst so readers don't need any lock
+        and see all the values of a burst at once.
+        """
+        snapshot,names = dict(self.snapshot),[]
+        for comm,result,date in replies:
+            name = self.HVNames.get(comm)
+            if name is None or result is None: continue
+            try: 
+                value = self.HVDecoders[name](result[3:].rstrip('\r\n'))
+            except ValueError: 
+                self.parse_errors[name] = self.parse_errors.get(name,0)+1
+                #readValue will fall back to readCommand, that records the missreading
+                snapshot.pop(name,None)
+                continue
+            snapshot[name] = (value,date,PyTango.AttrQuality.ATTR_VALID)
+            names.append(name)
+            if self.pressures and name in self.convertedNames: names.extend(self.convertCurrent(name,value,date,snapshot))
+        self.snapshot = snapshot
+        for i,name in enumerate(names):
+            if name in names[i+1:] or name not in snapshot: continue
+            value,date = snapshot[name][:2]
+            if name in self.histories: self.histories[name].append(date,value)
+            if name in self.stats: self.stats[name].add(date,value)
+            if name[:2]=='HV' and name[-2:] in (' V',' I'):
+                #Last two values of each channel are kept to detect oscillations (see updateState)
+                self.pushSample(int(name[2:-2]),name[-1],value)
+            if name in self.EVENT_ATTRIBUTES: self.pushEvents(self.EVENT_ATTRIBUTES[name],value,date)
+            if name.startswith('HV') and name.endswith('Status') and self.KeepAlivePeriod>0: 
+                self.updateChannelPolling(int(name[2:-len('Status')]),value)
+    
+    def pushSample(self, channel, quantity, value):
+        """ Replaces the [old,new] voltages or currents of the channel, never modified in place """
+        samples = self.voltages if quantity=='V' else self.currents
+        if channel in samples: samples[channel] = [samples[channel][1],value]
+
+    def processReply(self, comm, result, date):
+        """ Processes a single reply, see processReplies """
+        self.processReplies([(comm,result,date)])
+    
+    def convertCurrent(self, name, value, date, snapshot):
+        """
+        With PressureFromCurrent, adds to snapshot the pressure computed from a current reply,
+        or calibrates the conversion with a pressure reply; returns the names of the values added.
+        """
+        if name.startswith('Pump'):
+            #Pump type read or changed, a new pressure reading is needed to calibrate the conversion
+            channel = int(name[len('Pump'):])
+            if not self.pressures.isCalibrated(channel,value): self.SVD.setPolledNext(self.HVComms['HV%d P'%channel])
+            return []
+        channel = int(name[2:-2])
+        pump = snapshot.get('Pump%d'%channel,(None,))[0]
+        if not pump: 
+            return []
+        elif name.endswith(' P'):
+            #Compared with the last current if received in the same polling cycle
+            current = snapshot.get('HV%d I'%channel)
+            if current and abs(date-current[1])<=max((1.,self.SVD.period)):
+                self.pressures.calibrate(channel,pump,current[0],value)
+            return []
+        pressure = self.pressures.getPressure(channel,pump,value)
+        if pressure is None: return []
+        snapshot['HV%d P'%channel] = (pressure,date,PyTango.AttrQuality.ATTR_VALID)
+        return ['HV%d P'%channel]
+    
+    #Columns of the Readings attribute, one row per channel
+    READINGS_COLUMNS = ('HV%d P','HV%d V','HV%d I','HV%dStatus')
+    
+    def getReadings(self):
+        """
+        Rows of [P, V, I, status code, timestamp] for each channel, all taken from the same
+        snapshot; the timestamp is the oldest reply of the row, NaN for values not available.
+        """
+        snapshot,rows = self.snapshot,[]
+        for channel in self.getChannels():
+            row,dates = [],[]
+            for name in (c%channel for c in self.READINGS_COLUMNS):
+                if name not in self.HVComms:
+                    #Not measured by this kind of channel (e.g. V/I of gauges)
+                    value,date = float('nan'),None
+                elif name in snapshot:
+                    value,date = snapshot[name][:2]
+                else:
+                    #Not published by the polling thread (legacy mode or parse error)
+                    try: value,date = self.readValue(name,float),self.getDateQuality(name)[0]
+                    except: value,date = float('nan'),None
+                row.append(float(value))
+                if date: dates.append(date)
+            rows.append(row+[min(dates) if dates else float('nan')])
+        return rows
+    
+    def getChannelComms(self, channel):
+        """ Polled measurements of a channel, only meaningful while it is ON """
+        return [self.HVComms[c%channel] for c in ('HV%d V','HV%d I','HV%d P') if c%channel in self.HVComms]
+    
+    def updateChannelPolling(self, channel, status):
+        """ While a channel is OFF or interlocked its measurements are polled at KeepAlivePeriod """
+        if status>0: self.SVD.resume(self.getChannelComms(channel))
+        else: self.SVD.suspend(self.getChannelComms(channel),self.KeepAlivePeriod)
+    
+    def readValue(self, comm, _type):
+        """ Returns the value published by the polling thread, or decodes the SVD cache if not available """
+        snapshot = self.snapshot
+        if comm in snapshot: return snapshot[comm][0]
+        return self.readCommand(comm,_type)
+    
+    def getDateQuality(self, *comms):
+        """
+        Returns the reception time of the oldest reply of comms and its quality;
+        WARNING/INVALID if older than StaleLimits times the polling period of the command.
+        """
+        now,dates,quality = time.time(),[],PyTango.AttrQuality.ATTR_VALID
+        snapshot,lastRead = self.snapshot,getattr(self.SVD,'lastRead',None)
+        for comm in comms:
+            date = snapshot[comm][1] if comm in snapshot else 0
+            if not date and isinstance(lastRead,dict): date = lastRead.get(self.HVComms[comm],0)
+            if not date: 
+                #The polling thread does not provide reception times
+                date = now
+            if hasattr(self.SVD,'getPeriod'): period = self.SVD.getPeriod(self.HVComms[comm],now)
+            else: period = self.HVPeriods.get(comm)
+            age = (now-date)/(period or self.SVD.period or 1.)
+            if age>=self.StaleLimits[-1]: quality = PyTango.AttrQuality.ATTR_INVALID
+            elif age>=self.StaleLimits[0] and quality==PyTango.AttrQuality.ATTR_VALID: 
+                quality = PyTango.AttrQuality.ATTR_WARNING
+            dates.append(date)
+        return min(dates),quality
+    
+    def setValue(self, attr, value, *comms):
+        """ attr.set_value_date_quality using the reception time of the replies of comms """
+        date,quality = self.getDateQuality(*comms)
+        if isSequence(value): attr.set_value_date_quality(value,date,quality,len(value))
+        else: attr.set_value_date_quality(value,date,quality)
     
     def readCommand(self, comm, _type):
         """
@@ -216,21 +664,34 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
         BitField         8         Like the integer type, but with meanings associated to the number.s single bits
         Exponential         7         .x.xEsxx. where x is BCD digits, E is the 45h character and s is the (.+. o .-. sign
         String             n         Sequence of na  characters included within the 20h and 7Fh range
+        
+        Values are validated and converted by the decoder of each command (see MultiGaugeProtocol.DataFormats),
+        _type is used only for commands not declared through addCommand.
+        Each reply is decoded once, the value is kept in self.decoded until the SVD cache changes.
         """
         result=""
         self.debug('readCommand(%s)'%comm)
         try:
             result = self.SVD.getComm(self.HVComms[comm])
+            last = self.decoded.get(comm)
+            if last is not None and result is not None and last[0]==result:
+                return last[1]
+            raw = result
             ##OJORL! The 3 first characters are discarded (not 4). The initial '>' is discarded by the SVD class.
             if result is not None: 
                 self.debug('readCommand(%s): Data(%d,%s) readed: "%s"'%(comm,len(result)-3,result,result[3:]))
-                result=result[3:]
+                result=result[3:].rstrip('\r\n')
             
             if result is not None and len(result):
-                if re.match(self.REGEXPS[_type],result):
-                    if _type is bool: _type=int
+                decoder = self.HVDecoders.get(comm) or self.getTypeDecoder(_type)
+                try: value = decoder(result)
+                except ValueError: 
+                    value = None
+                    self.parse_errors[comm] = self.parse_errors.get(comm,0)+1
+                if value is not None:
                     self.exception = ''
-                    return _type(result)
+                    self.decoded[comm] = (raw,value)
+                    return value
                 elif hasattr(self,'read_Missreadings'): 
                     self.read_Missreadings(value=result)
                     print 'Missreadings are '+str(self.missreadings)
@@ -270,20 +731,38 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
         self.init_my_Logger()
         self.get_device_properties(self.get_device_class())
 
-        self.HV1Status,self.HV2Status=None,None
-        self.prevHV1Code=0,1
-        self.prevHV2Code=0,1
-        self.voltages = [[0,0],[0,0]] #old1,new1,old2,new2
-        self.currents = [[1e-9,1e-9],[1e-9,1e-9]] #old1,new1,old2,new2
+        #Per channel values, filled for each channel of ChannelTable
+        self.channels,self.configNames = [],set()
+        self.channelStatus = {}
+        self.prevCodes = {} #channel:(time,code)
+        self.voltages = {} #channel:[old,new]
+        self.currents = {} #channel:[old,new]
         self.exception,self.init_error,self.comms_report,self.channelstatus,self.oscillation='','','','',''
         self.last_state_change=0
+        self.state_key,self.state_expires=None,0
         self.last_serial_change=0
         self.event = threading.Event()
+        self.histories = {}
+        self.stats = {}
+        self.pressures,self.convertedNames = None,set()
+        self.snapshot = {}
+        self.decoded = {}
+        self.parse_errors = {}
+        self.state_lock = threading.Lock()
+        self.initWriteSessions()
         try:
             if not hasattr(self,'LogLevel'): self.LogLevel = 'INFO'
             self.info(''.join(("In ", self.get_name(), "::init_device(%s)"%self.LogLevel)))
             self.startTime = time.time()
             self.statesQueue = TimedQueue(self.get_state())
+            self.channels = self.parseChannelTable()
+            for channel in self.getChannels():
+                self.channelStatus[channel] = None
+                self.prevCodes[channel] = 0,1
+                self.voltages[channel] = [0,0]
+                self.currents[channel] = [1e-9,1e-9]
+            self.configNames = set(c%ch if '%' in c else c for c in self.CONFIG_COMMANDS for ch in self.getChannels())
+            self.info('ChannelTable: %s'%', '.join('%d:%s'%c for c in self.channels))
             if not hasattr(self,'Refresh') or not self.Refresh:
                 self.warning('Refresh attribute does not exists!')
                 self.Refresh=3.
@@ -301,68 +780,122 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
             else:
                 #The arguments for SerialVacuumDevice are:
                 #    tangoDevice=SerialLineName, period=minimum time between communications, wait=time waiting for answer
-                from VacuumController import SerialVacuumDevice
-                SerialVacuumDevice.LogLevel = self.LogLevel
-                self.SVD=SerialVacuumDevice(
-                    tangoDevice=self.SerialLine,
-                    period=self.Refresh,
-                    wait=0.2,
-                    retries=3,
-                    log=self.LogLevel,
-                    blackbox=self.BlackBox)
+                from DualTransport import isDirectLine,newTransport
+                if isDirectLine(self.SerialLine) and self.Pipeline<=0:
+                    self.warning('SerialLine %s is accessed directly, that requires Pipeline>0; using Pipeline=1'%self.SerialLine)
+                    self.Pipeline = 1
+                if self.Pipeline>0:
+                    #Polled commands are sent in bursts of Pipeline frames
+                    from DualPoller import DualPoller,DualEngine
+                    from DualBus import BusArbiter
+                    if self.PressureFromCurrent>0:
+                        #Pressure of HV channels is computed from every current reply, P Meas is polled only to calibrate it
+                        from DualPressure import PressureConverter
+                        self.pressures = PressureConverter()
+                        self.convertedNames = set(n%c for c in self.getChannels('HV') for n in ('HV%d I','HV%d P','Pump%d'))
+                    #With SharedEngine all the devices of the server are polled from a single thread
+                    shared = str(self.SharedEngine).lower() in ('true','yes')
+                    self.SVD=DualPoller(
+                        tangoDevice=self.SerialLine,
+                        period=self.Refresh,
+                        wait=0.2,
+                        retries=3,
+                        log=self.LogLevel,
+                        blackbox=self.BlackBox,
+                        pipeline=self.Pipeline,
+                        transport=newTransport(self.SerialLine),
+                        engine=DualEngine.instance(self.LogLevel) if shared else None,
+                        arbiter=BusArbiter.get(self.SharedBus) if self.SharedBus else None)
+                else:
+                    from VacuumController import SerialVacuumDevice
+                    SerialVacuumDevice.LogLevel = self.LogLevel
+                    self.SVD=SerialVacuumDevice(
+                        tangoDevice=self.SerialLine,
+                        period=self.Refresh,
+                        wait=0.2,
+                        retries=3,
+                        log=self.LogLevel,
+                        blackbox=self.BlackBox)
                 self.HVComms = {}
-                def addCommand(name,command,polling = 0):
+                self.HVDecoders = {}
+                self.HVNames = {}
+                self.HVPeriods = {}
+                def addCommand(name,command,polling = 0,priority = 0):
+                    factors = None
+                    if name in self.configNames and self.ConfigTTL>0 and self.Pipeline>0:
+                        #The TTL is not modified by the adaptive polling factors
+                        polling,factors = self.ConfigTTL,(1.,1.)
+                    elif name.startswith('HV') and name.endswith('Status'):
+                        #Never slowed down, a channel switched on from the front panel must be seen within its period
+                        factors = (None,1.)
+                    if self.pressures and name in self.convertedNames and name.endswith(' P'): 
+                        polling = max((polling,self.PressureFromCurrent))
                     self.HVComms[name] = command
+                    self.HVPeriods[name] = polling
+                    self.HVNames[command] = name
+                    self.HVDecoders[name] = self.getDecoder(command)
                     if polling>0:
                         self.SVD.addComm(command)
-                        self.SVD.setPolledComm(command,polling)
+                        if self.Pipeline>0: self.SVD.setPolledComm(command,polling,priority,factors)
+                        else: self.SVD.setPolledComm(command,polling)
                     return
                     
+                def addChannelCommands(period):
+                    #Commands of all channels with the same period are added together, so they are polled in the same bursts
+                    for channel,kind in self.channels:
+                        for name,command,polling,priority in self.CHANNEL_READS[kind]:
+                            if polling==period: addCommand(name%channel,self.packChannel(channel,command),polling,priority)
+                    
                 # READ COMMANDS #VARIAN DUAL PROTOCOL: MultiGauge Compatible (No Checksum)
-                addCommand('HV1 V',self.packMultiGauge(1,self.GeneralComms['V Meas'],'?'),1.)
-                addCommand('HV1 I',self.packMultiGauge(1,self.GeneralComms['I Meas'],'?'),1.)
-                addCommand('HV1 P',self.packMultiGauge(1,self.GeneralComms['P Meas'],'?'),1.)
-                addCommand('HV2 V',self.packMultiGauge(2,self.GeneralComms['V Meas'],'?'),1.)
-                addCommand('HV2 I',self.packMultiGauge(2,self.GeneralComms['I Meas'],'?'),1.)
-                addCommand('HV2 P',self.packMultiGauge(2,self.GeneralComms['P Meas'],'?'),1.)        
-                
-                addCommand('ModeLocal',self.packMultiGauge(0,self.GeneralComms['Local/Remote'],'?'),10.)
-                addCommand('Remote Error',self.packMultiGauge(0,self.GeneralComms['Remote Error'],'?'),10.)
-                addCommand('Interlock',self.packMultiGauge(0,self.GeneralComms['Interlock'],'?'),10.)
-                addCommand('ErrorStatus',self.packMultiGauge(1,self.GeneralComms['Error Status'],'?'),10.)
-                addCommand('HV1Status',self.packMultiGauge(1,self.GeneralComms['HV On/Off'],'?'),10.)
-                addCommand('HV2Status',self.packMultiGauge(2,self.GeneralComms['HV On/Off'],'?'),10.)
-                addCommand('HV1Step',self.packMultiGauge(1,self.HighVoltageCommands['fixed/step'],'?'),10.)
-                addCommand('HV1Protect',self.packMultiGauge(1,self.HighVoltageCommands['start/protect'],'?'),10.)
-                addCommand('HV2Step',self.packMultiGauge(2,self.HighVoltageCommands['fixed/step'],'?'),10.)
-                addCommand('HV2Protect',self.packMultiGauge(2,self.HighVoltageCommands['start/protect'],'?'),10.)
-                addCommand('HV1 IProtect',self.packMultiGauge(1,self.HighVoltageCommands['Iprotect'],'?'),10.)
-                addCommand('HV2 IProtect',self.packMultiGauge(2,self.HighVoltageCommands['Iprotect'],'?'),10.)
-                addCommand('HV1 PSetPoint',self.packMultiGauge(1,self.HighVoltageCommands['SetPt1'],'?'),10.)
-                addCommand('HV2 PSetPoint',self.packMultiGauge(2,self.HighVoltageCommands['SetPt1'],'?'),10.)                
-                
-                addCommand('Firmware',self.packMultiGauge(0,self.GeneralComms['Firmware'],'?'),60.)
-                addCommand('Pump1',self.packMultiGauge(1,self.GeneralComms['Device Type'],'?'),60.)
-                addCommand('Pump2',self.packMultiGauge(2,self.GeneralComms['Device Type'],'?'),60.)
+                for period in (1.,10.,60.):
+                    for name,channel,command,polling,priority in self.GENERAL_READS:
+                        if polling==period: addCommand(name,self.packChannel(channel,command),polling,priority)
+                    addChannelCommands(period)
                 
                 # WRITE COMMANDS
                 # THESE COMMANDS MUST NOT BE ADDED TO THE COMMON COMMANDS LIST (so will not be polled)!!!!!
                 self.HVComms['Serial On'] = self.packMultiGauge(0,self.GeneralComms['Local/Remote'],'2')
                 self.HVComms['Serial Off'] = self.packMultiGauge(0,self.GeneralComms['Local/Remote'],'0')
-                self.HVComms['HV1 On'] = self.packMultiGauge(1,self.GeneralComms['HV On/Off'],'1')
-                self.HVComms['HV1 Off'] = self.packMultiGauge(1,self.GeneralComms['HV On/Off'],'0')
-                self.HVComms['HV2 On'] = self.packMultiGauge(2,self.GeneralComms['HV On/Off'],'1')
-                self.HVComms['HV2 Off'] = self.packMultiGauge(2,self.GeneralComms['HV On/Off'],'0')
-                self.HVComms['HV1setFixed'] = self.packMultiGauge(1,self.HighVoltageCommands['fixed/step'],'0')
-                self.HVComms['HV1setStep'] = self.packMultiGauge(1,self.HighVoltageCommands['fixed/step'],'1')
-                self.HVComms['HV1setStart'] = self.packMultiGauge(1,self.HighVoltageCommands['start/protect'],'0')
-                self.HVComms['HV1setProtect'] = self.packMultiGauge(1,self.HighVoltageCommands['start/protect'],'1')
-                self.HVComms['HV2setFixed'] = self.packMultiGauge(2,self.HighVoltageCommands['fixed/step'],'0')
-                self.HVComms['HV2setStep'] = self.packMultiGauge(2,self.HighVoltageCommands['fixed/step'],'1')
-                self.HVComms['HV2setStart'] = self.packMultiGauge(2,self.HighVoltageCommands['start/protect'],'0')
-                self.HVComms['HV2setProtect'] = self.packMultiGauge(2,self.HighVoltageCommands['start/protect'],'1')
+                for channel,kind in self.channels:
+                    for name,command,data in self.CHANNEL_WRITES[kind]:
+                        self.HVComms[name%channel] = self.packChannel(channel,command,data)
     
-                self.SVD.period = max((self.Refresh,len(self.SVD.pollingList)*.1))
+                if self.Pipeline>0:
+                    #Each burst costs a single round trip; the cycle period just limits the bus load
+                    self.SVD.period = .1*len(self.SVD.pollingList)/self.Pipeline
+                else:
+                    self.SVD.period = max((self.Refresh,len(self.SVD.pollingList)*.1))
+                
+                if self.Pipeline>0:
+                    #Adaptive polling, periods are shortened while values change
+                    self.SVD.budget = self.PollingBudget
+                    self.SVD.factors = (min(self.PollingFactors),max(self.PollingFactors))
+                    self.SVD.changeCheck = self.checkChanged
+                
+                if hasattr(self.SVD,'addListener'):
+                    #Events and histories are updated by the polling thread, not by the attribute reads
+                    self.last_events = {}
+                    self.event_thresholds = self.parseEventThresholds()
+                    for attr in self.EVENT_ATTRIBUTES.values():
+                        self.set_change_event(attr,True,False)
+                        self.set_archive_event(attr,True,False)
+                    if self.HistorySize>self.MAX_HISTORY:
+                        self.warning('HistorySize: %d exceeds the size of the history attributes, using %d'%(
+                            self.HistorySize,self.MAX_HISTORY))
+                        self.HistorySize = self.MAX_HISTORY
+                    if self.HistorySize>0:
+                        from DualHistory import HistoryBuffer
+                        self.histories = dict((name,HistoryBuffer(self.HistorySize)) for name in self.HISTORY_ATTRIBUTES
+                            if name in self.HVComms)
+                    if len(self.StatsWindows)>self.MAX_STATS_WINDOWS:
+                        self.warning('StatsWindows: only %d windows are allowed, %s ignored'%(
+                            self.MAX_STATS_WINDOWS,list(self.StatsWindows)[self.MAX_STATS_WINDOWS:]))
+                        self.StatsWindows = list(self.StatsWindows)[:self.MAX_STATS_WINDOWS]
+                    if len(self.StatsWindows):
+                        from DualHistory import RollingStats
+                        self.stats = dict((name,RollingStats(self.StatsWindows)) for name in self.HVComms
+                            if name[:2]=='HV' and name[-2:] in (' P',' V',' I'))
+                    self.SVD.addListener(self.processReplies,batch=True)
     
                 self.SVD.start() #self.SVD.updateThread.start()
                 self.WarmUp()
@@ -380,6 +913,45 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
 #------------------------------------------------------------------
     def always_executed_hook(self):
         self.debug("In "+self.get_name()+"::always_executed_hook()")
+        """
+        State and Status are recomputed by updateState only when the polling thread
+        has received new data (or communication errors), or when a timed transition
+        (communication timeout, states kept in statesQueue) is due; otherwise the
+        last State/Status are kept.
+        """
+        try:
+            if self.SerialLine and self.SVD: 
+                key = (self.SVD.init,self.SVD.errors,self.SVD.lasttime)
+                #If another thread (e.g. a command not serialized by Tango) is updating the state the last one is kept
+                if (key!=self.state_key or time.time()>=self.state_expires) and self.state_lock.acquire(False):
+                    try:
+                        self.state_key = key
+                        self.updateState()
+                    finally:
+                        self.state_lock.release()
+            else:
+                self.set_state(DevState.FAULT)
+                self.set_status('SerialLine property must be initialized!')
+                self.error(self.get_status())
+        
+        except Exception,e:
+            self.error('Exception in always_executed_hook: %s'%str(e))
+            print traceback.format_exc()                
+
+    WRONG_STATES = {
+        'PanelInterlock': DevState.DISABLE, #Read -3 2Dh33h Power off caused by Interlock Panel
+        'RemoteInterlock': DevState.ALARM, #Read -4 2Dh34h Power off caused by Remote I/O Interlock
+        'CableInterlock': DevState.FAULT, #Read -3 2Dh33h Power off caused by Cable Interlock
+        'HVTemperature': DevState.FAULT, #Read -8 2Dh38h Power off caused by HV Overtemperature
+        'RemoteFault': DevState.FAULT, #Read -7 2Dh37h Power off caused by Remote I/O not Present or Remote I/O Fault
+        'HVProtect': DevState.ALARM, #Read -6 2Dh36h Power off caused by HV Protect
+        'HVShortCircuit': DevState.FAULT #Read -7 2Dh37h Power off caused by HV Short Circuit
+        }
+    
+    #Maximum time a computed State/Status is kept without new data
+    STATE_REFRESH = 10.
+    
+    def updateState(self):
         """ State Machine Description:
         Communications are prioritary:
             DevState.INIT if variables has not been readed yet
@@ -389,89 +961,74 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
             DevState.DISABLE=PanelInterlock
             DevState.FAULT=HardwareError,CableInterlock
         """
-        try:
-            if self.SerialLine and self.SVD: 
-                state = self.get_state()
-                prev,channelstatus=state,''
-                wrongstates={
-                    'PanelInterlock': DevState.DISABLE, #Read -3 2Dh33h Power off caused by Interlock Panel
-                    'RemoteInterlock': DevState.ALARM, #Read -4 2Dh34h Power off caused by Remote I/O Interlock
-                    'CableInterlock': DevState.FAULT, #Read -3 2Dh33h Power off caused by Cable Interlock
-                    'HVTemperature': DevState.FAULT, #Read -8 2Dh38h Power off caused by HV Overtemperature
-                    'RemoteFault': DevState.FAULT, #Read -7 2Dh37h Power off caused by Remote I/O not Present or Remote I/O Fault
-                    'HVProtect': DevState.ALARM, #Read -6 2Dh36h Power off caused by HV Protect
-                    'HVShortCircuit': DevState.FAULT #Read -7 2Dh37h Power off caused by HV Short Circuit
-                    }
-                        
-                #Checking Communications status
-                if self.SVD.init == False: #If done in 2 lines to avoid changing to ON by default
-                    state,channelstatus = DevState.INIT,'Hardware values not read yet, started at %s'%time.ctime(self.startTime)
-                elif self.SVD.errors>=len(self.SVD.readList) or self.SVD.lasttime<time.time()-2*60:
-                    state,channelstatus=DevState.UNKNOWN,'Unable to communicate with the device since %s'%time.ctime(self.SVD.lasttime)
-                    #self.set_state(state)
+        state = self.get_state()
+        prev,channelstatus=state,''
+        wrongstates=self.WRONG_STATES
                 
-                #Checking interlock state through HV1/HV2 Status
-                else: 
-                    error_status = self.read_ErrorStatus()
-                    self.read_HV1Status()
-                    self.read_HV2Status()
-                    channelstatus='High Voltage 1 is %s, High Voltage 2 is %s\n'%(self.HV1Status,self.HV2Status)
-                    if error_status: 
-                        channelstatus+='ERROR: %s\n'%error_status
-                        print '*'*80
-                        print channelstatus
-                        print '*'*80
-                    if self.HV1Status in wrongstates.keys(): 
-                        state=wrongstates[self.HV1Status]
-                    elif self.HV2Status in wrongstates.keys(): 
-                        state=wrongstates[self.HV2Status]
-                    elif error_status: state=DevState.FAULT
-                    elif not any([s.lower()=='on' for s in [self.HV1Status,self.HV2Status] if s]): state=DevState.OFF                           
-                    elif self.DefaultStatus and any(s.lower()!=ss.lower() for s,ss in zip((self.HV1Status,self.HV2Status),self.DefaultStatus.split(','))): 
-                        state=DevState.ALARM
-                        channelstatus+='Channel Status (%s,%s) differ from defaults (%s)'%(self.HV1Status,self.HV2Status,self.DefaultStatus)
-                    else: state=DevState.ON
-                    
-                    #Checking oscillations
-                    for old,new in self.voltages:
-                        if old and new and abs(old-new)>=100:
-                            state=DevState.MOVING
-                            self.oscillation = 'Voltage oscillates between %s and %s\n' % (old,new)
-                            break
-                    for old,new in self.currents:
-                        if old and new and not (.5<(old/new)<1.5 ):
-                            state=DevState.MOVING
-                            self.oscillation = 'Current oscillates between %s and %s\n' % (old,new)
-                            break                     
+        #Checking Communications status
+        if self.SVD.init == False: #If done in 2 lines to avoid changing to ON by default
+            state,channelstatus = DevState.INIT,'Hardware values not read yet, started at %s'%time.ctime(self.startTime)
+        elif self.SVD.errors>=len(self.SVD.readList) or self.SVD.lasttime<time.time()-2*60:
+            state,channelstatus=DevState.UNKNOWN,'Unable to communicate with the device since %s'%time.ctime(self.SVD.lasttime)
+            #self.set_state(state)
+        
+        #Checking interlock state through the status of each channel
+        else: 
+            error_status = self.read_ErrorStatus()
+            statuses = [self.readChannelStatus(c) for c in self.getChannels()]
+            channelstatus=', '.join('%s %d is %s'%(self.CHANNEL_LABELS[k],c,s) for (c,k),s in zip(self.channels,statuses))+'\n'
+            if error_status: 
+                channelstatus+='ERROR: %s\n'%error_status
+                self.debug(channelstatus.strip())
+            wrong = [s for s in statuses if s in wrongstates]
+            if wrong: 
+                state=wrongstates[wrong[0]]
+            elif error_status: state=DevState.FAULT
+            elif not any([s.lower()=='on' for s in statuses if s]): state=DevState.OFF                           
+            elif self.DefaultStatus and any(s.lower()!=ss.strip().lower() for s,ss in zip(statuses,self.DefaultStatus.split(','))): 
+                state=DevState.ALARM
+                channelstatus+='Channel Status (%s) differ from defaults (%s)'%(','.join(statuses),self.DefaultStatus)
+            else: state=DevState.ON
             
-                if prev!=state and self.statesQueue.index(state) is None:
-                    #Any Wrong State should be kept at least for 20 seconds!
-                    self.statesQueue.append(state,1 if state==DevState.ON else 20)
-                
-                #Getting next state to process (it will be actual state if there's no new states in queue)
-                state=self.statesQueue.pop()
-                if state == DevState.MOVING: channelstatus+=self.oscillation
-                else: self.oscillation = ''
-                
-                self.comms_report=self.SVD.getReport()
-                status = '\n'.join(s for s in [channelstatus,self.Description,self.init_error,self.comms_report,'',self.exception.replace('\n',''),] if s)
-                if state is None: self.error('The StateQueue is EMPTY!!!')
-                elif prev!=state:
-                    self.info('*'*80)
-                    self.info('%s.State changed from %s to %s'%(self.get_name(),str(prev),str(state)))
-                    self.info(status)
-                    self.info('*'*80)
-                    self.last_state_change=time.time()
-                    self.set_state(state)
-                self.set_status(status[:200])
-            else:
-                self.set_state(DevState.FAULT)
-                self.set_status('SerialLine property must be initialized!')
-                self.error(self.get_status())
+            #Checking oscillations
+            for old,new in self.voltages.values():
+                if old and new and abs(old-new)>=100:
+                    state=DevState.MOVING
+                    self.oscillation = 'Voltage oscillates between %s and %s\n' % (old,new)
+                    break
+            for old,new in self.currents.values():
+                if old and new and not (.5<(old/new)<1.5 ):
+                    state=DevState.MOVING
+                    self.oscillation = 'Current oscillates between %s and %s\n' % (old,new)
+                    break                     
+    
+        if prev!=state and self.statesQueue.index(state) is None:
+            #Any Wrong State should be kept at least for 20 seconds!
+            self.statesQueue.append(state,1 if state==DevState.ON else 20)
         
-        except Exception,e:
-            self.error('Exception in always_executed_hook: %s'%str(e))
-            print traceback.format_exc()                
+        #Getting next state to process (it will be actual state if there's no new states in queue)
+        state=self.statesQueue.pop()
+        if state == DevState.MOVING: channelstatus+=self.oscillation
+        else: self.oscillation = ''
+        
+        self.comms_report=self.SVD.getReport()
+        status = '\n'.join(s for s in [channelstatus,self.Description,self.init_error,self.comms_report,'',self.exception.replace('\n',''),] if s)
+        if state is None: self.error('The StateQueue is EMPTY!!!')
+        elif prev!=state:
+            self.info('*'*80)
+            self.info('%s.State changed from %s to %s'%(self.get_name(),str(prev),str(state)))
+            self.info(status)
+            self.info('*'*80)
+            self.last_state_change=time.time()
+            self.set_state(state)
+        self.set_status(status[:200])
+        
+        #Next time the State must be recomputed even if no new data is received
+        now = time.time()
+        expires = [now+self.STATE_REFRESH]
+        if self.SVD.init: expires.append(self.SVD.lasttime+2*60)
+        if len(self.statesQueue)>1: expires.append(self.statesQueue[0][2])
+        self.state_expires = min(expires)
 
 #==================================================================
 #
@@ -487,84 +1044,34 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
 
 
 #------------------------------------------------------------------
-#    Read V1 attribute
-#------------------------------------------------------------------
-    @self_locked
-    def read_V1(self, attr):
-        self.debug("In "+self.get_name()+"::read_V1()")
-        
-        #    Add your own code here        
-        attr_V1_read = self.readCommand('HV1 V',long)
-        self.voltages[0][0],self.voltages[0][1] = self.voltages[0][1],attr_V1_read
-        attr.set_value(attr_V1_read)        
-
-
-#------------------------------------------------------------------
-#    Read V2 attribute
+#    Read V1/V2/.../I1/.../P1/... attributes
 #------------------------------------------------------------------
-    @self_locked
-    def read_V2(self, attr):
-        self.debug("In "+self.get_name()+"::read_V2()")
+    def read_Measure(self, attr):
+        aname = attr.get_name()
+        self.debug("In "+self.get_name()+"::read_%s()"%aname)
         
         #    Add your own code here
-        
-        attr_V2_read = self.readCommand('HV2 V',long)
-        self.voltages[1][0],self.voltages[1][1] = self.voltages[1][1],attr_V2_read
-        attr.set_value(attr_V2_read)
-
-
-#------------------------------------------------------------------
-#    Read I1 attribute
-#------------------------------------------------------------------
-    @self_locked
-    def read_I1(self, attr):
-        self.debug("In "+self.get_name()+"::read_I1()")
-        
-        #    Add your own code here
-        
-        attr_I1_read = self.readCommand('HV1 I',float)
-        self.currents[0][0],self.currents[0][1] = self.currents[0][1],attr_I1_read
-        attr.set_value(attr_I1_read)
-
-
-#------------------------------------------------------------------
-#    Read I2 attribute
-#------------------------------------------------------------------
-    @self_locked
-    def read_I2(self, attr):
-        self.debug("In "+self.get_name()+"::read_I2()")
-        
-        #    Add your own code here
-        
-        attr_I2_read = self.readCommand('HV2 I',float)
-        self.currents[1][0],self.currents[1][1] = self.currents[1][1],attr_I2_read
-        attr.set_value(attr_I2_read)
-
-
-#------------------------------------------------------------------
-#    Read P1 attribute
-#------------------------------------------------------------------
-    @self_locked
-    def read_P1(self, attr):
-        self.debug("In "+self.get_name()+"::read_P1()")
-        
-        #    Add your own code here
-        
-        attr_P1_read = self.readCommand('HV1 P',float)
-        attr.set_value(attr_P1_read)
-
-
-#------------------------------------------------------------------
-#    Read P2 attribute
-#------------------------------------------------------------------
-    @self_locked
-    def read_P2(self, attr):
-        self.debug("In "+self.get_name()+"::read_P2()")
-        
-        #    Add your own code here
-        
-        attr_P2_read = self.readCommand('HV2 P',float)
-        attr.set_value(attr_P2_read)
+        quantity,channel = aname[0].upper(),int(aname[1:])
+        name = 'HV%d %s'%(channel,quantity)
+        self.checkChannel(name,'read_%s'%aname)
+        value = self.readValue(name,{'V':long,'I':float,'P':float}[quantity])
+        if not hasattr(self.SVD,'addListener') and quantity in 'VI':
+            #Legacy pollers do not notify the replies, oscillations are detected on reads
+            self.pushSample(channel,quantity,value)
+        self.setValue(attr,value,name)
+    
+    read_V1=read_Measure
+    read_V2=read_Measure
+    read_V3=read_Measure
+    read_V4=read_Measure
+    read_I1=read_Measure
+    read_I2=read_Measure
+    read_I3=read_Measure
+    read_I4=read_Measure
+    read_P1=read_Measure
+    read_P2=read_Measure
+    read_P3=read_Measure
+    read_P4=read_Measure
         
 #------------------------------------------------------------------
 #    Read IonPumpsConfig attribute
@@ -573,18 +1080,12 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
         self.info( "In "+ self.get_name()+ "::read_IonPumpsConfig()")
         
         #    Add your own code here
-        last_read_time,last_read_value = getattr(self,'_last_IonPumpsConfig',(0,[]))
-        #if time.time()>(last_read_time+60):
-            #commands = [self.packMultiGauge(i,self.GeneralComms['Device Type'],'?') for i in (1,2)]
-            #result = self.SendCommand(commands,'\n').strip().split('\n')
-        result = [self.readCommand('Pump%d'%i,str) for i in (1,2)]
+        #Pump types are polled every ConfigTTL and refreshed by write_IonPumpsConfig
+        names = ['Pump%d'%c for c in self.getChannels('HV')]
+        result = [self.readValue(n,str) for n in names]
         self.info( "\tPumps : %s"%(result))
         attr_IonPumpsConfig_read = [r.strip().replace(' ','').lower() for r in result]
-        attr.set_value(attr_IonPumpsConfig_read, len(attr_IonPumpsConfig_read))
-        self._last_IonPumpsConfig = (time.time(),attr_IonPumpsConfig_read)
-        #else:
-            #self.info("... getting IonPumps config from cache ...")
-            #attr.set_value_date_quality(last_read_value,last_read_time,PyTango.AttrQuality.ATTR_VALID,len(last_read_value))
+        self.setValue(attr,attr_IonPumpsConfig_read,*names)
 
 #------------------------------------------------------------------
 #    Write IonPumpsConfig attribute
@@ -594,13 +1095,14 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
         data=[]
         attr.get_write_value(data)
         #    Add your own code here
-        if len(data)!=2:
+        channels = self.getChannels('HV')
+        if len(data)!=len(channels):
             PyTango.Except.throw_exception('WrongDataLenght','Data length should be equal to NumOfChannels',
                 'write_IonPumpsConfig')
         commands = []
-        for chan in (1,2):
+        for chan,pump in zip(channels,data):
             numbers = [i for i,s in enumerate(self.DeviceTypes)
-                if data[chan-1].lower().strip().replace(' ','')==s.lower().strip().replace(' ','')
+                if pump.lower().strip().replace(' ','')==s.lower().strip().replace(' ','')
                 ]
             if not numbers:
                 PyTango.Except.throw_exception('UknownType','%s not in IonPumpTypes list'%data,'write_IonPumpsConfig')
@@ -629,10 +1131,9 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
         
         #    Add your own code here
         #setpoints = lambda d:','.join(s[3:] for s in map(astor.proxies[d].SendCommand,['#171?\n\r','#172?\n\r']))
-        protect1 = self.readCommand('HV1 IProtect',long)
-        protect2 = self.readCommand('HV2 IProtect',long)
-        attr_IProtectSetPoint_read = map(str,[protect1,protect2])
-        attr.set_value(attr_IProtectSetPoint_read, len(attr_IProtectSetPoint_read))
+        names = ['HV%d IProtect'%c for c in self.getChannels('HV')]
+        attr_IProtectSetPoint_read = [str(self.readValue(n,long)) for n in names]
+        self.setValue(attr,attr_IProtectSetPoint_read,*names)
         
 #---- PressureSetPoints attribute State Machine -----------------
 
@@ -654,14 +1155,11 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
 
         #    Add your own code here
         #[proxies['%s22/vc/ipct-%02d'%(d,i)].SendCommand('#1711.0E-07') for d,i,j in (('fe',1,1),('fe',1,2),('bl',1,1),('bl',1,2),('bl',2,1))]
-        if len(data)!=2:
-            PyTango.Except.throw_exception('WrongDataLenght','Data length should be equal to 2',
+        channels = self.getChannels('HV')
+        if len(data)!=len(channels):
+            PyTango.Except.throw_exception('WrongDataLenght','Data length should be equal to %d'%len(channels),
                 'write_IProtectSetPoint')
-        data = map(int,data)
-        self.SendCommand([
-            self.packMultiGauge(1,self.HighVoltageCommands['Iprotect'],'%05d'%data[0]),
-            self.packMultiGauge(2,self.HighVoltageCommands['Iprotect'],'%05d'%data[1])
-            ])
+        self.SendCommand([self.packChannel(c,'Iprotect','%05d'%int(d)) for c,d in zip(channels,data)])
                 
 #------------------------------------------------------------------
 #    Read CurrentSetPoints attribute
@@ -671,10 +1169,9 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
         
         #    Add your own code here
         #setpoints = lambda d:','.join(s[3:] for s in map(astor.proxies[d].SendCommand,['#171?\n\r','#172?\n\r']))
-        protect1 = self.readCommand('HV1 PSetPoint',float)
-        protect2 = self.readCommand('HV2 PSetPoint',float)
-        attr_PressureSetPoints_read = ['%1.1e'%s for s in (protect1,protect2)]
-        attr.set_value(attr_PressureSetPoints_read, len(attr_PressureSetPoints_read))
+        names = ['HV%d PSetPoint'%c for c in self.getChannels('HV')]
+        attr_PressureSetPoints_read = ['%1.1e'%self.readValue(n,float) for n in names]
+        self.setValue(attr,attr_PressureSetPoints_read,*names)
         
 #---- PressureSetPoints attribute State Machine -----------------
 
@@ -697,15 +1194,11 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
 
         #    Add your own code here
         #[proxies['%s22/vc/ipct-%02d'%(d,i)].SendCommand('#1711.0E-07') for d,i,j in (('fe',1,1),('fe',1,2),('bl',1,1),('bl',1,2),('bl',2,1))]
-        if len(data)!=2:
-            PyTango.Except.throw_exception('WrongDataLenght','Data length should be equal to 2',
+        channels = self.getChannels('HV')
+        if len(data)!=len(channels):
+            PyTango.Except.throw_exception('WrongDataLenght','Data length should be equal to %d'%len(channels),
                 'write_PressureSetPoints')
-        data = map(float,data)
-        self.SendCommand([
-            #self.packMultiGauge(1,self.HighVoltageCommands['Iprotect'],'%05d'%data[0]),
-            self.packMultiGauge(1,self.HighVoltageCommands['SetPt1'],'%1.1e'%data[0]),
-            self.packMultiGauge(2,self.HighVoltageCommands['SetPt1'],'%1.1e'%data[1])
-            ])
+        self.SendCommand([self.packChannel(c,'SetPt1','%1.1E'%float(d)) for c,d in zip(channels,data)])
 
 #------------------------------------------------------------------
 #    Read Interlock attribute
@@ -715,8 +1208,8 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
         
         #    Add your own code here
         
-        attr_Interlock_read = bool(int(self.readCommand('Interlock',str)))
-        attr.set_value(attr_Interlock_read)
+        attr_Interlock_read = bool(self.readValue('Interlock',int))
+        self.setValue(attr,attr_Interlock_read,'Interlock')
 
 
 #------------------------------------------------------------------
@@ -726,8 +1219,8 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
         self.debug("In "+self.get_name()+"::read_FirmwareVersion()")
         
         #    Add your own code here
-        attr_FirmwareVersion_read = self.readCommand('Firmware',str)
-        attr.set_value(attr_FirmwareVersion_read)
+        attr_FirmwareVersion_read = self.readValue('Firmware',str)
+        self.setValue(attr,attr_FirmwareVersion_read,'Firmware')
         
 #------------------------------------------------------------------
 #    Read SerialLine attribute
@@ -747,7 +1240,7 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
         
         #    Add your own code here
         attr_Mode_read = self.getModeLocal()
-        attr.set_value(attr_Mode_read)
+        self.setValue(attr,attr_Mode_read,'ModeLocal')
         try:
           if (time.time()>self.last_serial_change+60 
                   and str(self.ForceLocal.lower())  in ('true','yes') 
@@ -766,12 +1259,10 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
         
         #    Add your own code here
         attr_Mode_read = 'Unknown'
-        st1 = self.readCommand('HV1Step',bool)
-        st2 = self.readCommand('HV2Step',bool)
-        attr_Mode_read=['FIXED','STEP'][st1]
-        if st2!=st1:
-            attr_Mode_read+=';'+['FIXED','STEP'][st2]
-        attr.set_value(attr_Mode_read)
+        names = ['HV%dStep'%c for c in self.getChannels('HV')]
+        modes = [['FIXED','STEP'][self.readValue(n,bool)] for n in names]
+        attr_Mode_read=';'.join(m for i,m in enumerate(modes) if m not in modes[:i])
+        self.setValue(attr,attr_Mode_read,*names)
         try:
           if (time.time()>self.last_serial_change+60 
                   and str(self.ForceStep.lower()) in ('true','yes')
@@ -790,17 +1281,15 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
         
         #    Add your own code here
         attr_Mode_read = 'Unknown'
-        st1 = self.readCommand('HV1Protect',bool)
-        st2 = self.readCommand('HV2Protect',bool)
-        attr_Mode_read=['START','PROTECT'][st1]
-        if st2!=st1:
-            attr_Mode_read+=';'+['START','PROTECT'][st2]
-        attr.set_value(attr_Mode_read)
+        names = ['HV%dProtect'%c for c in self.getChannels('HV')]
+        modes = [['START','PROTECT'][self.readValue(n,bool)] for n in names]
+        attr_Mode_read=';'.join(m for i,m in enumerate(modes) if m not in modes[:i])
+        self.setValue(attr,attr_Mode_read,*names)
         try:
           if (time.time()>self.last_serial_change+60 
                   and str(self.ForceProtect.lower()) in ('true','yes')
                   and 'START' in attr_Mode_read 
-                  and self.HV1Status.lower()=='on'):
+                  and str(self.channelStatus.get(self.getChannels('HV')[0])).lower()=='on'):
               self.info('>'*80)
               self.info('ForceProtect=%s: Forcing PROTECT mode.'%self.ForceProtect)
               self.SetMode('protect')
@@ -808,34 +1297,29 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
 
 
 #------------------------------------------------------------------
-#    Read HV1Status attribute
+#    Read HV1Status/HV2Status/... attributes
 #------------------------------------------------------------------
-    def read_HV1Status(self, attr=None):
-        self.debug("In "+self.get_name()+"::read_HV1Status()")
-        
-        #    Add your own code here
-        attr_HV1Status_read = "Unknown"
-        st = self.readCommand('HV1Status',int)
-        for k,v in self.OnOffCoding.iteritems():
-            if v==st: attr_HV1Status_read = k
-        self.HV1Status=attr_HV1Status_read
+    def readChannelStatus(self, channel, attr=None):
+        """ Updates channelStatus with the On/Off name of the channel status, also returned """
+        name = 'HV%dStatus'%channel
+        st = self.readValue(name,int)
+        self.channelStatus[channel] = self.getOnOffName(st)
         if attr:
-            attr.set_value(attr_HV1Status_read)
-            
-#------------------------------------------------------------------
-#    Read HV2Status attribute
-#------------------------------------------------------------------
-    def read_HV2Status(self, attr=None):
-        self.debug("In "+self.get_name()+"::read_HV2Status()")
+            self.setValue(attr,self.channelStatus[channel],name)
+        return self.channelStatus[channel]
+    
+    def read_HVStatus(self, attr):
+        aname = attr.get_name()
+        self.debug("In "+self.get_name()+"::read_%s()"%aname)
         
         #    Add your own code here
-        attr_HV2Status_read = "Unknown"
-        st = self.readCommand('HV2Status',int)
-        for k,v in self.OnOffCoding.iteritems():
-            if v==st: attr_HV2Status_read = k
-        self.HV2Status=attr_HV2Status_read
-        if attr:
-            attr.set_value(attr_HV2Status_read)
+        self.checkChannel(aname,'read_%s'%aname)
+        self.readChannelStatus(int(aname[2:-len('Status')]),attr)
+    
+    read_HV1Status=read_HVStatus
+    read_HV2Status=read_HVStatus
+    read_HV3Status=read_HVStatus
+    read_HV4Status=read_HVStatus
 
 #------------------------------------------------------------------
 #    Read ErrorStatus attribute
@@ -844,22 +1328,108 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
         aname = attr and attr.get_name() or 'ErrorStatus'
         now=time.time()
         if aname=='ErrorStatus':
-            st = self.readCommand('ErrorStatus',int)
-        elif aname=='HV1Code':
-            st = self.readCommand('HV1Status',int)
-            if st and st!=self.prevHV1Code[1] and now<=self.prevHV1Code[0]+30:
-                st=self.prevHV1Code[1]
-        elif aname=='HV2Code':
-            st = self.readCommand('HV2Status',int)
-            if st and st!=self.prevHV2Code[1] and now<=self.prevHV2Code[0]+30:
-                st=self.prevHV2Code[1]
+            st = self.readValue('ErrorStatus',int)
+        elif aname.startswith('HV') and aname.endswith('Code'):
+            channel = int(aname[2:-len('Code')])
+            self.checkChannel('HV%dStatus'%channel,'read_%s'%aname)
+            st = self.readValue('HV%dStatus'%channel,int)
+            prev = self.prevCodes[channel]
+            if st and st!=prev[1] and now<=prev[0]+30:
+                st=prev[1]
         else: raise Exception('Error reading %s'%attr.get_name())
-        if attr: attr.set_value(st)
+        if attr: self.setValue(attr,st,'ErrorStatus' if aname=='ErrorStatus' else 'HV%dStatus'%channel)
         else: return self.DualControllerErrorStatus['HV'].get(str(st),'')
         
     read_HV1Code=read_ErrorStatus
     read_HV2Code=read_ErrorStatus
+    read_HV3Code=read_ErrorStatus
+    read_HV4Code=read_ErrorStatus
     
+#------------------------------------------------------------------
+#    Read P1History/P2History/V1History/... attributes
+#------------------------------------------------------------------
+    def read_History(self, attr):
+        aname = attr.get_name()
+        self.debug("In "+self.get_name()+"::read_%s()"%aname)
+        names = [k for k,v in self.HISTORY_ATTRIBUTES.items() if v.lower()==aname.lower()]
+        if not names or names[0] not in self.histories:
+            PyTango.Except.throw_exception('HistoryNotAvailable','%s requires Pipeline>0 and HistorySize>0'%aname,'read_History')
+        attr.set_value(self.histories[names[0]].get())
+    
+    read_P1History=read_History
+    read_P2History=read_History
+    read_V1History=read_History
+    read_V2History=read_History
+    read_I1History=read_History
+    read_I2History=read_History
+    read_HV1CodeHistory=read_History
+    read_HV2CodeHistory=read_History
+    read_P3History=read_History
+    read_P4History=read_History
+    read_V3History=read_History
+    read_V4History=read_History
+    read_I3History=read_History
+    read_I4History=read_History
+    read_HV3CodeHistory=read_History
+    read_HV4CodeHistory=read_History
+
+#------------------------------------------------------------------
+#    Read P1Stats/V1Stats/I1Stats/... attributes
+#------------------------------------------------------------------
+    def read_Stats(self, attr):
+        aname = attr.get_name()
+        self.debug("In "+self.get_name()+"::read_%s()"%aname)
+        name = 'HV%d %s'%(int(aname[1:-len('Stats')]),aname[0].upper())
+        if name not in self.stats:
+            PyTango.Except.throw_exception('StatsNotAvailable','%s requires Pipeline>0, StatsWindows and a channel measuring it'%aname,'read_Stats')
+        attr.set_value(self.stats[name].get())
+    
+    read_P1Stats=read_Stats
+    read_P2Stats=read_Stats
+    read_P3Stats=read_Stats
+    read_P4Stats=read_Stats
+    read_V1Stats=read_Stats
+    read_V2Stats=read_Stats
+    read_V3Stats=read_Stats
+    read_V4Stats=read_Stats
+    read_I1Stats=read_Stats
+    read_I2Stats=read_Stats
+    read_I3Stats=read_Stats
+    read_I4Stats=read_Stats
+
+#------------------------------------------------------------------
+#    Read Readings attribute
+#------------------------------------------------------------------
+    def read_Readings(self, attr):
+        self.debug("In "+self.get_name()+"::read_Readings()")
+        
+        #    Add your own code here
+        rows = self.getReadings()
+        date,quality = self.getDateQuality(*[c%ch for ch in self.getChannels() for c in self.READINGS_COLUMNS
+            if c%ch in self.HVComms])
+        attr.set_value_date_quality(rows,date,quality,len(rows[0]),len(rows))
+
+#------------------------------------------------------------------
+#    Read CommStats attribute
+#------------------------------------------------------------------
+    def read_CommStats(self, attr):
+        self.debug("In "+self.get_name()+"::read_CommStats()")
+        
+        #    Add your own code here
+        lines = []
+        if hasattr(self.SVD,'stats'):
+            lines.append('Cycle: %s'%self.SVD.cycle_stats)
+            lines.append('Cycle lateness: %s'%self.SVD.jitter_stats)
+            if getattr(self.SVD,'engine',None): lines.append(self.SVD.engine.getReport())
+            if getattr(self.SVD,'arbiter',None): lines.append(self.SVD.arbiter.getReport())
+            if self.pressures: lines.append(self.pressures.getReport())
+            for comm,stats in sorted(self.SVD.stats.items()):
+                name = self.HVNames.get(comm,comm.strip())
+                lines.append('%s: %s parse=%d'%(name,stats,self.parse_errors.get(name,0)))
+        lines.extend('%s: parse=%d'%(k,v) for k,v in sorted(self.parse_errors.items())
+            if self.HVComms.get(k) not in getattr(self.SVD,'stats',{}))
+        attr.set_value(lines, len(lines))
+
 #------------------------------------------------------------------
 #    Read Missreadings attribute
 #------------------------------------------------------------------
@@ -917,33 +1487,92 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
 #    argin:  DevString
 #    argout: DevString
 #------------------------------------------------------------------
+    @write_locked
     def SendCommand(self, argin, separator = '', mode=True):
         self.info("In "+self.get_name()+"::SendCommand(%s)"%argin)
         #    Add your own code here
         if mode:
-            local = time.time()>=self.last_serial_change+60 and self.ForceLocal
-            if not 'SERIAL' in self.getModeLocal(): self.SetMode('serial')
-        else: local = False
-        self.SVD.stop()
-        if self.SVD.Alive:
-            self.warning('SVD IS STILL ALIVE!!!')
+            #SERIAL mode is set (and LOCAL restored) by the session
+            with self.writeSession():
+                return self.SendCommand(argin,separator,mode=False)
         try:            
             result,argin = '',toSequence(argin)
-            for arg in argin:
-                result+=self.SVD.serialComm(arg)+separator
+            if hasattr(self.SVD,'submit'):
+                #Sent in the write lane before the next polling burst, polling is not stopped
+                futures = [self.SVD.submit(arg) for arg in argin]
+                timeout = self.SVD.getWriteTimeout(len(futures))
+                for future in futures:
+                    result+=future.result(timeout)+separator
+            else:
+                self.SVD.stop()
+                if self.SVD.Alive:
+                    self.warning('SVD IS STILL ALIVE!!!')
+                try:
+                    for arg in argin:
+                        result+=self.SVD.serialComm(arg)+separator
+                finally:
+                    self.SVD.start()
         except Exception, e:
             self.error(str(e))
             self.set_status(self.get_status())
             PyTango.Except.throw_exception('SendCommandError',str(e),'SendCommand')
-        self.SVD.start()
         if '!' in result:
             code = result[result.index('!')+1]
             self.error('ProtocolError%s: %s'%(code,self.ProtocolErrors[code]))
             #raise Exception('ProtocolError%s: %s'%(code,self.ProtocolErrors[code]))
             PyTango.Except.throw_exception('ProtocolError',self.ProtocolErrors[code],'SendCommand')
-        if mode and local: self.SetMode('local')
+        self.refreshConfig(argin)
         return result
         
+#------------------------------------------------------------------
+#    ResetStats command:
+#
+#    Description: Clears the communication statistics shown in CommStats
+#                
+#------------------------------------------------------------------
+    def ResetStats(self):
+        self.info("In "+self.get_name()+"::ResetStats()")
+        #    Add your own code here
+        if hasattr(self.SVD,'resetStats'): self.SVD.resetStats()
+        self.parse_errors = {}
+        return 'DONE'
+        
+#------------------------------------------------------------------
+#    GetReadings command:
+#
+#    Description: Returns the Readings attribute as a flat array
+#                
+#    argout: DevVarDoubleArray [P1, V1, I1, code1, time1, P2, V2, I2, code2, time2, ...]
+#------------------------------------------------------------------
+    def GetReadings(self):
+        self.debug("In "+self.get_name()+"::GetReadings()")
+        #    Add your own code here
+        return [v for row in self.getReadings() for v in row]
+        
+#------------------------------------------------------------------
+#    GetHistory command:
+#
+#    Description: Returns the values kept for a channel and quantity
+#                
+#    argin:  DevVarStringArray [channel, quantity (P/V/I/Code), since]
+#    argout: DevVarDoubleArray [time0, value0, time1, value1, ...]
+#------------------------------------------------------------------
+    def GetHistory(self, argin):
+        self.info("In "+self.get_name()+"::GetHistory(%s)"%argin)
+        #    Add your own code here
+        if len(argin) not in (2,3):
+            PyTango.Except.throw_exception('WrongArguments','Arguments are channel, quantity and since','GetHistory')
+        channel,quantity = int(argin[0]),argin[1].strip().upper()
+        since = float(argin[2]) if len(argin)>2 else 0
+        if since<0: since = time.time()+since
+        if quantity in ('P','V','I'): aname = '%s%dHistory'%(quantity,channel)
+        elif quantity in ('CODE','HV','STATUS'): aname = 'HV%dCodeHistory'%channel
+        else: PyTango.Except.throw_exception('WrongArguments','Unknown quantity %s'%quantity,'GetHistory')
+        names = [k for k,v in self.HISTORY_ATTRIBUTES.items() if v==aname]
+        if not names or names[0] not in self.histories:
+            PyTango.Except.throw_exception('HistoryNotAvailable','%s history not available'%aname,'GetHistory')
+        return self.histories[names[0]].get(since).flatten()
+        
 #------------------------------------------------------------------
 #    SetMode command:
 #
@@ -951,6 +1580,7 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
 #                
 #    argin:  DevString
 #------------------------------------------------------------------
+    @write_locked
     def SetMode(self, argin):
         self.info("In "+self.get_name()+"::SetMode(%s)"%argin)
         #    Add your own code here
@@ -961,37 +1591,26 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
                 self.writeCommand('Serial On',self.HVComms['Serial On'])
                 self.info('\tserial command sent, waiting for repply ...')
                 self.last_serial_change=time.time()
-                self.SVD.setPolledNext(self.HVComms['ModeLocal'])
-                while time.time()<self.last_serial_change+1.:
-                    self.event.wait(.05)
-                    if 'SERIAL' in self.getModeLocal(): break
+                self.waitValue('ModeLocal',int,lambda v: v==2,1.)
                 if 'SERIAL' not in self.getModeLocal():
-                    print self.warning('SetMode(SERIAL) failed?')
+                    self.warning('SetMode(SERIAL) failed?')
                     #raise Exception('SetMode(SERIAL) failed!')
                 self.info('Mode changed to serial in %s seconds.'%(time.time()-self.last_serial_change))
             else:
                 self.info('\tSERIAL mode already set %d seconds ago.'%(time.time()-self.last_serial_change))
         elif argin.lower()=='local':
-            self.writeCommand('Serial Off',self.HVComms['Serial Off'])
-            self.last_serial_change=0
+            if self.getSession():
+                #LOCAL is set once when the session ends
+                self.getSession().local = True
+            else:
+                self.writeCommand('Serial Off',self.HVComms['Serial Off'])
+                self.last_serial_change=0
         elif argin.lower() in ['fixed','step','start','protect']:
-            local = time.time()>=self.last_serial_change+SERIAL_WAIT and self.ForceLocal
-            self.SetMode('serial')
-            if argin.lower()=='fixed':
-                self.writeCommand('HV1setFixed',self.HVComms['HV1setFixed'])
-                self.writeCommand('HV2setFixed',self.HVComms['HV2setFixed'])
-                self.ForceStep = False
-            elif argin.lower()=='step':
-                self.writeCommand('HV1setStep',self.HVComms['HV1setStep'])
-                self.writeCommand('HV2setStep',self.HVComms['HV2setStep'])
-            elif argin.lower()=='start':
-                self.writeCommand('HV1setStart',self.HVComms['HV1setStart'])
-                self.writeCommand('HV2setStart',self.HVComms['HV2setStart'])
-            elif argin.lower()=='protect':
-                self.writeCommand('HV1setProtect',self.HVComms['HV1setProtect'])
-                self.writeCommand('HV2setProtect',self.HVComms['HV2setProtect'])
-                self.ForceProtect = False
-            if local: self.SetMode('local')
+            with self.writeSession() as session:
+                for channel in self.getChannels('HV'):
+                    session.write('HV%dset%s'%(channel,argin.lower().capitalize()))
+            if argin.lower()=='fixed': self.ForceStep = False
+            elif argin.lower()=='protect': self.ForceProtect = False
         return 'DONE'
 
 #------------------------------------------------------------------
@@ -1000,19 +1619,17 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
 #    Description: It enables both High Voltage Outputs of the device.
 #                
 #------------------------------------------------------------------
+    @write_locked
     def On(self):
         self.info("In "+self.get_name()+"::On()")
         #    Add your own code here
-        status = str(self.DefaultStatus or 'On,On').lower().strip()
-        local = time.time()>=self.last_serial_change+60 and self.ForceLocal
-        self.SetMode('serial')
-        if status.startswith('on'): 
-            self.writeCommand('HV1 On',self.HVComms['HV1 On'])
-            self.SVD.setPolledNext(self.HVComms['HV1Status'])
-        if status.endswith('on'):
-            self.writeCommand('HV2 On',self.HVComms['HV2 On'])
-            self.SVD.setPolledNext(self.HVComms['HV2Status'])
-        if local: self.SetMode('local')
+        #Channels without a DefaultStatus are switched on
+        defaults = [s.strip() for s in str(self.DefaultStatus or '').lower().split(',')]
+        with self.writeSession() as session:
+            for i,channel in enumerate(self.getChannels()):
+                if i<len(defaults) and defaults[i] not in ('','on'): continue
+                session.write('HV%d On'%channel)
+                self.pollChannel(channel)
         return 'DONE'
 
 #------------------------------------------------------------------
@@ -1021,16 +1638,14 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
 #    Description: It disables both high voltage outputs of the device
 #                
 #------------------------------------------------------------------
+    @write_locked
     def Off(self):
         self.info("In "+self.get_name()+"::Off()")
         #    Add your own code here
-        local = time.time()>=self.last_serial_change+60 and self.ForceLocal
-        self.SetMode('serial')
-        self.writeCommand('HV1 Off',self.HVComms['HV1 Off'])
-        self.SVD.setPolledNext(self.HVComms['HV1Status'])
-        self.writeCommand('HV2 Off',self.HVComms['HV2 Off'])
-        self.SVD.setPolledNext(self.HVComms['HV2Status'])
-        if local: self.SetMode('local')
+        with self.writeSession() as session:
+            for channel in self.getChannels():
+                session.write('HV%d Off'%channel)
+                self.pollChannel(channel)
         return 'DONE'
 
 #------------------------------------------------------------------
@@ -1039,12 +1654,11 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
 #    Description: It enables High Voltage Channel 1
 #                
 #------------------------------------------------------------------
+    @write_locked
     def OnHV1(self):
         self.info("In "+self.get_name()+"::OnHV1()")
         #    Add your own code here
-        self.writeCommand('HV1 On',self.HVComms['HV1 On'],mode=True)
-        self.SVD.setPolledNext(self.HVComms['HV1Status'])
-        return 'DONE'
+        return self.OnChannel(1)
 
 #------------------------------------------------------------------
 #    OnHV2 command:
@@ -1052,12 +1666,11 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
 #    Description: It enables High Voltage Channel 2
 #                
 #------------------------------------------------------------------
+    @write_locked
     def OnHV2(self):
         self.info("In "+self.get_name()+"::OnHV2()")
         #    Add your own code here
-        self.writeCommand('HV2 On',self.HVComms['HV2 On'],mode=True)
-        self.SVD.setPolledNext(self.HVComms['HV2Status'])
-        return 'DONE'
+        return self.OnChannel(2)
 
 #------------------------------------------------------------------
 #    OffHV1 command:
@@ -1065,12 +1678,11 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
 #    Description: It disables High Voltage Channel 1
 #                
 #------------------------------------------------------------------
+    @write_locked
     def OffHV1(self):
         self.info("In "+self.get_name()+"::OffHV1()")
         #    Add your own code here
-        self.writeCommand('HV1 Off',self.HVComms['HV1 Off'],mode=True)
-        self.SVD.setPolledNext(self.HVComms['HV1Status'])
-        return 'DONE'
+        return self.OffChannel(1)
 
 #------------------------------------------------------------------
 #    OffHV2 command:
@@ -1078,11 +1690,42 @@ class VarianDUAL(Dev4Tango, MultiGaugeProtocol):
 #    Description: It disables High Voltage Channel 2
 #                
 #------------------------------------------------------------------
+    @write_locked
     def OffHV2(self):
         self.info("In "+self.get_name()+"::OffHV2()")
         #    Add your own code here
-        self.writeCommand('HV2 Off',self.HVComms['HV2 Off'],mode=True)
-        self.SVD.setPolledNext(self.HVComms['HV2Status'])
+        return self.OffChannel(2)
+
+#------------------------------------------------------------------
+#    OnChannel command:
+#
+#    Description: It enables a channel of ChannelTable
+#                
+#    argin:  DevShort channel number
+#------------------------------------------------------------------
+    @write_locked
+    def OnChannel(self, argin):
+        self.info("In "+self.get_name()+"::OnChannel(%s)"%argin)
+        #    Add your own code here
+        self.checkChannel('HV%d On'%argin,'OnChannel')
+        self.writeCommand('HV%d On'%argin,self.HVComms['HV%d On'%argin],mode=True)
+        self.pollChannel(argin)
+        return 'DONE'
+
+#------------------------------------------------------------------
+#    OffChannel command:
+#
+#    Description: It disables a channel of ChannelTable
+#                
+#    argin:  DevShort channel number
+#------------------------------------------------------------------
+    @write_locked
+    def OffChannel(self, argin):
+        self.info("In "+self.get_name()+"::OffChannel(%s)"%argin)
+        #    Add your own code here
+        self.checkChannel('HV%d Off'%argin,'OffChannel')
+        self.writeCommand('HV%d Off'%argin,self.HVComms['HV%d Off'%argin],mode=True)
+        self.pollChannel(argin)
         return 'DONE'
 
 #==================================================================
@@ -1101,7 +1744,7 @@ class VarianDUALClass(PyTango.PyDeviceClass):
     device_property_list = {
         'SerialLine':
             [PyTango.DevString,
-            "SerialLine Device Server to connect with",
+            "SerialLine Device Server to connect with, or the port opened directly by the device: /dev/ttyS0[:baudrate] or tcp://host:port (Pipeline>0 only)",
             [''] ],
         'Refresh':
             [PyTango.DevDouble,
@@ -1125,7 +1768,7 @@ class VarianDUALClass(PyTango.PyDeviceClass):
             ['YES'] ],            
         'DefaultStatus':
             [PyTango.DevString,
-            "On/Off,On/Off; the expected status for each channel, empty if not used",
+            "On/Off,On/Off; the expected status for each channel of ChannelTable, empty if not used",
             [''] ],
         'Description':
             [PyTango.DevString,
@@ -1139,6 +1782,58 @@ class VarianDUALClass(PyTango.PyDeviceClass):
             [PyTango.DevLong,
             "Lenght of the serial line buffer to be kept for debugging",
             [0] ],
+        'Pipeline':
+            [PyTango.DevLong,
+            "Max number of polled frames written in a single burst, 0 to poll them one by one using SerialVacuumDevice",
+            [0] ],
+        'SharedEngine':
+            [PyTango.DevString,
+            "YES to poll all the devices of the server from a single thread instead of a thread per device (Pipeline>0 and /dev/tty or tcp:// SerialLine only, devices using a Tango Serial device keep their own thread as every call to it blocks)",
+            ['NO'] ],
+        'ChannelTable':
+            [PyTango.DevVarStringArray,
+            "channel:kind for each channel of the controller, kinds are HV (ion pump) and GAUGE (pressure and on/off only); e.g. 1:HV,2:HV for the DUAL or 1:HV,2:HV,3:GAUGE,4:GAUGE",
+            ['1:HV','2:HV'] ],
+        'SharedBus':
+            [PyTango.DevString,
+            "Name of the serial line if it is shared with other controllers (e.g. RS-485 or terminal server port); devices with the same SharedBus in this host poll it in turns (Pipeline>0 only)",
+            [''] ],
+        'EventThresholds':
+            [PyTango.DevVarStringArray,
+            "attribute,abs/rel/log,threshold; change and archive events pushed by the polling thread (Pipeline>0 only), log is the change in log10 units",
+            ['P1,log,0.05','P2,log,0.05','I1,rel,0.1','I2,rel,0.1','V1,abs,10','V2,abs,10'] ],
+        'StatsWindows':
+            [PyTango.DevVarDoubleArray,
+            "Windows (s) of the rolling statistics of P/V/I of each channel in the P1Stats/V1Stats/I1Stats/... attributes, up to 8, empty to disable them (Pipeline>0 only)",
+            [10.,60.,600.] ],
+        'HistorySize':
+            [PyTango.DevLong,
+            "Number of values kept for each channel and quantity in the history attributes, up to 86400 (Pipeline>0 only)",
+            [3600] ],
+        'PollingBudget':
+            [PyTango.DevDouble,
+            "Max frames per second sent by the polling thread, 0 for no limit (Pipeline>0 only)",
+            [0.] ],
+        'PollingFactors':
+            [PyTango.DevVarDoubleArray,
+            "Min and max factors applied to polling periods of changing/unchanged values (Pipeline>0 only)",
+            [.25,4.] ],
+        'KeepAlivePeriod':
+            [PyTango.DevDouble,
+            "Polling period of V/I/P of channels OFF or interlocked, 0 to poll them always at full rate (Pipeline>0 only)",
+            [30.] ],
+        'PressureFromCurrent':
+            [PyTango.DevDouble,
+            "0 to poll the pressure of ion pumps like V/I; otherwise the pressure is computed from each current reading using the pump type, and read from the controller every PressureFromCurrent seconds to calibrate the conversion (Pipeline>0 only)",
+            [0.] ],
+        'ConfigTTL':
+            [PyTango.DevDouble,
+            "Polling period of the configuration (firmware, pump types, set points, step/protect modes), that is also read after every write; not modified by PollingFactors; 0 to use the default periods (10 s for set points and modes, 60 s for firmware and pump types), that are always used with Pipeline=0",
+            [600.] ],
+        'StaleLimits':
+            [PyTango.DevVarDoubleArray,
+            "Age of a value, in number of polling periods, for its quality to become WARNING and INVALID",
+            [3.,10.] ],
         }
 
 
@@ -1207,6 +1902,24 @@ class VarianDUALClass(PyTango.PyDeviceClass):
         'SaveBlackBox':
             [[PyTango.DevString,"filename to export blackbox"],
             [PyTango.DevString,"filename to export blackbox"]],
+        'ResetStats':
+            [[PyTango.DevVoid, "Clears the communication statistics"],
+            [PyTango.DevString, "Clears the communication statistics"],
+            {'Display level':PyTango.DispLevel.EXPERT,} ],
+        'GetReadings':
+            [[PyTango.DevVoid, "Reads the measurements of all channels at once"],
+            [PyTango.DevVarDoubleArray, "P1, V1, I1, code1, time1, P2, V2, I2, code2, time2, ..."]],
+        'OnChannel':
+            [[PyTango.DevShort, "Switches On a channel of ChannelTable"],
+            [PyTango.DevString, "Switches On a channel of ChannelTable"],
+            {'Display level':PyTango.DispLevel.EXPERT,} ],
+        'OffChannel':
+            [[PyTango.DevShort, "Switches Off a channel of ChannelTable"],
+            [PyTango.DevString, "Switches Off a channel of ChannelTable"],
+            {'Display level':PyTango.DispLevel.EXPERT,} ],
+        'GetHistory':
+            [[PyTango.DevVarStringArray, "channel, quantity (P/V/I/Code), since (epoch or negative seconds from now)"],
+            [PyTango.DevVarDoubleArray, "time0, value0, time1, value1, ..."]],
         }
 
 
@@ -1273,7 +1986,7 @@ class VarianDUALClass(PyTango.PyDeviceClass):
         'IonPumpsConfig':
             [[PyTango.DevString,
             PyTango.SPECTRUM,
-            PyTango.READ_WRITE, 2]],       
+            PyTango.READ_WRITE, 4]],       
         'IonPumpTypes':
             [[PyTango.DevString,
             PyTango.SPECTRUM,
@@ -1281,7 +1994,7 @@ class VarianDUALClass(PyTango.PyDeviceClass):
         'IProtectSetPoints':
             [[PyTango.DevString,
             PyTango.SPECTRUM,
-            PyTango.READ_WRITE, 2],
+            PyTango.READ_WRITE, 4],
             {
                 'unit':"mA",
                 'format':"%4d",
@@ -1290,7 +2003,7 @@ class VarianDUALClass(PyTango.PyDeviceClass):
         'PressureSetPoints':
             [[PyTango.DevString,
             PyTango.SPECTRUM,
-            PyTango.READ_WRITE, 2],
+            PyTango.READ_WRITE, 4],
             {
                 'unit':"mbar",
                 'format':"%4d",
@@ -1344,7 +2057,35 @@ class VarianDUALClass(PyTango.PyDeviceClass):
             [[PyTango.DevString,PyTango.SPECTRUM,PyTango.READ, 256],{'Display Level':PyTango.DispLevel.EXPERT,} ],
         'BlackBox':
             [[PyTango.DevString,PyTango.SPECTRUM,PyTango.READ, 1024],{'Display Level':PyTango.DispLevel.EXPERT,} ],
+        'Readings':
+            [[PyTango.DevDouble,PyTango.IMAGE,PyTango.READ, 5, 4],
+            {'description':'One row per channel with pressure, voltage, current, status code and the timestamp of its oldest reply, all from the same polling snapshot',} ],
+        'CommStats':
+            [[PyTango.DevString,PyTango.SPECTRUM,PyTango.READ, 256],
+            {'Display Level':PyTango.DispLevel.EXPERT,
+             'description':'Per command requests, replies, timeouts, NACKs by code, parse errors and latency percentiles (s), and polling cycle statistics',} ],
         }
+    #Channels 3 and 4 of 4-channel controllers, see ChannelTable
+    for a in (3,4):
+        attr_list['V%d'%a] = [[PyTango.DevLong,PyTango.SCALAR,PyTango.READ],
+            {'unit':"V",'format':"%5d",'description':"Voltage for Channel %d"%a,} ]
+        attr_list['I%d'%a] = [[PyTango.DevDouble,PyTango.SCALAR,PyTango.READ],
+            {'unit':"mA",'format':"%5.2e",'description':"Current for Channel %d"%a,} ]
+        attr_list['P%d'%a] = [[PyTango.DevDouble,PyTango.SCALAR,PyTango.READ],
+            {'unit':"mbar",'format':"%5.2e",'description':"Pressure for Channel %d"%a,} ]
+        attr_list['HV%dStatus'%a] = [[PyTango.DevString,PyTango.SCALAR,PyTango.READ]]
+        attr_list['HV%dCode'%a] = [[PyTango.DevShort,PyTango.SCALAR,PyTango.READ],{'Display level':PyTango.DispLevel.EXPERT,} ]
+    #History attributes: one row per reply, columns are timestamp and value
+    for a in ['%s%d'%(q,c) for c in range(1,VarianDUAL.MAX_CHANNELS+1) for q in ('P','V','I','HV')]:
+        if a.startswith('HV'): a += 'Code'
+        attr_list[a+'History'] = [[PyTango.DevDouble,PyTango.IMAGE,PyTango.READ, 2, VarianDUAL.MAX_HISTORY],
+            {'description':'%s values received from the controller, columns are timestamp and value'%a,} ]
+    #Rolling statistics: window (s), n, mean, std, min, max and d(log value)/dt (1/s) for each of StatsWindows
+    for c in range(1,VarianDUAL.MAX_CHANNELS+1):
+        for a in ('P%d'%c,'V%d'%c,'I%d'%c):
+            attr_list[a+'Stats'] = [[PyTango.DevDouble,PyTango.SPECTRUM,PyTango.READ, 7*VarianDUAL.MAX_STATS_WINDOWS],
+                {'description':'%s statistics of each of StatsWindows: window (s), n, mean, std, min, max, d(log %s)/dt (1/s)'%(a,a),} ]
+    del a,c
 
 #------------------------------------------------------------------
 #    VarianDUALClass Constructor
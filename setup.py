@@ -37,6 +37,7 @@ print(__doc__)
 
 license = 'GPL-3.0'
 install_requires = ['fandango',
+                    'numpy',
                     'PyTango',]
 
 ## All the following defines are OPTIONAL
@@ -0,0 +1,151 @@
+#=============================================================================
+#
+# file :        test_DualBus.py
+#
+# description : Tests of BusArbiter queueing of several owners.
+#
+# project :    VacuumController Device Server
+#
+# $Author: srubio $
+#
+# copyleft :    Cells / Alba Synchrotron
+#               Bellaterra
+#               Spain
+#
+############################################################################
+#
+# This file is part of Tango-ds.
+#
+# Tango-ds is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Tango-ds is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+##########################################################################
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+import shutil
+import tempfile
+import threading
+
+from DualBus import BusArbiter
+
+class BusArbiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lockdir = tempfile.mkdtemp()
+        self.bus = BusArbiter('test',self.lockdir,gap=0.)
+        self.a,self.b,self.c,self.w = 'A','B','C','W'
+
+    def tearDown(self):
+        shutil.rmtree(self.lockdir)
+
+    def test_exclusive(self):
+        bus = self.bus
+        self.assertTrue(bus.acquire(self.a,timeout=0))
+        self.assertFalse(bus.acquire(self.b,timeout=.05))
+        self.assertEqual(bus.busy,1)
+        bus.release(self.a)
+        self.assertTrue(bus.acquire(self.b,timeout=0))
+        self.assertEqual(bus.transactions,2)
+
+    def test_turns(self):
+        #An owner that releases the bus goes after the ones already waiting
+        bus = self.bus
+        self.assertTrue(bus.acquire(self.a,timeout=0))
+        for o in (self.b,self.c): self.assertFalse(bus.acquire(o,timeout=0))
+        bus.release(self.a)
+        self.assertFalse(bus.acquire(self.a,timeout=0))
+        self.assertEqual(bus.waiting,[self.b,self.c,self.a])
+        order = []
+        for i in range(3):
+            owner = bus.waiting[0]
+            self.assertTrue(bus.acquire(owner,timeout=0))
+            order.append(owner)
+            bus.release(owner)
+        self.assertEqual(order,[self.b,self.c,self.a])
+
+    def test_writer_priority(self):
+        bus = self.bus
+        self.assertTrue(bus.acquire(self.a,timeout=0))
+        for o in (self.b,self.c): self.assertFalse(bus.acquire(o,timeout=0))
+        self.assertFalse(bus.acquire(self.w,write=True,timeout=0))
+        self.assertEqual(bus.waiting,[self.w,self.b,self.c])
+        bus.release(self.a)
+        self.assertFalse(bus.acquire(self.b,timeout=0))
+        self.assertTrue(bus.acquire(self.w,write=True,timeout=0))
+        self.assertEqual(bus.writes,1)
+        bus.release(self.w)
+        self.assertTrue(bus.acquire(self.b,timeout=0))
+
+    def test_threads(self):
+        bus,order,lock = self.bus,[],threading.Lock()
+        self.assertTrue(bus.acquire(self.a,timeout=0))
+        def transaction(owner, write):
+            if bus.acquire(owner,write,timeout=2.):
+                with lock: order.append(owner)
+                time.sleep(.01)
+                bus.release(owner)
+        threads = [threading.Thread(target=transaction,args=(o,o==self.w)) for o in (self.b,self.c)]
+        for t in threads:
+            t.start()
+            time.sleep(.05)
+        threads.append(threading.Thread(target=transaction,args=(self.w,True)))
+        threads[-1].start()
+        time.sleep(.05)
+        bus.release(self.a)
+        for t in threads: t.join(3.)
+        self.assertEqual(order,[self.w,self.b,self.c])
+
+    def test_release_waiting(self):
+        bus = self.bus
+        self.assertTrue(bus.acquire(self.a,timeout=0))
+        self.assertFalse(bus.acquire(self.b,timeout=0))
+        bus.release(self.b)
+        self.assertEqual(bus.waiting,[])
+        bus.release(self.a)
+        self.assertTrue(bus.acquire(self.c,timeout=0))
+
+    def test_processes(self):
+        #Two arbiters on the same lock files behave like two processes
+        bus,other = BusArbiter('test',self.lockdir),BusArbiter('test',self.lockdir)
+        stop,waited = threading.Event(),{self.a:0.,self.w:0.}
+        def poller(owner):
+            while not stop.isSet():
+                if other.acquire(owner,timeout=1.):
+                    time.sleep(.005)
+                    other.release(owner)
+        threads = [threading.Thread(target=poller,args=(o,)) for o in ('P1','P2')]
+        for t in threads: t.start()
+        try:
+            for owner,write in 5*((self.w,True),(self.a,False)):
+                time.sleep(.02)
+                t0 = time.time()
+                self.assertTrue(bus.acquire(owner,write,timeout=1.))
+                waited[owner] = max((waited[owner],time.time()-t0))
+                bus.release(owner)
+        finally:
+            stop.set()
+            for t in threads: t.join(2.)
+        #Neither the reads nor the write of the second process starve
+        self.assertTrue(waited[self.a]<.1,waited)
+        self.assertTrue(waited[self.w]<.05,waited)
+
+    def test_shared_instance(self):
+        self.assertTrue(BusArbiter.get('test-shared',self.lockdir) is BusArbiter.get('test-shared'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#=============================================================================
+#
+# file :        test_DualHistory.py
+#
+# description : Tests of HistoryBuffer and the rolling statistics, compared
+#            with numpy.
+#
+# project :    VacuumController Device Server
+#
+# $Author: srubio $
+#
+# copyleft :    Cells / Alba Synchrotron
+#               Bellaterra
+#               Spain
+#
+############################################################################
+#
+# This file is part of Tango-ds.
+#
+# Tango-ds is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Tango-ds is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+##########################################################################
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import math
+import random
+
+import numpy
+
+from DualPoller import RunningStats
+from DualHistory import HistoryBuffer,TrendStats,WindowStats,RollingStats
+
+class HistoryBufferTest(unittest.TestCase):
+
+    def test_not_full(self):
+        buff = HistoryBuffer(5)
+        for i in range(3): buff.append(i,10*i)
+        self.assertEqual(len(buff),3)
+        self.assertEqual(buff.get().tolist(),[[0,0],[1,10],[2,20]])
+
+    def test_wrap_around(self):
+        buff = HistoryBuffer(5)
+        for i in range(12): buff.append(i,10*i)
+        self.assertEqual(len(buff),5)
+        self.assertEqual(buff.get().tolist(),[[i,10*i] for i in range(7,12)])
+        self.assertEqual(buff.get(since=9.5).tolist(),[[10,100],[11,110]])
+        self.assertEqual(buff.get(since=100).shape,(0,2))
+
+    def test_clear(self):
+        buff = HistoryBuffer(2)
+        for i in range(3): buff.append(i,i)
+        buff.clear()
+        self.assertEqual(len(buff),0)
+        buff.append(5,5)
+        self.assertEqual(buff.get().tolist(),[[5,5]])
+
+class StatsTest(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(0)
+        self.t = [1e9+i*.7 for i in range(200)]
+        self.y = [1e-8*math.exp(-.002*(t-self.t[0])+rand.gauss(0,.05)) for t in self.t]
+
+    def test_running_merge(self):
+        parts = [RunningStats() for i in range(4)]
+        for i,y in enumerate(self.y): parts[i*4//len(self.y)].add(y)
+        stats = RunningStats()
+        for p in parts: stats.merge(p)
+        self.assertEqual(stats.n,len(self.y))
+        self.assertAlmostEqual(stats.mean/numpy.mean(self.y),1.,9)
+        self.assertAlmostEqual(stats.std/numpy.std(self.y,ddof=1),1.,9)
+        self.assertEqual((stats.min,stats.max),(min(self.y),max(self.y)))
+
+    def test_trend_merge(self):
+        logs = [math.log(y) for y in self.y]
+        parts = [TrendStats() for i in range(3)]
+        for i,(t,y) in enumerate(zip(self.t,logs)): parts[i%3].add(t,y)
+        trend = TrendStats()
+        for p in parts: trend.merge(p)
+        self.assertAlmostEqual(trend.slope/numpy.polyfit(self.t,logs,1)[0],1.,7)
+        self.assertEqual(TrendStats().merge(TrendStats()).slope,0.)
+
+    def test_window(self):
+        window = WindowStats(60.,buckets=10)
+        for t,y in zip(self.t,self.y): window.add(t,y)
+        now = self.t[-1]
+        w,n,mean,std,low,high,slope = window.get(now)
+        #Buckets of 6 s are dropped once they end before now-window
+        first = next(i for i,t in enumerate(self.t) if t-t%6.+6.>now-60.)
+        t,y = self.t[first:],self.y[first:]
+        self.assertEqual((w,n),(60.,len(y)))
+        self.assertAlmostEqual(mean/numpy.mean(y),1.,9)
+        self.assertAlmostEqual(std/numpy.std(y,ddof=1),1.,9)
+        self.assertEqual((low,high),(min(y),max(y)))
+        self.assertAlmostEqual(slope/numpy.polyfit(t,numpy.log(y),1)[0],1.,7)
+
+    def test_window_expired(self):
+        window = WindowStats(10.)
+        window.add(100.,1.)
+        result = window.get(200.)
+        self.assertEqual(result[:2],[10.,0])
+        self.assertTrue(all(math.isnan(v) for v in result[2:]))
+
+    def test_rolling(self):
+        stats = RollingStats((10.,60.),buckets=5)
+        for t,y in zip(self.t,self.y): stats.add(t,y)
+        values = stats.get(self.t[-1])
+        self.assertEqual(len(values),14)
+        self.assertEqual((values[0],values[7]),(10.,60.))
+        self.assertTrue(values[1]<values[8])
+
+if __name__ == '__main__':
+    unittest.main()
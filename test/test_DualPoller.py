@@ -0,0 +1,194 @@
+#=============================================================================
+#
+# file :        test_DualPoller.py
+#
+# description : Tests of the pipelined polling, the write lane and waitComm
+#            of DualPoller running on DualEmulatorTransport.
+#
+# project :    VacuumController Device Server
+#
+# $Author: srubio $
+#
+# copyleft :    Cells / Alba Synchrotron
+#               Bellaterra
+#               Spain
+#
+############################################################################
+#
+# This file is part of Tango-ds.
+#
+# Tango-ds is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Tango-ds is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+##########################################################################
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+
+from DualPoller import DualPoller,Future
+from DualEmulator import DualEmulator,DualEmulatorTransport
+
+class RecordingTransport(DualEmulatorTransport):
+    """ Keeps the number of frames of every write """
+    def __init__(self, emulator):
+        DualEmulatorTransport.__init__(self,emulator)
+        self.bursts = []
+
+    def write(self, data):
+        self.bursts.append(data.count(self.emulator.TERM))
+        DualEmulatorTransport.write(self,data)
+
+def newPoller(pipeline=4, period=.05, **kwargs):
+    emulator = DualEmulator(latency=.002,baud=0,seed=0)
+    emulator.hv = {1:1,2:1}
+    emulator.mode = 2
+    poller = DualPoller('DualEmulator',period=period,wait=.05,log='ERROR',
+        pipeline=pipeline,transport=RecordingTransport(emulator),**kwargs)
+    return poller,emulator
+
+class BurstTest(unittest.TestCase):
+
+    def setUp(self):
+        self.poller,self.emulator = newPoller(pipeline=4)
+        p = self.poller
+        self.frames = [p.packMultiGauge(c,p.GeneralComms[m]) for c in (1,2) for m in ('V Meas','I Meas','P Meas')]
+        for i,frame in enumerate(self.frames): p.setPolledComm(frame,1.,priority=i%2)
+
+    def test_cycle_in_bursts(self):
+        self.poller.readCycle()
+        self.assertEqual(self.poller.transport.bursts,[4,2])
+        self.assertEqual(self.emulator.requests,6)
+        for frame in self.frames:
+            reply = self.poller.getComm(frame)
+            self.assertTrue(reply and reply[:3]==frame[1:4],'%r: %r'%(frame,reply))
+        self.assertTrue(self.poller.init)
+
+    def test_due_order(self):
+        p,now = self.poller,time.time()
+        self.assertEqual(sorted(p.getDueComms(now)[:3]),sorted(f for i,f in enumerate(self.frames) if i%2))
+        p.readCycle()
+        self.assertEqual(p.getDueComms(time.time()),[])
+        p.setPolledNext(self.frames[0])
+        self.assertEqual(p.getDueComms(time.time()),[self.frames[0]])
+
+    def test_answers_out_of_order(self):
+        #Answers are matched by channel/command, not by position
+        p = self.poller
+        p.transport.emulator.write(''.join(self.frames[:2]))
+        time.sleep(.01)
+        answers = p.parser.feed(p.transport.read())
+        answers.reverse()
+        burst = p.beginBurst(self.frames[:2])
+        p.transport.read = lambda data=''.join(p.packAnswer(*a)+p.TERM for a in answers): data
+        self.assertTrue(p.pollBurst(burst))
+        self.assertEqual([a[:2] for a in burst.answers],[p.getFrameKey(f) for f in self.frames[:2]])
+
+    def test_lost_answer(self):
+        p = self.poller
+        self.emulator.drop = 1.
+        p.readCycle()
+        self.assertEqual([p.getComm(f) for f in self.frames],[None]*len(self.frames))
+        self.assertEqual(p.stats[self.frames[0]].timeouts,1)
+        self.assertFalse(p.init)
+
+    def test_stats_bounded(self):
+        p = self.poller
+        for i in range(5):
+            p.serialComm(p.packMultiGauge(1,p.HighVoltageCommands['SetPt1'],'%1.1E'%(i+1e-7)))
+        self.assertEqual(sorted(p.stats),[p.WRITES])
+        self.assertEqual(p.stats[p.WRITES].requests,5)
+
+    def test_adaptive_period(self):
+        p,frame = self.poller,self.frames[0]
+        for i in range(50): p.adapt(frame,False)
+        self.assertEqual(p.getPeriod(frame),p.factors[-1])
+        p.adapt(frame,True)
+        self.assertEqual(p.getPeriod(frame),p.factors[-1]/2.)
+        for i in range(50): p.adapt(frame,True)
+        self.assertEqual(p.getPeriod(frame),p.factors[0])
+
+    def test_fixed_factors(self):
+        p,frame = self.poller,self.frames[1]
+        p.setPolledComm(frame,1.,factors=(1.,1.))
+        for i in range(50): p.adapt(frame,False)
+        self.assertEqual(p.getPeriod(frame),1.)
+        p.adapt(frame,True)
+        self.assertEqual(p.getPeriod(frame),1.)
+        #Capped only above, as done for the HV status
+        p.setPolledComm(frame,1.,factors=(None,1.))
+        for i in range(50): p.adapt(frame,False)
+        self.assertEqual(p.getPeriod(frame),1.)
+        p.adapt(frame,True)
+        self.assertEqual(p.getPeriod(frame),.5)
+
+class WriteLaneTest(unittest.TestCase):
+
+    def setUp(self):
+        self.poller,self.emulator = newPoller(pipeline=8)
+        p = self.poller
+        self.status = p.packMultiGauge(1,p.GeneralComms['HV On/Off'])
+        p.setPolledComm(self.status,10.)
+        p.setPolledComm(p.packMultiGauge(1,p.GeneralComms['P Meas']),.05)
+
+    def tearDown(self):
+        self.poller.stop()
+
+    def test_future_not_running(self):
+        p = self.poller
+        future = p.submit(p.packMultiGauge(1,p.GeneralComms['HV On/Off'],'0'))
+        self.assertTrue(future.done())
+        self.assertEqual(future.result(0),p.ACK)
+        self.assertEqual(self.emulator.hv[1],0)
+
+    def test_futures(self):
+        p = self.poller
+        p.start()
+        futures = [p.submit(p.packMultiGauge(1,p.GeneralComms['HV On/Off'],'0')),
+            p.submit(p.packMultiGauge(5,p.GeneralComms['HV On/Off'],'1')),
+            p.submit(p.packMultiGauge(0,p.GeneralComms['Firmware']))]
+        self.assertEqual(futures[0].result(2.),p.ACK)
+        self.assertEqual(futures[1].result(2.),p.NACK+'3')
+        self.assertEqual(futures[2].result(2.),'>005DUAL01.0')
+        self.assertEqual(self.emulator.hv[1],0)
+
+    def test_future_timeout(self):
+        p = self.poller
+        p.start()
+        self.emulator.drop = 1.
+        future = p.submit(p.packMultiGauge(1,p.GeneralComms['HV On/Off'],'0'))
+        self.assertRaises(Exception,future.result,p.getWriteTimeout())
+
+    def test_wait_comm(self):
+        p = self.poller
+        self.emulator.hv[1] = 0
+        p.start()
+        since = time.time()
+        reply = p.waitComm(self.status,since,2.)
+        self.assertEqual(reply,'130'+'0')
+        self.assertTrue(p.lastRead[self.status]>since)
+
+    def test_wait_comm_timeout(self):
+        p = self.poller
+        #Dropped from the first burst, so no reply can arrive after since
+        self.emulator.drop = 1.
+        p.start()
+        t0 = time.time()
+        self.assertEqual(p.waitComm(self.status,None,.3),None)
+        self.assertTrue(.3<=time.time()-t0<1.)
+
+if __name__ == '__main__':
+    unittest.main()
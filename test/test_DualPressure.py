@@ -0,0 +1,111 @@
+#=============================================================================
+#
+# file :        test_DualPressure.py
+#
+# description : Tests of the PressureConverter calibration.
+#
+# project :    VacuumController Device Server
+#
+# $Author: srubio $
+#
+# copyleft :    Cells / Alba Synchrotron
+#               Bellaterra
+#               Spain
+#
+############################################################################
+#
+# This file is part of Tango-ds.
+#
+# Tango-ds is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Tango-ds is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+##########################################################################
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DualPressure import PressureConverter,normalizePump
+
+class PressureConverterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.converter = PressureConverter(weight=.5)
+
+    def test_nominal(self):
+        c = self.converter
+        #I = K*S*P**n + I0
+        K,S,n,I0 = c.tables['150sc/tr']
+        self.assertEqual(S,150.)
+        self.assertTrue(n>1. and I0>0.)
+        self.assertAlmostEqual(c.getNominal('150 SC/Tr',K*S*1e-8**n+I0)/1e-8,1.,9)
+        #No pressure can be measured below the leakage current
+        self.assertEqual(c.getNominal('150SC/Tr',I0),0.)
+        self.assertEqual(c.getNominal('150SC/Tr',0.),0.)
+        self.assertEqual(c.getNominal('Spare',1e-6),None)
+        self.assertEqual(normalizePump(' 75-55-40 Diode/ND'),'75-55-40diode/nd')
+
+    def test_calibration(self):
+        c,pump,current = self.converter,'150SC/Tr',1e-6
+        nominal = c.getNominal(pump,current)
+        self.assertFalse(c.isCalibrated(1,pump))
+        self.assertEqual(c.getPressure(1,pump,current),nominal)
+        c.calibrate(1,pump,current,2*nominal)
+        self.assertTrue(c.isCalibrated(1,pump))
+        self.assertAlmostEqual(c.getPressure(1,pump,current)/nominal,2.,9)
+        #A single reading gives the ratio, at any current, and does not affect other channels
+        self.assertAlmostEqual(c.getPressure(1,pump,10*current)/c.getNominal(pump,10*current),2.,9)
+        self.assertEqual(c.getPressure(2,pump,current),nominal)
+
+    def test_log_average(self):
+        c,pump,current = self.converter,'150SC/Tr',1e-6
+        nominal = c.getNominal(pump,current)
+        c.calibrate(1,pump,current,2*nominal)
+        c.calibrate(1,pump,current,8*nominal)
+        #exp(.5*log(2)+.5*log(8)) = 4
+        self.assertAlmostEqual(c.getPressure(1,pump,current)/nominal,4.,9)
+        self.assertEqual(c.calibrations[1],2)
+        self.assertTrue('x4 slope 1 (2 readings)' in c.getReport(),c.getReport())
+
+    def test_log_curve(self):
+        #The controller conversion has a different slope, fitted from readings spanning several decades
+        c,pump = PressureConverter(weight=.1),'150SC/Tr'
+        K,S,n,I0 = c.tables['150sc/tr']
+        controller = lambda p: 3.*p**1.1
+        for i in range(10):
+            for p in (1e-10,1e-9,1e-8,1e-7,1e-6):
+                c.calibrate(1,pump,K*S*p**n+I0,controller(p))
+        a,b = c.getCurve(1)
+        self.assertAlmostEqual(b,1.1,1)
+        for p in (3e-10,2e-8,5e-7):
+            self.assertAlmostEqual(c.getPressure(1,pump,K*S*p**n+I0)/controller(p),1.,1)
+
+    def test_pump_changed(self):
+        c,current = self.converter,1e-6
+        c.calibrate(1,'150SC/Tr',current,3*c.getNominal('150SC/Tr',current))
+        self.assertFalse(c.isCalibrated(1,'300SC/Tr'))
+        self.assertEqual(c.getPressure(1,'300SC/Tr',current),c.getNominal('300SC/Tr',current))
+        c.calibrate(1,'300SC/Tr',current,5*c.getNominal('300SC/Tr',current))
+        self.assertAlmostEqual(c.getPressure(1,'300SC/Tr',current)/c.getNominal('300SC/Tr',current),5.,9)
+
+    def test_invalid_readings(self):
+        c = self.converter
+        c.calibrate(1,'150SC/Tr',1e-6,0.)
+        c.calibrate(1,'Spare',1e-6,1e-8)
+        c.calibrate(1,'150SC/Tr',0.,1e-8)
+        self.assertEqual(c.corrections,{})
+        self.assertEqual(c.getReport(),'Pressure from current: not calibrated')
+
+if __name__ == '__main__':
+    unittest.main()
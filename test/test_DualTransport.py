@@ -0,0 +1,99 @@
+#=============================================================================
+#
+# file :        test_DualTransport.py
+#
+# description : Tests of the direct line transports on local sockets and fifos.
+#
+# project :    VacuumController Device Server
+#
+# $Author: srubio $
+#
+# copyleft :    Cells / Alba Synchrotron
+#               Bellaterra
+#               Spain
+#
+############################################################################
+#
+# This file is part of Tango-ds.
+#
+# Tango-ds is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Tango-ds is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+##########################################################################
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+import shutil
+import socket
+import tempfile
+
+from DualTransport import FileTransport,SocketTransport
+
+class SocketTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1',0))
+        self.server.listen(1)
+        self.transport = SocketTransport(*self.server.getsockname(),timeout=1.,reconnect=0.)
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.close()
+
+    def test_connect(self):
+        t = self.transport
+        t.check()
+        client,address = self.server.accept()
+        while not t.ready(): t.wait(.01)
+        t.write('#0101\r')
+        self.assertEqual(client.recv(16),'#0101\r')
+        client.sendall('>0101\r')
+        t.wait(1.)
+        self.assertEqual(t.read(),'>0101\r')
+        client.close()
+
+    def test_refused(self):
+        #Nobody listening, the error is raised by a later call instead of blocking open()
+        port = self.server.getsockname()[1]
+        self.server.close()
+        t = SocketTransport('127.0.0.1',port,timeout=1.,reconnect=0.)
+        t0 = time.time()
+        t.check()
+        self.assertTrue(time.time()-t0<.1)
+        t.wait(.1)
+        self.assertRaises(IOError,t.write,'#0101\r')
+        self.assertEqual(t.fd,None)
+
+class FileTransportTest(unittest.TestCase):
+
+    def test_fifo(self):
+        #Whatever is written to a fifo is read back from it
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.mkfifo(os.path.join(tmpdir,'line'))
+            t = FileTransport(os.path.join(tmpdir,'line'))
+            self.assertEqual(t.read(),'')
+            t.write('>0101\r')
+            t.wait(1.)
+            self.assertEqual(t.read(),'>0101\r')
+            t.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#=============================================================================
+#
+# file :        test_MultiGauge.py
+#
+# description : Tests of MultiGaugeParser and the data format decoders.
+#
+# project :    VacuumController Device Server
+#
+# $Author: srubio $
+#
+# copyleft :    Cells / Alba Synchrotron
+#               Bellaterra
+#               Spain
+#
+############################################################################
+#
+# This file is part of Tango-ds.
+#
+# Tango-ds is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Tango-ds is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+##########################################################################
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MultiGauge import MultiGaugeParser,MultiGaugeProtocol
+
+class MultiGaugeParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = MultiGaugeParser()
+
+    def test_single_frame(self):
+        self.assertEqual(self.parser.feed('>1025.0E-09\r'),[(1,2,'5.0E-09')])
+
+    def test_split_frame(self):
+        self.assertEqual(self.parser.feed('>10'),[])
+        self.assertEqual(self.parser.feed('25.0E'),[])
+        self.assertEqual(self.parser.feed('-09\r'),[(1,2,'5.0E-09')])
+        self.assertEqual(self.parser.discarded,0)
+
+    def test_concatenated_frames(self):
+        records = self.parser.feed('>1025.0E-09\r>20705000\r\x06>005DUAL01.0\r')
+        self.assertEqual(records,[(1,2,'5.0E-09'),(2,7,'05000'),(None,MultiGaugeProtocol.ACK,''),(0,5,'DUAL01.0')])
+
+    def test_garbage(self):
+        records = self.parser.feed('xyz\r>1x2bad\r>130')
+        self.assertEqual(records,[])
+        self.assertEqual(self.parser.discarded,len('xyz')+len('>1x2bad\r'))
+        #The incomplete frame is kept until its terminator arrives
+        self.assertEqual(self.parser.feed('1\r'),[(1,30,'1')])
+
+    def test_nack(self):
+        self.assertEqual(self.parser.feed('!'),[])
+        self.assertEqual(self.parser.feed('3>1301\r'),[(None,MultiGaugeProtocol.NACK,'3'),(1,30,'1')])
+
+    def test_maxsize(self):
+        parser = MultiGaugeParser(maxsize=16)
+        self.assertEqual(parser.feed('>'+'1'*32),[])
+        self.assertEqual(len(parser.buffer),0)
+        self.assertEqual(parser.feed('>1301\r'),[(1,30,'1')])
+
+class DecodersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol = MultiGaugeProtocol()
+
+    def test_status(self):
+        self.assertEqual(self.protocol.decodeStatus('1'),1)
+        self.assertEqual(self.protocol.decodeStatus('-3'),-3)
+        for data in ('','12','-','a'):
+            self.assertRaises(ValueError,self.protocol.decodeStatus,data)
+
+    def test_integer(self):
+        self.assertEqual(self.protocol.decodeInteger('07000'),7000)
+        #Shorter and signed values (e.g. Error Status) were accepted by the old regular expressions
+        self.assertEqual(self.protocol.decodeInteger('7000'),7000)
+        self.assertEqual(self.protocol.decodeInteger('-7000'),-7000)
+        for data in ('','-','0700a',' 7000','+7000'):
+            self.assertRaises(ValueError,self.protocol.decodeInteger,data)
+
+    def test_bitfield(self):
+        self.assertEqual(self.protocol.decodeBitField('00000101'),5)
+        for data in ('0101','00000102'):
+            self.assertRaises(ValueError,self.protocol.decodeBitField,data)
+
+    def test_exponential(self):
+        self.assertEqual(self.protocol.decodeExponential('5.0E-09'),5e-9)
+        for data in ('5.0e-09','5.0E-9','5.0E+0a','50E-090'):
+            self.assertRaises(ValueError,self.protocol.decodeExponential,data)
+
+    def test_string(self):
+        self.assertEqual(self.protocol.decodeString('DUAL01.0'),'DUAL01.0')
+        for data in ('','DUAL\x01'):
+            self.assertRaises(ValueError,self.protocol.decodeString,data)
+
+    def test_decoder_of_frame(self):
+        p = self.protocol
+        self.assertEqual(p.getDecoder(p.packMultiGauge(1,p.GeneralComms['P Meas'])),p.decodeExponential)
+        self.assertEqual(p.getDecoder(p.GeneralComms['HV On/Off']),p.decodeStatus)
+        self.assertEqual(p.getDecoder(p.GeneralComms['Firmware']),p.decodeString)
+
+    def test_pack_answer(self):
+        self.assertEqual(self.protocol.packAnswer(1,2,'5.0E-09'),'>1025.0E-09')
+        self.assertEqual(self.protocol.packAnswer(None,MultiGaugeProtocol.NACK,'3'),'!3')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,256 @@
+#=============================================================================
+#
+# file :        test_WriteSession.py
+#
+# description : Tests of VarianDUAL WriteSession on a DualPoller running on
+#            DualEmulatorTransport.
+#
+# project :    VacuumController Device Server
+#
+# $Author: srubio $
+#
+# copyleft :    Cells / Alba Synchrotron
+#               Bellaterra
+#               Spain
+#
+############################################################################
+#
+# This file is part of Tango-ds.
+#
+# Tango-ds is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Tango-ds is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+##########################################################################
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+import threading
+
+from MultiGauge import MultiGaugeProtocol
+from DualEmulator import DualEmulator,DualEmulatorTransport
+
+try:
+    import VarianDUAL
+except ImportError:
+    #PyTango, fandango and VacuumController are required to import the device
+    VarianDUAL = None
+
+class FakeMonitor(object):
+    """ Tango device monitor, reentrant for the thread that holds it """
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.owner,self.count = None,0
+
+    def acquire(self):
+        if self.owner is not threading.currentThread():
+            self.mutex.acquire()
+            self.owner = threading.currentThread()
+        self.count += 1
+
+    def release(self):
+        self.count -= 1
+        if not self.count:
+            self.owner = None
+            self.mutex.release()
+
+class FakeAllowThreads(object):
+    """ PyTango.AutoTangoAllowThreads on a FakeDevice.monitor """
+    def __init__(self, device):
+        self.monitor,self.count = device.monitor,0
+        while self.monitor.owner is threading.currentThread():
+            self.monitor.release()
+            self.count += 1
+
+    def __enter__(self): return self
+
+    def __exit__(self, etype, value, tb):
+        for i in range(self.count): self.monitor.acquire()
+        self.count = 0
+
+class FakeDevice(MultiGaugeProtocol):
+    """ The attributes of VarianDUAL used by WriteSession, without Tango """
+    def __init__(self):
+        from DualPoller import DualPoller
+        self.emulator = DualEmulator(latency=.002,baud=0,seed=0)
+        self.emulator.mode = 2
+        self.SVD = DualPoller('DualEmulator',period=.05,wait=.05,log='ERROR',
+            transport=DualEmulatorTransport(self.emulator))
+        self.HVComms = {}
+        for c in (1,2):
+            self.HVComms['HV%d On'%c] = self.packMultiGauge(c,self.GeneralComms['HV On/Off'],'1')
+            self.HVComms['HV%dStatus'%c] = self.packMultiGauge(c,self.GeneralComms['HV On/Off'])
+            self.SVD.setPolledComm(self.HVComms['HV%dStatus'%c],10.)
+        self.monitor = FakeMonitor()
+        self.initWriteSessions()
+        self.StartSequence = []
+        self.ForceLocal = 'false'
+        self.last_serial_change = 0
+        self.modes = []
+        self.logs = []
+
+    if VarianDUAL is not None:
+        initWriteSessions = VarianDUAL.VarianDUAL.initWriteSessions.im_func
+        getSession = VarianDUAL.VarianDUAL.getSession.im_func
+        writeSession = VarianDUAL.VarianDUAL.writeSession.im_func
+        WarmUp = VarianDUAL.VarianDUAL.WarmUp.im_func
+
+    def SetMode(self, mode):
+        self.modes.append((mode,threading.currentThread().getName()))
+
+    def OnHV1(self): self.writeSession().write('HV1 On')
+    def OnHV2(self): self.writeSession().write('HV2 On')
+
+    def info(self, msg): self.logs.append(msg)
+    warning = debug = info
+
+@unittest.skipIf(VarianDUAL is None,'VarianDUAL cannot be imported')
+class WriteSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.allow = VarianDUAL.PyTango.__dict__.get('AutoTangoAllowThreads')
+        VarianDUAL.PyTango.AutoTangoAllowThreads = FakeAllowThreads
+        self.device = FakeDevice()
+        self.device.SVD.start()
+
+    def tearDown(self):
+        self.device.SVD.stop()
+        if self.allow is None: del VarianDUAL.PyTango.AutoTangoAllowThreads
+        else: VarianDUAL.PyTango.AutoTangoAllowThreads = self.allow
+
+    def test_confirmed(self):
+        d = self.device
+        with d.writeSession() as session:
+            session.write('HV1 On')
+            session.write('HV2 On')
+        self.assertEqual(session.failed,[])
+        self.assertEqual(d.emulator.hv,{1:1,2:1})
+        self.assertEqual(d.modes,[('serial',threading.currentThread().getName())])
+        self.assertEqual(d.getSession(),None)
+
+    def test_nested(self):
+        d = self.device
+        with d.writeSession() as outer:
+            with d.writeSession() as inner:
+                self.assertTrue(inner is outer)
+                inner.write('HV1 On')
+            #Nothing is confirmed until the outermost session ends
+            self.assertEqual(outer.depth,1)
+            self.assertEqual(len(outer.writes),1)
+            outer.write('HV2 On')
+        self.assertEqual(outer.depth,0)
+        self.assertEqual(outer.failed,[])
+        self.assertEqual(len(d.modes),1)
+
+    def test_local(self):
+        d = self.device
+        d.ForceLocal = 'true'
+        with d.writeSession() as session:
+            session.write('HV1 On')
+        self.assertEqual([m for m,t in d.modes],['serial','local'])
+
+    def test_failed(self):
+        d = self.device
+        d.emulator.hv[2] = -3
+        try:
+            with d.writeSession() as session:
+                session.write('HV1 On')
+                session.write('HV2 On')
+            self.fail('WriteNotConfirmed not raised')
+        except Exception,e:
+            self.assertTrue('WriteNotConfirmed' in str(e),str(e))
+        self.assertEqual([name for name,error in session.failed],['HV2 On'])
+        self.assertTrue('ProtocolError5' in session.failed[0][1])
+        self.assertEqual(d.emulator.hv[1],1)
+        self.assertEqual(d.getSession(),None)
+
+    def test_exception_inside(self):
+        d = self.device
+        try:
+            with d.writeSession() as session:
+                raise KeyError('HV3 On')
+        except KeyError:
+            pass
+        self.assertEqual(d.getSession(),None)
+        self.assertTrue(d.lock.acquire(False))
+        d.lock.release()
+
+    def test_other_thread(self):
+        #A session of other thread is not joined, it waits for the first one to end
+        d,events = self.device,[]
+        def other():
+            session = d.writeSession()
+            events.append(('new',session is not outer))
+            with session: events.append(('entered',time.time()))
+        with d.writeSession() as outer:
+            thread = threading.Thread(target=other)
+            thread.start()
+            time.sleep(.2)
+            events.append(('ended',time.time()))
+        thread.join(2.)
+        self.assertEqual([e[0] for e in events],['new','ended','entered'])
+        self.assertTrue(events[0][1])
+
+    def test_warmup(self):
+        #The lock is created by the device itself, not by the test
+        d = self.device
+        d.StartSequence = ['ON1','ON2 # both channels']
+        self.assertEqual(d.WarmUp(),'ON1\nON2')
+        self.assertEqual(d.emulator.hv,{1:1,2:1})
+        self.assertEqual([m for m,t in d.modes],['serial'])
+        self.assertEqual(d.getSession(),None)
+
+    def test_warmup_nothing_to_write(self):
+        d = self.device
+        d.StartSequence = ['#ON1','UNKNOWN']
+        d.WarmUp()
+        self.assertEqual(d.modes,[])
+        self.assertEqual(d.emulator.hv,{1:0,2:0})
+
+    def test_read_latency_while_writing(self):
+        #Attribute reads of other clients while a write command waits for the controller
+        d,started,results = self.device,threading.Event(),{}
+        @VarianDUAL.write_locked
+        def OnHV1(device):
+            with device.writeSession() as session:
+                session.write('HV1 On')
+        def command():
+            #Tango holds the monitor while executing a command
+            d.monitor.acquire()
+            started.set()
+            t0 = time.time()
+            OnHV1(d)
+            results['write'] = time.time()-t0
+            results['owner'] = d.monitor.owner is threading.currentThread()
+            d.monitor.release()
+        d.emulator.latency,d.SVD.wait = .1,.5
+        thread = threading.Thread(target=command)
+        thread.start()
+        started.wait(1.)
+        time.sleep(.05)
+        t0 = time.time()
+        d.monitor.acquire()
+        results['read'] = time.time()-t0
+        d.monitor.release()
+        thread.join(3.)
+        self.assertEqual(d.emulator.hv[1],1)
+        self.assertTrue(results['write']>=.2,results)
+        self.assertTrue(results['read']<.05,results)
+        #The command gets the monitor back before returning to Tango
+        self.assertTrue(results['owner'])
+
+if __name__ == '__main__':
+    unittest.main()